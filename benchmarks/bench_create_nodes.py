@@ -0,0 +1,46 @@
+"""
+Measures node creation one by one and in bulk, then commit of them.
+
+    python benchmarks/bench_create_nodes.py [count]
+"""
+if __name__ == '__main__' and __package__ is None:
+    import sys, os
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    del sys, os
+
+import sys
+import time
+
+from yggdrasil.node import Runtime
+
+def measure(name, func, count):
+    start = time.perf_counter()
+    func(count)
+    elapsed = time.perf_counter() - start
+    print("{:<32} {:>12,.0f} nodes/sec {:>8.2f}s".format(
+        name, count / elapsed, elapsed))
+
+def main(count):
+    def single(count):
+        branch = Runtime().create_branch()
+        wc = branch.wc
+        for i in range(count):
+            node = wc.create_node()
+            node.value = i
+            node.name = "node"
+        branch.commit()
+    def bulk(count):
+        branch = Runtime().create_branch()
+        branch.wc.create_nodes(
+            {"value": i, "name": "node"} for i in range(count))
+        branch.commit()
+    def empty(count):
+        branch = Runtime().create_branch()
+        branch.wc.create_nodes(count)
+
+    measure("create_node", single, count)
+    measure("create_nodes", bulk, count)
+    measure("create_nodes without commit", empty, count)
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
@@ -0,0 +1,49 @@
+"""
+Measures memory held by node payloads as dictionaries and frozen after
+commit, and memory of whole runtime per committed node.
+
+    python benchmarks/bench_node_memory.py [count]
+"""
+if __name__ == '__main__' and __package__ is None:
+    import sys, os
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    del sys, os
+
+import gc
+import sys
+import tracemalloc
+
+from yggdrasil.node import Runtime
+from yggdrasil.utils import FrozenDict
+
+def traced(name, func, count):
+    gc.collect()
+    tracemalloc.start()
+    start = tracemalloc.get_traced_memory()[0]
+    result = func(count)
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0] - start
+    tracemalloc.stop()
+    print("{:<32} {:>8.1f} bytes/node".format(name, size / count))
+    return result
+
+def main(count):
+    contents = [{"name": "node", "value": i, "required": i % 2 == 0}
+        for i in range(count)]
+    traced("dict payloads", lambda count: [dict(c) for c in contents], count)
+    traced("frozen payloads", lambda count: [FrozenDict(c) for c in contents], count)
+
+    def created(count):
+        runtime = Runtime()
+        branch = runtime.create_branch()
+        branch.wc.create_nodes(contents)
+        return runtime, branch
+    def committed(count):
+        runtime, branch = created(count)
+        branch.commit()
+        return runtime
+    traced("runtime before commit", created, count)
+    traced("runtime after commit", committed, count)
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
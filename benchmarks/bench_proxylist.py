@@ -0,0 +1,65 @@
+"""
+Measures random access and editing of tracked lists.
+
+    python benchmarks/bench_proxylist.py [size]
+"""
+if __name__ == '__main__' and __package__ is None:
+    import sys, os
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    del sys, os
+
+import random
+import sys
+import time
+
+from yggdrasil.utils import ProxyList
+from yggdrasil.merge import merge_lists
+
+def measure(name, func, count):
+    start = time.perf_counter()
+    func(count)
+    elapsed = time.perf_counter() - start
+    print("{:<32} {:>12,.0f} ops/sec".format(name, count / elapsed))
+
+def main(size):
+    rng = random.Random(0)
+    tracked = ProxyList(range(size))
+
+    def read(count):
+        for i in range(count):
+            tracked[rng.randrange(size)]
+    def write(count):
+        for i in range(count):
+            tracked[rng.randrange(size)] = i
+    def insert(count):
+        for i in range(count):
+            tracked.insert(rng.randrange(len(tracked) + 1), i)
+    def delete(count):
+        for i in range(count):
+            del tracked[rng.randrange(len(tracked))]
+
+    def extend(count):
+        for i in range(count // 1000):
+            tracked.extend(range(1000))
+    def slices(count):
+        for i in range(count // 100):
+            start = rng.randrange(len(tracked) - 100)
+            tracked[start:start + 100] = range(50)
+
+    measure("random read", read, size)
+    measure("random write", write, size)
+    measure("random insert", insert, size)
+    measure("random delete", delete, size)
+    measure("extend by 1000", extend, size)
+    measure("replace slice of 100", slices, size)
+
+    base = tuple(range(size))
+    mine = base[:10] + ("M",) + base[10:]
+    theirs = base[:size // 2] + base[size // 2 + 100:] + ("T",)
+    def merge(count):
+        for i in range(count):
+            merge_lists(base, mine, theirs, (), [])
+    measure("merge lists, far edits", merge, 10)
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 50000)
@@ -0,0 +1,71 @@
+"""
+Measures latency of snapshot reads with and without concurrent commits.
+
+    python benchmarks/bench_snapshot.py [nodes]
+"""
+if __name__ == '__main__' and __package__ is None:
+    import sys, os
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    del sys, os
+
+import random
+import sys
+import threading
+import time
+
+from yggdrasil.node import Runtime, NodeId
+
+def read_latencies(runtime, branch_id, refs, count):
+    rng = random.Random(0)
+    latencies = []
+    for i in range(count):
+        start = time.perf_counter()
+        with runtime.snapshot() as snapshot:
+            rid = snapshot.get_latest_revision_id(branch_id)
+            revision = snapshot.get_revision(rid)
+            ref = rng.choice(refs)
+            node = snapshot.get_node(NodeId.intern(ref, revision.search(ref).id))
+            dict(node.content)
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    return latencies
+
+def report(name, latencies):
+    def percentile(p):
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1e6
+    print("{:<24} p50 {:>8.1f}us  p99 {:>8.1f}us".format(
+        name, percentile(0.5), percentile(0.99)))
+
+def main(size):
+    runtime = Runtime()
+    branch = runtime.create_branch()
+    refs = []
+    for i in range(size):
+        node = branch.wc.create_node()
+        node.value = i
+        refs.append(node.ref)
+    branch.commit()
+
+    report("idle", read_latencies(runtime, branch.id, refs, 20000))
+
+    stop = threading.Event()
+    commits = [0]
+    def writer():
+        rng = random.Random(1)
+        while not stop.is_set():
+            for i in range(10):
+                branch.wc.get_node(rng.choice(refs)).value = i
+            branch.commit()
+            commits[0] += 1
+    thread = threading.Thread(target=writer)
+    thread.start()
+    try:
+        latencies = read_latencies(runtime, branch.id, refs, 20000)
+    finally:
+        stop.set()
+        thread.join()
+    report("under commits", latencies)
+    print("{} commits published meanwhile".format(commits[0]))
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
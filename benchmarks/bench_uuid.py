@@ -0,0 +1,56 @@
+"""
+Measures throughput of uid generation used by node and branch creation.
+
+    python benchmarks/bench_uuid.py [count]
+"""
+if __name__ == '__main__' and __package__ is None:
+    import sys, os
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    del sys, os
+
+import random
+import sys
+import time
+
+from yggdrasil.node import (
+    ALPHABET,
+    NodeRef,
+    UUIDGenerator,
+    pack_uid,
+    seed_uuids,
+    )
+
+def legacy(length):
+    "Per character generation which was used before batching"
+    return ''.join(random.choice(ALPHABET) for i in range(length))
+
+def measure(name, func, count):
+    start = time.perf_counter()
+    func(count)
+    elapsed = time.perf_counter() - start
+    print("{:<32} {:>12,.0f} ids/sec".format(name, count / elapsed))
+
+def main(count):
+    measure("legacy string", 
+        lambda n: [legacy(32) for i in range(n)], count)
+    measure("legacy string + pack", 
+        lambda n: [pack_uid(legacy(32), 32) for i in range(n)], count)
+
+    generator = UUIDGenerator(32)
+    measure("batched", 
+        lambda n: [generator() for i in range(n)], count)
+    measure("batched take", generator.take, count)
+
+    generator = UUIDGenerator(32, seed=0)
+    measure("batched seeded", 
+        lambda n: [generator() for i in range(n)], count)
+
+    measure("NodeRef()", 
+        lambda n: [NodeRef() for i in range(n)], count)
+    seed_uuids(0)
+    measure("NodeRef() seeded", 
+        lambda n: [NodeRef() for i in range(n)], count)
+    seed_uuids(None)
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200000)
@@ -0,0 +1,72 @@
+"""
+Measures durable commits through write-ahead log under concurrent load,
+with and without group commit window.
+
+    python benchmarks/bench_wal.py [commits per thread]
+"""
+if __name__ == '__main__' and __package__ is None:
+    import sys, os
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    del sys, os
+
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+from yggdrasil.node import Runtime
+from yggdrasil.segments import SegmentStorage
+from yggdrasil.wal import WriteAheadLog, LoggedStorage
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+def measure(name, threads, window, count):
+    path = tempfile.mkdtemp()
+    try:
+        log = WriteAheadLog(os.path.join(path, "wal.log"), window=window)
+        storage = LoggedStorage(SegmentStorage(os.path.join(path, "segments")), log)
+        runtime = Runtime(storage=storage)
+        branches = [runtime.create_branch() for i in range(threads)]
+        before = log.stats
+        latencies = []
+        def commit(branch):
+            own = []
+            for i in range(count):
+                branch.wc.create_node().value = i
+                start = time.perf_counter()
+                branch.commit()
+                own.append(time.perf_counter() - start)
+            latencies.extend(own)
+        workers = [threading.Thread(target=commit, args=(branch,))
+            for branch in branches]
+        start = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - start
+        fsyncs = log.stats["fsyncs"] - before["fsyncs"]
+        print("{:<28} {:>8,.0f} commits/sec  p50 {:>7.2f}ms  p99 {:>7.2f}ms"
+            "  {:>5.1f} commits/fsync".format(
+            name, len(latencies) / elapsed,
+            percentile(latencies, 0.5) * 1000,
+            percentile(latencies, 0.99) * 1000,
+            len(latencies) / fsyncs if fsyncs else 0.0))
+        log.close()
+        storage._storage.close()
+    finally:
+        shutil.rmtree(path)
+
+def main(count):
+    measure("1 thread", 1, 0.0, count)
+    measure("8 threads", 8, 0.0, count)
+    measure("8 threads, 1ms window", 8, 0.001, count)
+    measure("8 threads, 5ms window", 8, 0.005, count)
+    measure("32 threads, 1ms window", 32, 0.001, count)
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200)
@@ -0,0 +1,224 @@
+"""
+Ancestry index over revisions graph.
+
+Every revision gets generation number (longest path to root) and
+position on its first-parent chain with a skew-binary jump pointer, so
+any first-parent ancestor is reachable in O(log n) steps. Nearest merge
+revision on the chain is remembered too, so linear parts of history are
+never walked one revision at a time.
+"""
+
+import heapq
+
+class _Entry(object):
+    __slots__ = "id", "parents", "generation", "depth", "parent", "jump", "merge"
+
+    def __init__(self, revision_id, parents):
+        self.id = revision_id
+        self.parents = parents
+        self.generation = 1 + max((parent.generation for parent in parents),
+            default=-1)
+        if parents:
+            parent = parents[0]
+            self.parent = parent
+            self.depth = parent.depth + 1
+            jump = parent.jump
+            if parent.depth - jump.depth == jump.depth - jump.jump.depth:
+                self.jump = jump.jump
+            else:
+                self.jump = parent
+            self.merge = self if len(parents) > 1 else parent.merge
+        else:
+            self.parent = None
+            self.depth = 0
+            self.jump = self
+            self.merge = None
+
+    def ancestor_at(self, depth):
+        "Returns first-parent ancestor at given depth"
+        entry = self
+        while entry.depth > depth:
+            if entry.jump.depth >= depth:
+                entry = entry.jump
+            else:
+                entry = entry.parent
+        return entry
+
+    def merges(self, generation):
+        """
+        Yields merge revisions of first-parent chain with generation
+        greater than given one.
+        """
+        merge = self.merge
+        while merge is not None and merge.generation > generation:
+            yield merge
+            merge = merge.parent.merge
+
+def _tree_lca(first, second):
+    "Common ancestor by first-parent chains only"
+    if first.depth > second.depth:
+        first = first.ancestor_at(second.depth)
+    else:
+        second = second.ancestor_at(first.depth)
+    while first is not second:
+        if first.parent is None:
+            return None
+        if first.jump is not second.jump:
+            first, second = first.jump, second.jump
+        else:
+            first, second = first.parent, second.parent
+    return first
+
+_FIRST = 1
+_SECOND = 2
+_BOTH = _FIRST | _SECOND
+
+class AncestryIndex(object):
+    def __init__(self):
+        self._entries = {} # RevisionId -> _Entry
+
+    def add(self, revision_id, parents=()):
+        """
+        Indexes revision. Revision without descendants (working copy)
+        may be indexed again after its parents changed.
+        """
+        entries = self._entries
+        self._entries[revision_id] = _Entry(revision_id,
+            tuple(entries[parent] for parent in parents))
+
+    def discard(self, revision_id):
+        self._entries.pop(revision_id, None)
+
+    def parents(self, revision_id):
+        "Returns ids of parents revision was indexed with"
+        return tuple(parent.id for parent in self._entries[revision_id].parents)
+
+    def __contains__(self, revision_id):
+        return revision_id in self._entries
+
+    def generation(self, revision_id):
+        return self._entries[revision_id].generation
+
+    def _is_ancestor(self, ancestor, entry):
+        if ancestor.generation > entry.generation:
+            return False
+        stack = [entry]
+        seen = set()
+        while stack:
+            entry = stack.pop()
+            if entry.id in seen:
+                continue
+            seen.add(entry.id)
+            if ancestor.depth <= entry.depth and \
+                    entry.ancestor_at(ancestor.depth) is ancestor:
+                return True
+            for merge in entry.merges(ancestor.generation):
+                for parent in merge.parents[1:]:
+                    if parent.generation >= ancestor.generation:
+                        stack.append(parent)
+        return False
+
+    def is_ancestor(self, ancestor_id, revision_id):
+        "Whether first revision is reachable from second one"
+        return self._is_ancestor(
+            self._entries[ancestor_id], self._entries[revision_id])
+
+    def _paint(self, first, second, floor=-1, stale=True):
+        """
+        Walks both histories from the newest revisions in generation
+        order. Yields pairs of revision and flags telling from which
+        side it is reachable. Flags are final when revision is yielded.
+        With `stale` walk stops once only common revisions are left.
+        """
+        flags = {first.id: _FIRST}
+        flags[second.id] = flags.get(second.id, 0) | _SECOND
+        queue = []
+        counter = 0
+        for entry in (first, second) if first is not second else (first,):
+            heapq.heappush(queue, (-entry.generation, counter, entry))
+            counter += 1
+        pending = sum(1 for entry in (first, second) if flags[entry.id] != _BOTH)
+        while queue and (pending or not stale):
+            generation, _, entry = heapq.heappop(queue)
+            flag = flags[entry.id]
+            if flag != _BOTH:
+                pending -= 1
+            yield entry, flag
+            for parent in entry.parents:
+                if parent.generation < floor:
+                    continue
+                old = flags.get(parent.id)
+                if old is None:
+                    flags[parent.id] = flag
+                    heapq.heappush(queue, (-parent.generation, counter, parent))
+                    counter += 1
+                    if flag != _BOTH:
+                        pending += 1
+                elif old | flag != old:
+                    flags[parent.id] = old | flag
+                    if old != _BOTH:
+                        pending -= 1
+
+    def merge_base(self, first_id, second_id):
+        "Returns common ancestor with highest generation or None"
+        first = self._entries[first_id]
+        second = self._entries[second_id]
+        if self._is_ancestor(first, second):
+            return first_id
+        if self._is_ancestor(second, first):
+            return second_id
+        tree = _tree_lca(first, second)
+        floor = -1 if tree is None else tree.generation
+        first_linear = next(first.merges(floor), None) is None
+        second_linear = next(second.merges(floor), None) is None
+        if first_linear and second_linear:
+            # nothing but first-parent chains above common one
+            return None if tree is None else tree.id
+        if first_linear or second_linear:
+            linear, other = (first, second) if first_linear else (second, first)
+            entry = self._highest_common(linear, other, tree)
+            return None if entry is None else entry.id
+        for entry, flag in self._paint(first, second, floor, stale=False):
+            if flag == _BOTH:
+                return entry.id
+        return None if tree is None else tree.id
+
+    def _highest_common(self, linear, other, tree):
+        """
+        Ancestors of `other` on linear chain above `tree` are all below
+        some revision of it, which is found by binary search over depth.
+        """
+        low = -1 if tree is None else tree.depth # known common or none
+        high = linear.depth # known not to be ancestor of other
+        while high - low > 1:
+            middle = (low + high) // 2
+            if self._is_ancestor(linear.ancestor_at(middle), other):
+                low = middle
+            else:
+                high = middle
+        if low < 0:
+            return None
+        return linear.ancestor_at(low)
+
+    def ahead_behind(self, first_id, second_id):
+        """
+        Returns pair of counts of revisions reachable only from first
+        and only from second revision.
+        """
+        first = self._entries[first_id]
+        second = self._entries[second_id]
+        for newer, older, swap in ((first, second, False), (second, first, True)):
+            # linear history between them is measured by depth only
+            if newer.depth >= older.depth and \
+                    newer.ancestor_at(older.depth) is older and \
+                    (newer.merge is None or newer.merge.depth <= older.depth):
+                distance = newer.depth - older.depth
+                return (0, distance) if swap else (distance, 0)
+        ahead = 0
+        behind = 0
+        for entry, flag in self._paint(first, second):
+            if flag == _FIRST:
+                ahead += 1
+            elif flag == _SECOND:
+                behind += 1
+        return ahead, behind
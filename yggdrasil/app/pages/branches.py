@@ -10,7 +10,8 @@ class Branches(Page):
         self.runtime = runtime
 
     def on_all_branches(self, request): 
-        branches = list(self.runtime.get_branches())
+        with self.runtime.snapshot() as snapshot:
+            branches = list(snapshot.get_branches())
 
         result = Record()
         result.branches = branches
@@ -18,22 +19,27 @@ class Branches(Page):
         return result
 
     def on_branch_by_id(self, request, bid):
-        branch = self.runtime.get_branch(BranchId.from_string(bid))
+        with self.runtime.snapshot() as snapshot:
+            branch = snapshot.get_branch(BranchId.from_string(bid))
         if branch is None:
             raise NotFound()
 
         result = Record()  
         result.bid = branch.id
         result.revision = branch.revision
-        result.wc = branch.wc.id
+        result.wc = branch.wc
+        result.head = branch.head
 
         return result
 
     def on_all_branch_revisions(self, request, bid):
-        branch = self.runtime.get_branch(BranchId.from_string(bid))
-        if branch is None:
-            raise NotFound()
-        revisions = list(self.runtime.get_revisions(branch.id))
+        start = request.args.get("start", None, type=int)
+        stop = request.args.get("stop", None, type=int)
+        with self.runtime.snapshot() as snapshot:
+            branch = snapshot.get_branch(BranchId.from_string(bid))
+            if branch is None:
+                raise NotFound()
+            revisions = list(snapshot.get_revisions(branch.id, start, stop))
 
         result = Record()
         result.revisions = revisions
@@ -60,8 +66,10 @@ class BranchesRefs(Branches):
             "branches.all_branches")
         refs.revisions = self.build_url(request,
             "branches.all_branch_revisions", bid=bid)
-        refs.wc = self.build_url(request,
-            "revisions.revision_by_id", rid=result.wc)
+        # working copy is not visible to readers, finished head is
+        if result.head is not None:
+            refs.head = self.build_url(request,
+                "revisions.revision_by_id", rid=result.head)
 
         return result
 
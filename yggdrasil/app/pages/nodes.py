@@ -12,7 +12,8 @@ class Nodes(Page):
 
     def on_by_uid(self, request, uid):
         uid = NodeId.from_string(uid)
-        node = self.runtime.get_node(uid)
+        with self.runtime.snapshot() as snapshot:
+            node = snapshot.get_node(uid)
         if node is None:
             raise NotFound()
 
@@ -47,7 +48,8 @@ class NodesRefs(Nodes):
         result = super().on_by_uid(request, uid)
 
         uid = NodeId.from_string(uid)
-        revision = self.runtime.get_revision(uid.revision)
+        with self.runtime.snapshot() as snapshot:
+            revision = snapshot.get_revision(uid.revision)
 
         result.refs = refs = Record()
         for name, value in result.data.items():
@@ -15,7 +15,8 @@ class Revisions(Page):
 
     def on_revision_by_id(self, request, rid): 
         rid = RevisionId.from_string(rid)
-        revision = self.runtime.get_revision(rid)
+        with self.runtime.snapshot() as snapshot:
+            revision = snapshot.get_revision(rid)
         if revision is None:
             raise NotFound()
 
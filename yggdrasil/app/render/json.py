@@ -7,10 +7,11 @@ from yggdrasil.utils import (
     ReadOnlySet,
     ReadOnlyDict,
     )
+from yggdrasil.node import Identifier
 
 class APIEncoder(libjson.JSONEncoder):
     def default(self, obj):
-        if isinstance(obj, UserString):
+        if isinstance(obj, (UserString, Identifier)):
             return str(obj)
         elif isinstance(obj, ReadOnlySet):
             return tuple(obj.__items__)
@@ -0,0 +1,103 @@
+"""
+Content addressed storage of node payloads.
+
+Finished node versions never change, so versions with equal content
+can share single attributes dictionary. Payloads are keyed by content
+digest, every distinct payload is kept once.
+"""
+
+import collections
+import sys
+import threading
+
+def _sizeof(value, seen):
+    "Rough deep size of payload in bytes"
+    if id(value) in seen:
+        return 0
+    seen.add(id(value))
+    size = sys.getsizeof(value)
+    if isinstance(value, (str, bytes)):
+        return size
+    if isinstance(value, collections.Mapping):
+        for key, item in value.items():
+            size += _sizeof(key, seen) + _sizeof(item, seen)
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        for item in value:
+            size += _sizeof(item, seen)
+    return size
+
+class BlobStore(object):
+    """
+    Maps content digests to shared payload dictionaries. Payload given
+    to `store` must not be changed after that. Readers faulting nodes
+    in store and release concurrently with commits, so counts are kept
+    under lock.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._blobs = {} # digest -> payload
+        self._sizes = {} # digest -> size of payload in bytes, made by `stats`
+        self._references = collections.Counter() # digest -> count
+        self.collisions = 0
+
+    def store(self, digest, payload):
+        """
+        Returns shared payload equal to given one, which is stored if
+        there was no such payload yet.
+        """
+        with self._lock:
+            blob = self._blobs.get(digest)
+            if blob is None:
+                self._blobs[digest] = payload
+                blob = payload
+            elif blob is not payload and blob != payload:
+                # different contents with equal digests are kept apart
+                self.collisions += 1
+                return payload
+            self._references[digest] += 1
+            return blob
+
+    def release(self, digest, blob):
+        """
+        Drops reference taken by `store` which returned `blob`. Payload
+        is forgotten with its last reference.
+        """
+        with self._lock:
+            if self._blobs.get(digest) is not blob:
+                return
+            self._references[digest] -= 1
+            if self._references[digest] <= 0:
+                del self._references[digest]
+                del self._blobs[digest]
+                self._sizes.pop(digest, None)
+
+    def get(self, digest, default=None):
+        return self._blobs.get(digest, default)
+
+    def __contains__(self, digest):
+        return digest in self._blobs
+
+    def __len__(self):
+        return len(self._blobs)
+
+    def _size(self, digest):
+        size = self._sizes.get(digest)
+        if size is None:
+            size = self._sizes[digest] = _sizeof(self._blobs[digest], set())
+        return size
+
+    @property
+    def stats(self):
+        with self._lock:
+            references = sum(self._references.values())
+            stored = sum(map(self._size, self._blobs))
+            saved = sum(self._size(digest) * (count - 1)
+                for digest, count in self._references.items())
+            return dict(
+                blobs=len(self._blobs),
+                references=references,
+                dedup_ratio=references / len(self._blobs) if self._blobs else 1.0,
+                bytes_stored=stored,
+                bytes_saved=saved,
+                collisions=self.collisions,
+                )
@@ -0,0 +1,252 @@
+"""
+Composable change records of mappings and sets.
+
+Delta describes transition of a container from one state to another.
+Deltas of successive transitions are composed without touching the
+containers, so a chain of k deltas is squashed in O(total changes)
+instead of replaying every delta over the whole container.
+"""
+
+from .utils import undefined
+
+class DictDelta(object):
+    """
+    Changes of mapping as `key -> (old, new)` pairs, `undefined` stands
+    for absent value.
+    """
+    __slots__ = "_changes",
+
+    def __init__(self, changes=None):
+        self._changes = {} if changes is None else dict(changes)
+
+    @classmethod
+    def from_proxy(cls, proxy):
+        "Takes changes recorded by ProxyDict or OverlayDict"
+        changes = {}
+        for key in proxy.added:
+            changes[key] = undefined, proxy[key]
+        for key, old in proxy.changed.items():
+            new = proxy[key]
+            if not (old is new or old == new):
+                changes[key] = old, new
+        for key, old in proxy.removed.items():
+            changes[key] = old, undefined
+        return cls._make(changes)
+
+    @classmethod
+    def between(cls, old, new):
+        "Computes delta turning mapping `old` into `new`"
+        changes = {}
+        for key, value in old.items():
+            other = new.get(key, undefined)
+            if not (value is other or value == other):
+                changes[key] = value, other
+        for key, value in new.items():
+            if key not in old:
+                changes[key] = undefined, value
+        return cls._make(changes)
+
+    @classmethod
+    def _make(cls, changes):
+        delta = cls.__new__(cls)
+        delta._changes = changes
+        return delta
+
+    def __len__(self):
+        return len(self._changes)
+
+    def __iter__(self):
+        return iter(self._changes)
+
+    def __contains__(self, key):
+        return key in self._changes
+
+    def __eq__(self, other):
+        if not isinstance(other, DictDelta):
+            return NotImplemented
+        return self._changes == other._changes
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        if result is NotImplemented:
+            return result
+        return not result
+
+    def items(self):
+        return self._changes.items()
+
+    def old(self, key, default=undefined):
+        return self._changes.get(key, (default, default))[0]
+
+    def new(self, key, default=undefined):
+        return self._changes.get(key, (default, default))[1]
+
+    def invert(self):
+        "Returns delta undoing this one"
+        return self._make({key: (new, old)
+            for key, (old, new) in self._changes.items()})
+
+    def compose(self, other):
+        """
+        Returns delta of this transition followed by `other` one,
+        delta(A->B).compose(delta(B->C)) == delta(A->C).
+        """
+        changes = dict(self._changes)
+        _compose(changes, other._changes)
+        return self._make(changes)
+
+    def apply(self, mapping):
+        "Returns dictionary with changes applied to `mapping`"
+        result = dict(mapping)
+        for key, (old, new) in self._changes.items():
+            if new is undefined:
+                result.pop(key, None)
+            else:
+                result[key] = new
+        return result
+
+    def dump(self):
+        "Returns compact form built of plain dictionaries"
+        added = {}
+        changed = {}
+        removed = {}
+        for key, (old, new) in self._changes.items():
+            if old is undefined:
+                added[key] = new
+            elif new is undefined:
+                removed[key] = old
+            else:
+                changed[key] = old, new
+        return dict(added=added, changed=changed, removed=removed)
+
+    @classmethod
+    def load(cls, data):
+        changes = {}
+        for key, new in data.get("added", {}).items():
+            changes[key] = undefined, new
+        for key, (old, new) in data.get("changed", {}).items():
+            changes[key] = old, new
+        for key, old in data.get("removed", {}).items():
+            changes[key] = old, undefined
+        return cls._make(changes)
+
+    def __repr__(self):
+        return "DictDelta({!r})".format(self.dump())
+
+def _compose(changes, following):
+    "Composes `following` changes into `changes` in place"
+    for key, (old, new) in following.items():
+        previous = changes.get(key)
+        if previous is None:
+            changes[key] = old, new
+            continue
+        first, middle = previous
+        if not (middle is old or middle == old):
+            raise ValueError("Deltas do not follow each other at "
+                "key {!r}".format(key))
+        if first is new or first == new:
+            del changes[key]
+        else:
+            changes[key] = first, new
+
+class SetDelta(object):
+    "Changes of set as sets of added and removed values"
+    __slots__ = "_added", "_removed"
+
+    def __init__(self, added=(), removed=()):
+        self._added = frozenset(added)
+        self._removed = frozenset(removed)
+        if self._added & self._removed:
+            raise ValueError("Values both added and removed: {!r}".format(
+                set(self._added & self._removed)))
+
+    @classmethod
+    def from_proxy(cls, proxy):
+        "Takes changes recorded by ProxySet"
+        return cls(proxy.__added__, proxy.__removed__)
+
+    @classmethod
+    def between(cls, old, new):
+        "Computes delta turning set `old` into `new`"
+        return cls(set(new) - set(old), set(old) - set(new))
+
+    @property
+    def added(self):
+        return self._added
+
+    @property
+    def removed(self):
+        return self._removed
+
+    def __len__(self):
+        return len(self._added) + len(self._removed)
+
+    def __eq__(self, other):
+        if not isinstance(other, SetDelta):
+            return NotImplemented
+        return self._added == other._added and self._removed == other._removed
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        if result is NotImplemented:
+            return result
+        return not result
+
+    def invert(self):
+        "Returns delta undoing this one"
+        return SetDelta(self._removed, self._added)
+
+    def compose(self, other):
+        """
+        Returns delta of this transition followed by `other` one,
+        value added and then removed is dropped and vice versa.
+        """
+        return SetDelta(
+            (self._added - other._removed) | (other._added - self._removed),
+            (self._removed - other._added) | (other._removed - self._added),
+            )
+
+    def apply(self, values):
+        "Returns set with changes applied to `values`"
+        return (set(values) - self._removed) | self._added
+
+    def dump(self):
+        "Returns compact form built of plain lists"
+        return dict(added=list(self._added), removed=list(self._removed))
+
+    @classmethod
+    def load(cls, data):
+        return cls(data.get("added", ()), data.get("removed", ()))
+
+    def __repr__(self):
+        return "SetDelta(added={!r}, removed={!r})".format(
+            set(self._added), set(self._removed))
+
+def squash(deltas):
+    """
+    Composes chain of deltas of the same kind into single one. Every
+    changed key or value is visited once per delta it appears in.
+    """
+    deltas = iter(deltas)
+    first = next(deltas, None)
+    if first is None:
+        return None
+    if isinstance(first, SetDelta):
+        added = set(first.added)
+        removed = set(first.removed)
+        for delta in deltas:
+            for value in delta.removed:
+                if value in added:
+                    added.discard(value)
+                else:
+                    removed.add(value)
+            for value in delta.added:
+                if value in removed:
+                    removed.discard(value)
+                else:
+                    added.add(value)
+        return SetDelta(added, removed)
+    changes = dict(first._changes)
+    for delta in deltas:
+        _compose(changes, delta._changes)
+    return DictDelta._make(changes)
@@ -0,0 +1,90 @@
+"""
+Content digests.
+
+Values are hashed with BLAKE2b in canonical form, so equal values have
+equal digests regardless of order of dictionaries and sets. Canonical
+form keeps kinds of values apart: values with equal digests are always
+equal, but equal values of different kinds, like `1` and `1.0` or `True`
+and `1`, have different digests. Payloads with equal digests are shared,
+and sharing must not change types of values read back. Lists and tuples
+are distinct kinds, as they are never equal.
+
+Digest of a node is a sum of digests of its attributes modulo 2**256,
+which lets digest of a node version stored as delta be derived from
+digest of its base by visiting changed attributes only. Sums over HAMT
+subtrees make digests of whole revisions.
+"""
+
+import collections
+from functools import lru_cache
+from hashlib import blake2b
+
+from .utils import undefined
+
+DIGEST_SIZE = 32
+DIGEST_MASK = (1 << (8 * DIGEST_SIZE)) - 1
+
+def _hash(*parts):
+    h = blake2b(digest_size=DIGEST_SIZE)
+    for part in parts:
+        h.update(part)
+    return h.digest()
+
+def value_digest(value):
+    "Returns canonical digest of attribute value as bytes"
+    if value is None:
+        return _hash(b"N")
+    if value is True:
+        return _hash(b"T")
+    if value is False:
+        return _hash(b"F")
+    if isinstance(value, int):
+        return _hash(b"I", str(value).encode())
+    if isinstance(value, float):
+        return _hash(b"D", value.hex().encode())
+    if isinstance(value, str):
+        return _hash(b"S", value.encode("utf-8", "surrogatepass"))
+    if isinstance(value, bytes):
+        return _hash(b"B", value)
+    if isinstance(value, collections.Mapping):
+        return _hash(b"M", *sorted(
+            _hash(value_digest(key), value_digest(item))
+            for key, item in value.items()))
+    if isinstance(value, collections.Set):
+        return _hash(b"E", *sorted(value_digest(item) for item in value))
+    if isinstance(value, collections.MutableSequence):
+        return _hash(b"A", *(value_digest(item) for item in value))
+    if isinstance(value, collections.Sequence):
+        return _hash(b"L", *(value_digest(item) for item in value))
+    # identifiers have packed forms, other atomic values string forms
+    if hasattr(type(value), "__bytes__"):
+        form = bytes(value)
+    else:
+        form = str(value).encode()
+    return _hash(b"R", type(value).__name__.encode(), form)
+
+@lru_cache(maxsize=1 << 12)
+def _name_digest(name):
+    # attribute names repeat in every node
+    return value_digest(name)
+
+def entry_digest(key, value):
+    "Returns digest of single `key: value` entry as integer"
+    key = _name_digest(key) if type(key) is str else value_digest(key)
+    return int.from_bytes(_hash(key, value_digest(value)), "little")
+
+def content_digest(content):
+    "Returns digest of mapping as sum of its entry digests"
+    total = 0
+    for key, value in content.items():
+        total += entry_digest(key, value)
+    return total & DIGEST_MASK
+
+def update_digest(digest, delta):
+    "Returns digest of mapping after changes given as DictDelta"
+    for key, (old, new) in delta.items():
+        if old is not undefined:
+            digest -= entry_digest(key, old)
+        if new is not undefined:
+            digest += entry_digest(key, new)
+    return digest & DIGEST_MASK
@@ -0,0 +1,447 @@
+"""
+Persistent hash array mapped trie.
+
+Every modification returns new map which shares all untouched subtrees
+with the original one, so copying a map is free and updating it costs
+O(log32 n). Batched updates mutate nodes owned by the batch in place.
+Every trie node can cache sum of digests of its entries, so digest of a
+map derived from another one costs O(changes * log32 n).
+"""
+
+import collections
+
+from .utils import undefined
+
+_BITS = 5
+_MASK = (1 << _BITS) - 1
+_HASH_MASK = (1 << 64) - 1
+_DIGEST_MASK = (1 << 256) - 1
+
+def _hash(key):
+    return hash(key) & _HASH_MASK
+
+def _bit(h, shift):
+    return 1 << ((h >> shift) & _MASK)
+
+def _index(bitmap, bit):
+    return bin(bitmap & (bit - 1)).count("1")
+
+def _pair(shift, entry1, h1, entry2, h2, owner):
+    "Creates smallest subtree holding two leaf entries"
+    if h1 == h2:
+        return _CollisionNode(h1, [entry1, entry2], owner)
+    bit1 = _bit(h1, shift)
+    bit2 = _bit(h2, shift)
+    if bit1 == bit2:
+        child = _pair(shift + _BITS, entry1, h1, entry2, h2, owner)
+        return _BitmapNode(bit1, [child], owner)
+    if bit1 < bit2:
+        return _BitmapNode(bit1 | bit2, [entry1, entry2], owner)
+    return _BitmapNode(bit1 | bit2, [entry2, entry1], owner)
+
+class _BitmapNode(object):
+    """
+    Array entries are either leaf `(key, value)` tuples or child nodes.
+    """
+    __slots__ = "bitmap", "array", "owner", "digest"
+
+    def __init__(self, bitmap, array, owner=None):
+        self.bitmap = bitmap
+        self.array = array
+        self.owner = owner
+        self.digest = None
+
+    def _edit(self, owner):
+        if owner is not None and self.owner is owner:
+            return self
+        return _BitmapNode(self.bitmap, list(self.array), owner)
+
+    def get(self, h, shift, key, default):
+        bit = _bit(h, shift)
+        bitmap = self.bitmap
+        if not bitmap & bit:
+            return default
+        entry = self.array[_index(bitmap, bit)]
+        if type(entry) is tuple:
+            if entry[0] is key or entry[0] == key:
+                return entry[1]
+            return default
+        return entry.get(h, shift + _BITS, key, default)
+
+    def set(self, h, shift, key, value, owner):
+        "Returns pair of resulting node and flag whether key was added"
+        bit = _bit(h, shift)
+        index = _index(self.bitmap, bit)
+        if not self.bitmap & bit:
+            node = self._edit(owner)
+            node.bitmap |= bit
+            node.array.insert(index, (key, value))
+            return node, True
+        entry = self.array[index]
+        if type(entry) is tuple:
+            old_key, old_value = entry
+            if old_key is key or old_key == key:
+                if old_value is value:
+                    return self, False
+                node = self._edit(owner)
+                node.array[index] = (key, value)
+                return node, False
+            child = _pair(shift + _BITS,
+                entry, _hash(old_key), (key, value), h, owner)
+            added = True
+        else:
+            child, added = entry.set(h, shift + _BITS, key, value, owner)
+            if child is entry:
+                return self, added
+        node = self._edit(owner)
+        node.array[index] = child
+        return node, added
+
+    def delete(self, h, shift, key, owner):
+        """
+        Returns pair of resulting entry and flag whether key was removed.
+        Resulting entry is None for empty subtree and a leaf tuple when
+        only single leaf left, so parent can inline it.
+        """
+        bit = _bit(h, shift)
+        if not self.bitmap & bit:
+            return self, False
+        index = _index(self.bitmap, bit)
+        entry = self.array[index]
+        if type(entry) is tuple:
+            if not (entry[0] is key or entry[0] == key):
+                return self, False
+            child = None
+        else:
+            child, removed = entry.delete(h, shift + _BITS, key, owner)
+            if not removed:
+                return self, False
+        if child is None:
+            if len(self.array) == 1:
+                return None, True
+            if len(self.array) == 2 and shift > 0:
+                other = self.array[1 - index]
+                if type(other) is tuple:
+                    return other, True
+            node = self._edit(owner)
+            node.bitmap &= ~bit
+            del node.array[index]
+            return node, True
+        if type(child) is tuple and len(self.array) == 1 and shift > 0:
+            return child, True
+        node = self._edit(owner)
+        node.array[index] = child
+        return node, True
+
+    def entries(self):
+        stack = [iter(self.array)]
+        while stack:
+            for entry in stack[-1]:
+                if type(entry) is tuple:
+                    yield entry
+                else:
+                    stack.append(entry.iterator())
+                    break
+            else:
+                stack.pop()
+
+    def iterator(self):
+        return iter(self.array)
+
+class _CollisionNode(object):
+    __slots__ = "hash", "array", "owner", "digest"
+
+    def __init__(self, h, array, owner=None):
+        self.hash = h
+        self.array = array
+        self.owner = owner
+        self.digest = None
+
+    def _edit(self, owner):
+        if owner is not None and self.owner is owner:
+            return self
+        return _CollisionNode(self.hash, list(self.array), owner)
+
+    def _find(self, key):
+        for index, (old_key, old_value) in enumerate(self.array):
+            if old_key is key or old_key == key:
+                return index
+        return -1
+
+    def get(self, h, shift, key, default):
+        if h != self.hash:
+            return default
+        index = self._find(key)
+        if index < 0:
+            return default
+        return self.array[index][1]
+
+    def set(self, h, shift, key, value, owner):
+        if h != self.hash:
+            node = _BitmapNode(_bit(self.hash, shift), [self], owner)
+            return node.set(h, shift, key, value, owner)
+        index = self._find(key)
+        node = self._edit(owner)
+        if index < 0:
+            node.array.append((key, value))
+            return node, True
+        if self.array[index][1] is value:
+            return self, False
+        node.array[index] = (key, value)
+        return node, False
+
+    def delete(self, h, shift, key, owner):
+        if h != self.hash:
+            return self, False
+        index = self._find(key)
+        if index < 0:
+            return self, False
+        if len(self.array) == 2:
+            return self.array[1 - index], True
+        node = self._edit(owner)
+        del node.array[index]
+        return node, True
+
+    def iterator(self):
+        return iter(self.array)
+
+def _digest(entry, leaf):
+    """
+    Returns sum of `leaf(key, value)` over entries of subtree. Sums of
+    trie nodes are cached, maps sharing nodes must use the same `leaf`.
+    """
+    if type(entry) is tuple:
+        return leaf(*entry)
+    digest = entry.digest
+    if digest is None:
+        digest = 0
+        for child in entry.array:
+            digest += _digest(child, leaf)
+        digest &= _DIGEST_MASK
+        entry.digest = digest
+    return digest
+
+def _same(entry1, entry2, leaf):
+    if entry1 is entry2:
+        return True
+    if leaf is None:
+        return False
+    return _digest(entry1, leaf) == _digest(entry2, leaf)
+
+def _diff(node1, node2, shift, leaf=None):
+    if _same(node1, node2, leaf):
+        return
+    if type(node1) is _BitmapNode and type(node2) is _BitmapNode:
+        bitmap1 = node1.bitmap
+        bitmap2 = node2.bitmap
+        bits = bitmap1 | bitmap2
+        while bits:
+            bit = bits & -bits
+            bits ^= bit
+            entry1 = node1.array[_index(bitmap1, bit)] \
+                if bitmap1 & bit else None
+            entry2 = node2.array[_index(bitmap2, bit)] \
+                if bitmap2 & bit else None
+            yield from _diff_entries(entry1, entry2, shift + _BITS, leaf)
+        return
+    yield from _diff_generic(_entries(node1), _entries(node2), leaf)
+
+def _diff_entries(entry1, entry2, shift, leaf=None):
+    if entry1 is entry2:
+        return
+    if entry1 is None:
+        for key, value in _entries(entry2):
+            yield key, undefined, value
+    elif entry2 is None:
+        for key, value in _entries(entry1):
+            yield key, value, undefined
+    elif type(entry1) is tuple and type(entry2) is tuple:
+        key1, value1 = entry1
+        key2, value2 = entry2
+        if key1 is key2 or key1 == key2:
+            if not (value1 is value2 or value1 == value2 or 
+                    _same(entry1, entry2, leaf)):
+                yield key1, value1, value2
+        else:
+            yield key1, value1, undefined
+            yield key2, undefined, value2
+    elif type(entry1) is tuple or type(entry2) is tuple:
+        yield from _diff_generic(_entries(entry1), _entries(entry2), leaf)
+    else:
+        yield from _diff(entry1, entry2, shift, leaf)
+
+def _diff_generic(entries1, entries2, leaf=None):
+    other = dict(entries2)
+    for key, value1 in entries1:
+        value2 = other.pop(key, undefined)
+        if value2 is undefined:
+            yield key, value1, undefined
+        elif not (value1 is value2 or value1 == value2 or 
+                _same((key, value1), (key, value2), leaf)):
+            yield key, value1, value2
+    for key, value2 in other.items():
+        yield key, undefined, value2
+
+def _entries(entry):
+    if entry is None:
+        return iter(())
+    if type(entry) is tuple:
+        return iter((entry,))
+    if type(entry) is _CollisionNode:
+        return iter(entry.array)
+    return entry.entries()
+
+class _ItemsView(collections.ItemsView):
+    def __iter__(self):
+        return self._mapping._entries()
+
+class _ValuesView(collections.ValuesView):
+    def __iter__(self):
+        for key, value in self._mapping._entries():
+            yield value
+
+class PersistentMap(collections.Mapping):
+    """
+    Immutable mapping. `set`, `discard` and `update` return new maps.
+    """
+    __slots__ = "_root", "_size"
+
+    def __init__(self, *args, **kwargs):
+        self._root = None
+        self._size = 0
+        if args or kwargs:
+            root, size = self._batch(*args, **kwargs)
+            self._root = root
+            self._size = size
+
+    @classmethod
+    def _make(cls, root, size):
+        instance = cls.__new__(cls)
+        instance._root = root
+        instance._size = size
+        return instance
+
+    def __len__(self):
+        return self._size
+
+    def __getitem__(self, key):
+        value = self.get(key, undefined)
+        if value is undefined:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key):
+        return self.get(key, undefined) is not undefined
+
+    def get(self, key, default=None):
+        if self._root is None:
+            return default
+        return self._root.get(_hash(key), 0, key, default)
+
+    def _entries(self):
+        if self._root is None:
+            return iter(())
+        return self._root.entries()
+
+    def __iter__(self):
+        for key, value in self._entries():
+            yield key
+
+    def items(self):
+        return _ItemsView(self)
+
+    def values(self):
+        return _ValuesView(self)
+
+    def set(self, key, value):
+        root = self._root
+        if root is None:
+            root = _BitmapNode(0, [])
+        root, added = root.set(_hash(key), 0, key, value, None)
+        if root is self._root:
+            return self
+        return self._make(root, self._size + added)
+
+    def discard(self, key):
+        if self._root is None:
+            return self
+        root, removed = self._root.delete(_hash(key), 0, key, None)
+        if not removed:
+            return self
+        return self._make(root, self._size - 1)
+
+    def _batch(self, *args, **kwargs):
+        owner = object()
+        root = self._root
+        size = self._size
+        if root is None:
+            root = _BitmapNode(0, [], owner)
+        for mapping in args + (kwargs,):
+            if isinstance(mapping, collections.Mapping):
+                mapping = mapping.items()
+            for key, value in mapping:
+                root, added = root.set(_hash(key), 0, key, value, owner)
+                size += added
+        if not size:
+            root = None
+        return root, size
+
+    def update(self, *args, **kwargs):
+        """
+        Returns new map with all given pairs set. Nodes created during
+        the call are updated in place, so batch does not copy the path
+        for every key.
+        """
+        root, size = self._batch(*args, **kwargs)
+        if root is self._root:
+            return self
+        return self._make(root, size)
+
+    def diff(self, other, leaf=None):
+        """
+        Yields `(key, value, other_value)` triples for keys which differ,
+        missing values are `undefined`. Subtrees shared between maps are
+        skipped, so diff of a map against its derivative costs O(changes).
+        With `leaf` digest function subtrees and entries with equal 
+        digests are skipped as well.
+        """
+        if self._root is None:
+            for key, value in other._entries():
+                yield key, undefined, value
+        elif other._root is None:
+            for key, value in self._entries():
+                yield key, value, undefined
+        else:
+            yield from _diff(self._root, other._root, 0, leaf)
+
+    def digest(self, leaf):
+        """
+        Returns sum of `leaf(key, value)` over all entries modulo 2**256.
+        Sums of subtrees are cached in trie nodes, so `leaf` must give
+        the same result for the same entry in all maps sharing them.
+        """
+        if self._root is None:
+            return 0
+        return _digest(self._root, leaf)
+
+    def invalidate(self, keys):
+        """
+        Drops digest sums cached on paths to `keys`, for when `leaf`
+        result for these entries has changed without changing the map.
+        """
+        for key in keys:
+            h = _hash(key)
+            shift = 0
+            entry = self._root
+            while entry is not None and type(entry) is not tuple:
+                entry.digest = None
+                if type(entry) is _CollisionNode:
+                    break
+                bit = _bit(h, shift)
+                if not entry.bitmap & bit:
+                    break
+                entry = entry.array[_index(entry.bitmap, bit)]
+                shift += _BITS
+
+    def __repr__(self):
+        return "PersistentMap({!r})".format(dict(self.items()))
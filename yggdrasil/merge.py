@@ -0,0 +1,295 @@
+"""
+Three-way merge of node contents.
+
+Every attribute is classified on each side against common base as
+absent (0), unchanged (V), inserted (I), changed (C) or removed (R) and
+resolved with conflict tables from `utils`. Nested mappings, sets and
+sequences are merged recursively.
+"""
+
+import collections
+
+from .utils import (
+    undefined,
+    ProxyList,
+    ProxyListMerge,
+    CCMergeConflict,
+    CRMergeConflict,
+    RCMergeConflict,
+    IIMergeConflict,
+    )
+
+def _bisect(a, a0, a1, b, b0, b1):
+    """
+    Finds middle snake of the shortest edit script between `a[a0:a1]`
+    and `b[b0:b1]`, walking from both ends at once in linear space.
+    Returns split point or None when sequences have nothing in common.
+    """
+    n = a1 - a0
+    m = b1 - b0
+    max_d = (n + m + 1) // 2
+    offset = max_d
+    size = 2 * max_d + 2
+    forward = [-1] * size
+    backward = [-1] * size
+    forward[offset + 1] = 0
+    backward[offset + 1] = 0
+    delta = n - m
+    odd = delta & 1
+    # diagonals which run out of one of sequences are cut off
+    k1start = k1end = k2start = k2end = 0
+    for d in range(max_d):
+        for k1 in range(-d + k1start, d + 1 - k1end, 2):
+            index = offset + k1
+            if k1 == -d or (k1 != d and forward[index - 1] < forward[index + 1]):
+                x1 = forward[index + 1]
+            else:
+                x1 = forward[index - 1] + 1
+            y1 = x1 - k1
+            if x1 < n and y1 < m and a[a0 + x1] == b[b0 + y1]:
+                common = _common(a, a0 + x1, b, b0 + y1, min(n - x1, m - y1), 1)
+                x1 += common
+                y1 += common
+            forward[index] = x1
+            if x1 > n:
+                k1end += 2
+            elif y1 > m:
+                k1start += 2
+            elif odd:
+                other = offset + delta - k1
+                if 0 <= other < size and backward[other] != -1:
+                    if x1 >= n - backward[other]:
+                        return x1, y1
+        for k2 in range(-d + k2start, d + 1 - k2end, 2):
+            index = offset + k2
+            if k2 == -d or (k2 != d and backward[index - 1] < backward[index + 1]):
+                x2 = backward[index + 1]
+            else:
+                x2 = backward[index - 1] + 1
+            y2 = x2 - k2
+            if x2 < n and y2 < m and a[a1 - x2 - 1] == b[b1 - y2 - 1]:
+                common = _common(a, a1 - x2 - 1, b, b1 - y2 - 1, 
+                    min(n - x2, m - y2), -1)
+                x2 += common
+                y2 += common
+            backward[index] = x2
+            if x2 > n:
+                k2end += 2
+            elif y2 > m:
+                k2start += 2
+            elif not odd:
+                other = offset + delta - k2
+                if 0 <= other < size and forward[other] != -1:
+                    x1 = forward[other]
+                    y1 = offset + x1 - other
+                    if x1 >= n - x2:
+                        return x1, y1
+    return None
+
+def _common(a, i, b, j, limit, step):
+    """
+    Returns length of common run of `a` and `b` starting at `i` and `j`
+    and going in direction of `step`. Blocks of growing size are
+    compared as slices first.
+    """
+    count = 0
+    block = 8
+    growing = True
+    while block:
+        if count + block <= limit:
+            if step > 0:
+                x, y = i + count, j + count
+                same = a[x:x + block] == b[y:y + block]
+            else:
+                x, y = i - count + 1, j - count + 1
+                same = a[x - block:x] == b[y - block:y]
+            if same:
+                count += block
+                if growing:
+                    block *= 2
+                continue
+        growing = False
+        block //= 2
+    return count
+
+def _edits(a, b):
+    """
+    Yields `(equal, i1, i2, j1, j2)` blocks of Myers edit script in
+    order. Subproblems are kept on explicit stack, so memory depends on
+    number of edits only.
+    """
+    stack = [(0, len(a), 0, len(b))]
+    while stack:
+        task = stack.pop()
+        if len(task) == 5:
+            yield task
+            continue
+        a0, a1, b0, b1 = task
+        start = a0
+        common = _common(a, a0, b, b0, min(a1 - a0, b1 - b0), 1)
+        a0 += common
+        b0 += common
+        if a0 > start:
+            yield True, start, a0, b0 - (a0 - start), b0
+        stop = a1
+        common = _common(a, a1 - 1, b, b1 - 1, min(a1 - a0, b1 - b0), -1)
+        a1 -= common
+        b1 -= common
+        if a1 < stop:
+            stack.append((True, a1, stop, b1, b1 + stop - a1))
+        if a0 == a1 or b0 == b1:
+            if a0 < a1 or b0 < b1:
+                yield False, a0, a1, b0, b1
+            continue
+        split = _bisect(a, a0, a1, b, b0, b1)
+        if split is None:
+            yield False, a0, a1, b0, b1
+            continue
+        x, y = split
+        stack.append((a0 + x, a1, b0 + y, b1))
+        stack.append((a0, a0 + x, b0, b0 + y))
+
+def diff_lists(base, other):
+    """
+    Yields opcodes turning `base` into `other` in the same form as
+    `difflib.SequenceMatcher.get_opcodes`, computed with Myers
+    algorithm.
+    """
+    pending = None
+    for equal, i1, i2, j1, j2 in _edits(base, other):
+        if pending is not None and pending[0] == equal:
+            pending = (equal, pending[1], i2, pending[3], j2)
+            continue
+        if pending is not None:
+            yield _opcode(*pending)
+        pending = (equal, i1, i2, j1, j2)
+    if pending is not None:
+        yield _opcode(*pending)
+
+def _opcode(equal, i1, i2, j1, j2):
+    if equal:
+        tag = "equal"
+    elif i1 == i2:
+        tag = "insert"
+    elif j1 == j2:
+        tag = "delete"
+    else:
+        tag = "replace"
+    return tag, i1, i2, j1, j2
+
+def track_list(base, other):
+    """
+    Returns ProxyList over `base` with changes turning it into `other`.
+    Unchanged parts of `base` stay shared spans.
+    """
+    result = ProxyList(base)
+    # applied from the end, so positions of earlier opcodes stay valid
+    for tag, i1, i2, j1, j2 in reversed(list(diff_lists(base, other))):
+        if tag == "equal":
+            continue
+        if tag == "replace" and i2 - i1 == j2 - j1:
+            for offset in range(i2 - i1):
+                result[i1 + offset] = other[j1 + offset]
+            continue
+        result[i1:i2] = other[j1:j2]
+    return result
+
+def _rebuild(sample, values):
+    try:
+        return type(sample)(values)
+    except TypeError:
+        return values
+
+def _is_sequence(value):
+    return isinstance(value, collections.Sequence) and \
+        not isinstance(value, (str, bytes))
+
+def _is_set(value):
+    return isinstance(value, collections.Set)
+
+def merge_lists(base, mine, theirs, path, conflicts):
+    base = () if base is undefined else tuple(base)
+    merger = ProxyListMerge(track_list(base, mine), track_list(base, theirs), path)
+    result = _rebuild(mine, merger.merge())
+    conflicts.extend(merger.conflicts)
+    return result
+
+def merge_sets(base, mine, theirs, path, conflicts):
+    if base is undefined:
+        base = frozenset()
+    removed = (set(base) - set(mine)) | (set(base) - set(theirs))
+    result = (set(mine) | set(theirs)) - removed
+    return _rebuild(mine, result)
+
+def merge_mappings(base, mine, theirs, path, conflicts):
+    if base is undefined:
+        base = {}
+    result = {}
+    for key in _keys(base, mine, theirs):
+        value = merge_values(
+            base.get(key, undefined),
+            mine.get(key, undefined),
+            theirs.get(key, undefined),
+            path + (key,), conflicts)
+        if value is not undefined:
+            result[key] = value
+    return _rebuild(mine, result)
+
+def _keys(*mappings):
+    seen = set()
+    for mapping in mappings:
+        for key in mapping:
+            if key not in seen:
+                seen.add(key)
+                yield key
+
+def merge_values(base, mine, theirs, path, conflicts):
+    """
+    Returns merged value, `undefined` stands for absent one. Conflicts
+    are appended to `conflicts` and resolved in favour of `mine`.
+    """
+    if mine is theirs or mine == theirs: # VV, CC, II and RR with same result
+        return mine
+    if mine is not undefined and mine == base: # V?
+        return theirs
+    if theirs is not undefined and theirs == base: # ?V
+        return mine
+    if mine is undefined: # R?
+        if base is undefined:
+            return theirs
+        conflicts.append(RCMergeConflict(path, base, mine, theirs))
+        return mine
+    if theirs is undefined: # ?R
+        if base is undefined:
+            return mine
+        conflicts.append(CRMergeConflict(path, base, mine, theirs))
+        return mine
+    containers = [mine, theirs] if base is undefined else [base, mine, theirs]
+    if all(isinstance(value, collections.Mapping) for value in containers):
+        return merge_mappings(base, mine, theirs, path, conflicts)
+    if all(_is_set(value) for value in containers):
+        return merge_sets(base, mine, theirs, path, conflicts)
+    if all(_is_sequence(value) for value in containers):
+        return merge_lists(base, mine, theirs, path, conflicts)
+    if base is undefined:
+        conflicts.append(IIMergeConflict(path, base, mine, theirs))
+    else:
+        conflicts.append(CCMergeConflict(path, base, mine, theirs))
+    return mine
+
+def merge_content(base, mine, theirs, path=()):
+    """
+    Merges attributes of three versions of a node. Returns pair of
+    merged attributes dictionary and list of conflicts.
+    """
+    conflicts = []
+    result = {}
+    for key in _keys(base, mine, theirs):
+        value = merge_values(
+            base.get(key, undefined),
+            mine.get(key, undefined),
+            theirs.get(key, undefined),
+            path + (key,), conflicts)
+        if value is not undefined:
+            result[key] = value
+    return result, conflicts
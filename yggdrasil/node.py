@@ -1,23 +1,45 @@
+import os
 import random
-from collections import UserString, Mapping, Sequence, deque, defaultdict
+import threading
+from bisect import bisect_left
+from collections import UserString, Mapping, Sequence, Set, deque, defaultdict
 from functools import lru_cache
 
 from .utils import (
     ReadOnlyDict,
     ReadOnlySet,
+    OverlayDict,
+    LRUCache,
+    PinningCache,
+    FrozenDict,
+    undefined,
+    gc_paused,
     )
+from .hamt import PersistentMap
+from .merge import merge_content
+from .ancestry import AncestryIndex
+from .delta import DictDelta, squash
+from .digest import content_digest, update_digest, entry_digest
+from .blobs import BlobStore
+from .undo import UndoLog, Savepoint
+from .snapshot import Snapshot, SnapshotRegistry
+from .storage import Codec
 
 # ____________________________________________________________________________ #
 
+ALPHABET = "23456789abcdefghijkmnopqrstuvwxyz"
+
 @lru_cache()
 def UUID(length, alphabet=None):
-    _alphabet = alphabet or "23456789abcdefghijkmnopqrstuvwxyz"
+    _alphabet = alphabet or ALPHABET
     class _UUID(UserString):
         def __init__(self):
-            super().__init__(
-                ''.join(random.choice(_alphabet)  
+            if _alphabet == ALPHABET:
+                data = unpack_uid(uuid_generator(length)(), length)
+            else:
+                data = ''.join(random.choice(_alphabet)  
                     for i in range(length))
-            )
+            super().__init__(data)
         @classmethod
         def from_string(cls, s):
             assert isinstance(s, str)
@@ -28,11 +50,109 @@ def UUID(length, alphabet=None):
             return instance
     return _UUID
 
+_DIGITS = "0123456789abcdefghijklmnopqrstuvw"
+_DECODE = str.maketrans(ALPHABET, _DIGITS)
+
+def pack_uid(s, length):
+    """
+    Packs uid string of given length into integer. Each character is a 
+    digit in base 33 numeral system with ALPHABET as digits.
+    """
+    assert isinstance(s, str)
+    assert len(s) == length
+    assert not s.strip(ALPHABET)
+    return int(s.translate(_DECODE), len(ALPHABET))
+
+def unpack_uid(value, length):
+    base = len(ALPHABET)
+    chars = []
+    for i in range(length):
+        value, digit = divmod(value, base)
+        chars.append(ALPHABET[digit])
+    chars.reverse()
+    return ''.join(chars)
+
+class UUIDGenerator(object):
+    """
+    Source of packed uids. Entropy for a whole batch is drawn with single
+    read and sliced into uids which are kept in pool until requested.
+    With seed given generator switches to deterministic mode, which is 
+    useful for reproducible benchmarks.
+    """
+    def __init__(self, length, batch=1024, seed=None):
+        self._limit = len(ALPHABET) ** length
+        # extra 8 bytes per uid keep modulo bias below 2**-64
+        self._size = (self._limit.bit_length() + 7) // 8 + 8
+        self._batch = batch
+        self._pool = deque()
+        self.seed(seed)
+
+    def seed(self, seed=None):
+        self._random = None if seed is None else random.Random(seed)
+        self._pool.clear()
+
+    def _entropy(self, size):
+        if self._random is None:
+            return os.urandom(size)
+        return self._random.getrandbits(size * 8).to_bytes(size, "big")
+
+    def refill(self, count=None):
+        if count is None:
+            count = self._batch
+        size = self._size
+        limit = self._limit
+        from_bytes = int.from_bytes
+        data = memoryview(self._entropy(size * count))
+        self._pool.extend(from_bytes(data[offset:offset + size], "big") % limit
+            for offset in range(0, size * count, size))
+
+    def __call__(self):
+        try:
+            return self._pool.popleft()
+        except IndexError:
+            self.refill()
+            return self._pool.popleft()
+
+    def take(self, count):
+        "Returns list of `count` fresh uids"
+        missing = count - len(self._pool)
+        if missing > 0:
+            self.refill(missing + self._batch)
+        return [self() for i in range(count)]
+
+_generators = {}
+
+def uuid_generator(length):
+    generator = _generators.get(length)
+    if generator is None:
+        generator = _generators.setdefault(length, UUIDGenerator(length))
+    return generator
+
+def seed_uuids(seed=None):
+    """
+    Switches all uid generators into deterministic mode. Passing None 
+    returns them back to `os.urandom` entropy.
+    """
+    for length in sorted(set(_generators) | {16, 32}):
+        generator = uuid_generator(length)
+        generator.seed(None if seed is None else "{}:{}".format(seed, length))
+
 # ____________________________________________________________________________ #
 
 class NodeNotFound(KeyError): pass
 class RevisionFinishedError(RuntimeError): pass
 class RevisionNotFinishedError(RuntimeError): pass
+class ValidationError(TypeError): pass
+class TransactionError(RuntimeError): pass
+
+class CommitConflictError(RuntimeError):
+    "Working copy can not be merged into branch without conflicts"
+    def __init__(self, conflicts):
+        super().__init__(conflicts)
+        self.conflicts = conflicts
+
+class StaleReadError(CommitConflictError):
+    "Nodes read by working copy were changed in branch since"
 
 # ____________________________________________________________________________ #
 
@@ -49,81 +169,365 @@ class NodeMeta(type):
 
 # ____________________________________________________________________________ #
 
-class NodeRef(UserString):
-    def __init__(self, uid:UUID(32)=None):
-        assert uid is None or isinstance(uid, UUID(32))
-        super().__init__(UUID(32)() if uid is None else uid)
+class Identifier(object):
+    """
+    Base for compact immutable identifiers. Keeps only packed components
+    and precomputed hash. String form is built on first request only 
+    (it is needed by HTTP/JSON layer) and cached afterwards.
+    """
+    __slots__ = "_hash", "_str"
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return self._hash
+
+    def __str__(self):
+        text = self._str
+        if text is None:
+            text = self._str = self._format()
+        return text
+
+    def __repr__(self):
+        return "{}({!r})".format(type(self).__name__, str(self))
+
+class UniqueId(Identifier):
+    __slots__ = "_value",
+    __length__ = None
+
+    def __init__(self, uid=None):
+        if uid is None:
+            uid = uuid_generator(self.__length__)()
+        if isinstance(uid, int):
+            self._value = uid
+            self._str = None
+        else:
+            assert isinstance(uid, UUID(self.__length__))
+            self._value = pack_uid(uid.data, self.__length__)
+            self._str = uid.data
+        self._hash = hash(self._value)
+
+    __hash__ = Identifier.__hash__
+
     def __eq__(self, other):
         if not isinstance(other, type(self)):
             return False
-        return super().__eq__(other)
-    def __hash__(self): 
-        return super().__hash__()
+        return self._value == other._value
+
+    def __lt__(self, other):
+        return self._value < other._value
+
+    def _format(self):
+        return unpack_uid(self._value, self.__length__)
+
+    def __bytes__(self):
+        "Packed form used for content digests"
+        return self._value.to_bytes((self._value.bit_length() + 7) // 8, "big")
+
     @classmethod
-    def from_string(cls, s):
-        return cls(UUID(32).from_string(s))
+    def take(cls, count):
+        "Returns list of `count` fresh identifiers drawn in one batch"
+        new = cls.__new__
+        result = []
+        append = result.append
+        for value in uuid_generator(cls.__length__).take(count):
+            instance = new(cls)
+            instance._value = value
+            instance._str = None
+            instance._hash = hash(value)
+            append(instance)
+        return result
 
-class BranchId(UserString):
-    def __init__(self, uid:UUID(16)=None):
-        assert uid is None or isinstance(uid, UUID(16))
-        super().__init__(UUID(16)() if uid is None else uid)
-    def __eq__(self, other):
-        if not isinstance(other, type(self)):
-            return False
-        return super().__eq__(other)
-    def __hash__(self): 
-        return super().__hash__()
     @classmethod
+    @lru_cache(maxsize=1 << 14)
     def from_string(cls, s):
-        return cls(UUID(16).from_string(s))
+        instance = cls(pack_uid(s, cls.__length__))
+        instance._str = s
+        return instance
+
+class NodeRef(UniqueId):
+    __slots__ = ()
+    __length__ = 32
+
+class BranchId(UniqueId):
+    __slots__ = ()
+    __length__ = 16
+
+class RevisionId(Identifier):
+    """
+    Revision of a branch by its number. Detached working copies belong
+    to no branch, their ids have reserved number and unique key in place
+    of branch id.
+    """
+    __slots__ = "_branch", "_number"
+    DETACHED = 0xffffffff
 
-class RevisionId(UserString):
     def __init__(self, branch_id:BranchId, number:int):
-        self.branch = branch_id
-        self.number = number
-        super().__init__("{0}:{1:08x}".format(self.branch, self.number))
+        self._branch = branch_id
+        self._number = number
+        self._hash = hash((branch_id._hash, number))
+        self._str = None
+
+    @classmethod
+    def detached(cls):
+        "Returns fresh id of revision made apart from branches"
+        return cls(BranchId(), cls.DETACHED)
+
+    @property
+    def is_detached(self):
+        return self._number == self.DETACHED
+
+    @property
+    def branch(self):
+        "Id of branch, None for detached revisions"
+        if self._number == self.DETACHED:
+            return None
+        return self._branch
+
+    @property
+    def number(self):
+        if self._number == self.DETACHED:
+            return None
+        return self._number
+
+    __hash__ = Identifier.__hash__
+
     def __eq__(self, other):
         if not isinstance(other, type(self)):
             return False
-        return super().__eq__(other)
-    def __hash__(self): 
-        return super().__hash__()
+        return (self._number == other._number and 
+            self._branch == other._branch)
+
+    def __lt__(self, other):
+        return (self._branch, self._number) < (other._branch, other._number)
+
+    def _format(self):
+        return "{0}:{1:08x}".format(self._branch, self._number)
+
+    def __bytes__(self):
+        return bytes(self._branch) + b":" + str(self._number).encode()
+
     @classmethod
+    @lru_cache(maxsize=1 << 14)
     def from_string(cls, s):
         assert isinstance(s, str)
         assert len(s) == 25
         bid = BranchId.from_string(s[:16])
         number = int(s[17:], 16)
-        return cls(bid, number)
+        instance = cls(bid, number)
+        instance._str = s
+        return instance
+
+class NodeId(Identifier):
+    __slots__ = "_node_ref", "_revision"
 
-class NodeId(UserString):
     def __init__(self, node_ref:NodeRef, revision_id:RevisionId):
-        self.node_ref = node_ref
-        self.revision = revision_id
-        super().__init__("{0}:{1}".format(self.revision, self.node_ref))
+        self._node_ref = node_ref
+        self._revision = revision_id
+        self._hash = hash((revision_id._hash, node_ref._hash))
+        self._str = None
+
+    @property
+    def node_ref(self):
+        return self._node_ref
+
+    @property
+    def revision(self):
+        return self._revision
+
+    __hash__ = Identifier.__hash__
+
     def __eq__(self, other):
         if not isinstance(other, type(self)):
             return False
-        return super().__eq__(other)
-    def __hash__(self): 
-        return super().__hash__()
+        return (self._node_ref == other._node_ref and 
+            self._revision == other._revision)
+
+    def _format(self):
+        return "{0}:{1}".format(self._revision, self._node_ref)
+
+    def __bytes__(self):
+        return bytes(self._revision) + b":" + bytes(self._node_ref)
+
     @classmethod
+    @lru_cache(maxsize=1 << 16)
+    def intern(cls, node_ref:NodeRef, revision_id:RevisionId):
+        """
+        Returns shared instance for hot identifiers, so repeated lookups
+        of the same node do not allocate new keys.
+        """
+        return cls(node_ref, revision_id)
+
+    @classmethod
+    @lru_cache(maxsize=1 << 14)
     def from_string(cls, s):
         assert isinstance(s, str)
         assert len(s) == 58
         rid = RevisionId.from_string(s[:25])
         ref = NodeRef.from_string(s[26:])
-        return cls(ref, rid)
+        instance = cls.intern(ref, rid)
+        instance._str = s
+        return instance
+
+# values of records kept in persistent storage
+_codec = Codec(NodeRef, BranchId, RevisionId, NodeId)
 
 # ____________________________________________________________________________ #
 
+ATOMIC_TYPES = frozenset((
+    int, str, float, bool, NodeRef, BranchId, RevisionId, NodeId, type(None),
+    ))
+
+def _is_container(value):
+    "Whether value is a collection whose validation may be deferred"
+    return isinstance(value, (Sequence, Mapping, Set)) and \
+        not isinstance(value, (str, UserString))
+
+def check_value(value):
+    """
+    Generic validation of values which have no field schema. Only atomic
+    values and mappings or sequences of them are allowed.
+    """
+    if type(value) in ATOMIC_TYPES:
+        return
+    if isinstance(value, ReadOnlyNodeProxy.__atomic_types__):
+        return
+    if isinstance(value, Mapping):
+        values = value.values()
+    elif isinstance(value, Sequence):
+        values = value
+    else:
+        raise ValidationError(type(value))
+    if set(map(type, values)) <= ATOMIC_TYPES:
+        return
+    for item in values:
+        check_value(item)
+
+ATOMIC_FIELD_TYPES = {
+    "String": (str,),
+    "Boolean": (bool,),
+    "Integer": (int,),
+    "Float": (float, int),
+    }
+
+def atomic_validator(types):
+    allowed = frozenset(types) | {type(None)}
+    def validate(value):
+        if type(value) not in allowed and not isinstance(value, types):
+            raise ValidationError(type(value))
+    # containers use it to check all items with single set operation
+    validate.allowed = allowed
+    return validate
+
+def list_validator(item):
+    allowed = getattr(item, "allowed", None)
+    def validate(value):
+        if value is None:
+            return
+        if isinstance(value, (str, Mapping)) or not isinstance(value, Sequence):
+            raise ValidationError(type(value))
+        if allowed is not None and set(map(type, value)) <= allowed:
+            return
+        for subvalue in value:
+            item(subvalue)
+    return validate
+
+def dict_validator(key, value):
+    keys_allowed = getattr(key, "allowed", None)
+    values_allowed = getattr(value, "allowed", None)
+    def validate(mapping):
+        if mapping is None:
+            return
+        if not isinstance(mapping, Mapping):
+            raise ValidationError(type(mapping))
+        if keys_allowed is None or not set(map(type, mapping)) <= keys_allowed:
+            for subkey in mapping:
+                key(subkey)
+        if values_allowed is None or \
+                not set(map(type, mapping.values())) <= values_allowed:
+            for subvalue in mapping.values():
+                value(subvalue)
+    return validate
+
+class Resolution(object):
+    """
+    Cache of schema lookups made in one revision. `depends` holds refs of
+    all nodes consulted, any write into them resets the cache.
+    """
+    __slots__ = "getters", "validators", "fields", "depends"
+
+    def __init__(self):
+        self.getters = {} # class NodeRef -> getter
+        self.validators = {} # (class NodeRef, name) -> validator
+        self.fields = {} # field NodeRef -> validator
+        self.depends = set()
+
+    def clear(self):
+        self.getters.clear()
+        self.validators.clear()
+        self.fields.clear()
+        self.depends.clear()
+
+    def copy(self):
+        "Returns cache sharing compiled validators with this one"
+        resolution = Resolution()
+        resolution.getters.update(self.getters)
+        resolution.validators.update(self.validators)
+        resolution.fields.update(self.fields)
+        resolution.depends.update(self.depends)
+        return resolution
+
+def _restore_item(mapping, key, old):
+    if old is undefined:
+        mapping.pop(key, None)
+    else:
+        mapping[key] = old
+
+def _forget_items(mapping, keys):
+    for key in keys:
+        mapping.pop(key, None)
+
+def _restore_slots(instance, state):
+    for name, value in state.items():
+        object.__setattr__(instance, name, value)
+
+# ____________________________________________________________________________ #
+
+# instance dictionary of all sealed nodes, their payloads are frozen
+_SEALED = {}
+
 class Node(metaclass=NodeMeta):
-    __slots__ = "_runtime", "_ref", "__dict__"
+    __slots__ = "_runtime", "_ref", "_digest", "_frozen", "__dict__"
     def __init__(self, runtime, node_ref:NodeRef=None):
         self._runtime = runtime
         if node_ref is None:
             node_ref = NodeRef()
         self._ref = node_ref
+        self._digest = None
+        self._frozen = None
+
+    def __getattr__(self, name):
+        if name in Node.__slots__:
+            raise AttributeError(name)
+        frozen = self._frozen
+        if frozen is not None:
+            value = frozen.get(name, undefined)
+            if value is not undefined:
+                return value
+        raise AttributeError(name)
+
+    def __setattr__(self, name, value):
+        # instance dictionary of sealed node is shared by all of them
+        if self.__dict__ is _SEALED and name not in self.__slots__ \
+                and name != "__dict__":
+            raise RuntimeError("Sealed node is read only")
+        object.__setattr__(self, name, value)
+
+    def __delattr__(self, name):
+        if self.__dict__ is _SEALED:
+            raise RuntimeError("Sealed node is read only")
+        object.__delattr__(self, name)
 
     @property
     def ref(self):
@@ -135,8 +539,111 @@ class Node(metaclass=NodeMeta):
 
     @property
     def content(self):
+        if self._frozen is not None:
+            return ReadOnlyDict(self._frozen)
         return ReadOnlyDict(self.__dict__)
 
+    @property
+    def depth(self):
+        "Number of deltas between this node and its full snapshot"
+        return 0
+
+    @property
+    def digest(self):
+        "Content digest, fixed when revision of this version is finished"
+        if self._digest is not None:
+            return self._digest
+        return content_digest(self.content)
+
+    def seal(self):
+        """
+        Fixes content digest, node must not change after that. Equal 
+        payloads of all sealed nodes are shared through blob store.
+        """
+        self._runtime.record_undo(self._unseal, self.__dict__)
+        self._freeze(content_digest(self.__dict__), self.__dict__)
+
+    def _freeze(self, digest, payload):
+        """
+        Replaces instance dictionary with frozen payload, which keeps
+        values only and shares key layout with payloads of same keys.
+        """
+        self._digest = digest
+        self._frozen = self._runtime.blobs.store(digest, FrozenDict(payload))
+        self.__dict__ = _SEALED
+
+    def _unseal(self, payload):
+        self._runtime.blobs.release(self._digest, self._frozen)
+        self.__dict__ = payload
+        self._frozen = None
+        self._digest = None
+
+class DeltaNode(Node):
+    """
+    Node version stored as a set of changes over the content of previous
+    version of the same node. Changes are tracked with OverlayDict, so 
+    `delta` knows which attributes were added, changed or removed.
+    """
+    __slots__ = "_base", "_depth", "_delta"
+    def __init__(self, runtime, base_id:NodeId, base:Node):
+        super().__init__(runtime, base.ref)
+        self._base = base_id
+        self._depth = base.depth + 1
+        self._delta = OverlayDict(base.content)
+
+    def __getattr__(self, name):
+        if name in self.__slots__:
+            raise AttributeError(name)
+        try:
+            return self._delta[name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def __setattr__(self, name, value):
+        if name in self.__slots__:
+            object.__setattr__(self, name, value)
+        else:
+            self._delta[name] = value
+
+    def __delattr__(self, name):
+        try:
+            del self._delta[name]
+        except KeyError:
+            raise AttributeError(name)
+
+    @property
+    def base(self):
+        return self._base
+
+    @property
+    def delta(self):
+        return self._delta
+
+    @property
+    def changes(self):
+        "DictDelta from content of base version"
+        return DictDelta.from_proxy(self._delta)
+
+    @property
+    def content(self):
+        return ReadOnlyDict(self._delta)
+
+    @property
+    def depth(self):
+        return self._depth
+
+    @property
+    def digest(self):
+        if self._digest is not None:
+            return self._digest
+        return content_digest(self._delta)
+
+    def seal(self):
+        "Derives digest from base version visiting changed values only"
+        base = self._runtime.get_node(self._base)
+        self._runtime.record_undo(_restore_slots, self, {"_digest": None})
+        self._digest = update_digest(base.digest, self.changes)
+
 class ReadOnlyNodeProxy(object):
     """
     We need some proxy layer abstraction to control working copy bounds.
@@ -153,19 +660,20 @@ class ReadOnlyNodeProxy(object):
     def __setattr__(self, name, value):
         if name in self.__slots__:
             object.__setattr__(self, name, value)
+        else:
+            raise RuntimeError("This node is read only")
+
+    def __delattr__(self, name):
         raise RuntimeError("This node is read only")
 
     def __getattr__(self, name):
-        klass_ref = getattr(self._node, "__isinstance__", None)
+        node = self._node
+        klass_ref = getattr(node, "__isinstance__", None)
         if klass_ref is not None:
-            if klass_ref == self._node.ref:
-                klass = self._node
-            else:
-                klass = self._revision.get_node(klass_ref)
-            getter = getattr(klass, "getter", None)
+            getter = self._revision.resolve_getter(klass_ref, node)
             if getter is not None:
                 return getter(self, name)
-        return getattr(self._node, name)
+        return getattr(node, name)
 
     def __call__(self):
         return self._node
@@ -173,40 +681,85 @@ class ReadOnlyNodeProxy(object):
 class ReadWriteNodeProxy(ReadOnlyNodeProxy):
     __slots__ = "_revision", "_node"
     def _check_value(self, value):
-        if value is None:
-            pass
-        elif isinstance(value, self.__atomic_types__):
-            pass
-        elif isinstance(value, Mapping):
-            for k, v in value.items():
-                self._check_value(v)
-        elif isinstance(value, Sequence):
-            for i in value:
-                self._check_value(i)
-        else:
-            raise TypeError(type(value))
+        check_value(value)
 
     def __setattr__(self, name, value):
         if name in self.__slots__:
             object.__setattr__(self, name, value)
         else:
+            node = self._node
+            revision = self._revision
             try:
-                self._check_value(value)
+                revision.validate(node, name, value)
             except TypeError as error:
                 raise AttributeError(name)
-            setattr(self._node, name, value)
+            self._record_write(name)
+            setattr(node, name, value)
+            revision.invalidate(node.ref)
 
-class CopyOnWriteNodeProxy(ReadWriteNodeProxy): pass
+    def __delattr__(self, name):
+        if name in self.__slots__:
+            raise AttributeError(name)
+        node = self._node
+        self._record_write(name)
+        delattr(node, name)
+        self._revision.invalidate(node.ref)
+
+    def _record_write(self, name):
+        node = self._node
+        if isinstance(node, DeltaNode):
+            state = node.delta.save(name)
+        else:
+            state = node.__dict__.get(name, undefined)
+        self._revision.runtime.record_undo(_undo_write, self._revision, node, name, state)
+
+def _undo_write(revision, node, name, state):
+    if isinstance(node, DeltaNode):
+        node.delta.restore(name, state)
+    else:
+        _restore_item(node.__dict__, name, state)
+    revision.invalidate(node.ref)
+
+class CopyOnWriteNodeProxy(ReadWriteNodeProxy):
+    """
+    Proxy for node inherited by working copy from one of previous 
+    revisions. Node itself is shared with finished revision, so first
+    write makes own version of the node in working copy.
+    """
+    __slots__ = "_revision", "_node"
+    def _detach(self):
+        revision = self._revision
+        node = self._node
+        if not revision.has_node(node.ref):
+            node = revision.copy_node(node)
+        else:
+            node = revision.get_node(node.ref)()
+        object.__setattr__(self, "_node", node)
+
+    def __setattr__(self, name, value):
+        if name not in self.__slots__:
+            self._detach()
+        super().__setattr__(name, value)
+
+    def __delattr__(self, name):
+        if name not in self.__slots__:
+            self._detach()
+        super().__delattr__(name)
 
 class Revision(Node):
-    __slots__ = "_rid", "_ancestors", "_nodes", "_refs", "_finished"
+    __slots__ = "_rid", "_ancestors", "_nodes", "_refs", "_finished", "_pending"
     def __init__(self, runtime, node_ref:NodeRef, revision_id:RevisionId, *ancestors):
         super().__init__(runtime, node_ref)
         self._rid = revision_id
         self._ancestors = tuple(ancestors)
         self._nodes = set() # NodeRef
-        self._refs = {} # NodeRef -> RevisionId
+        self._refs = PersistentMap() # NodeRef -> RevisionId
+        if self._ancestors:
+            # shares whole structure with first parent, O(1)
+            parent = runtime.get_revision(self._ancestors[0])
+            self._refs = parent._refs
         self._finished = False
+        self._pending = {} # (NodeRef, name) -> validator
         self.attach_node(self)
         runtime.register_revision(self)
 
@@ -219,7 +772,48 @@ class Revision(Node):
         return self._finished
 
     def finish(self):
+        runtime = self.runtime
+        runtime.record_undo(_restore_slots, self, {"_finished": False,
+            "_digest": self._digest, "_pending": dict(self._pending)})
+        self.validate_pending()
+        # sums cached while finishing must not outlive rolled back content
+        runtime.record_undo(self._refs.invalidate, list(self._nodes))
+        with gc_paused():
+            for node_ref in self._nodes:
+                if node_ref != self.ref:
+                    runtime.get_node(NodeId.intern(node_ref, self._rid)).seal()
+            # only paths to own nodes are summed, other subtrees are cached
+            self._digest = self._refs.digest(runtime.leaf_digest)
         self._finished = True
+        runtime._changed(runtime._unpublished, self._rid)
+
+    @property
+    def digest(self):
+        "Sum of digests of all nodes visible in finished revision"
+        if not self._finished:
+            raise RevisionNotFinishedError(self)
+        return self._digest
+
+    def seal(self):
+        pass
+
+    def diff(self, revision):
+        """
+        Yields `(node_ref, our_rid, their_rid)` for nodes with different
+        content in two finished revisions, absent ones are `undefined`.
+        Subtrees of refs maps with equal digests are not visited.
+        """
+        if not self._finished:
+            raise RevisionNotFinishedError(self)
+        if not revision.finished:
+            raise RevisionNotFinishedError(revision)
+        runtime = self.runtime
+        for node_ref, ours, theirs in self._refs.diff(
+                revision._refs, runtime.leaf_digest):
+            rid = theirs if ours is undefined else ours
+            if isinstance(runtime.get_node(NodeId.intern(node_ref, rid)), Revision):
+                continue
+            yield node_ref, ours, theirs
 
     @property
     def ancestors(self):
@@ -229,6 +823,13 @@ class Revision(Node):
     def nodes(self):
         return ReadOnlySet(self._nodes)
 
+    def own_nodes(self):
+        "Yields `(node_id, node)` pairs of nodes made in this revision"
+        runtime = self.runtime
+        for node_ref in self._nodes:
+            node_id = NodeId.intern(node_ref, self._rid)
+            yield node_id, runtime.get_node(node_id)
+
     @property
     def refs(self):
         return ReadOnlyDict(self._refs)
@@ -240,23 +841,270 @@ class Revision(Node):
         self.attach_node(node)
         return ReadWriteNodeProxy(self, node)
 
+    def create_nodes(self, nodes):
+        """
+        Creates many nodes at once, `nodes` is either their count or 
+        iterable of attribute dictionaries. Refs are drawn in one batch
+        and all nodes are attached with single call. Returns sequence
+        of proxies made on access.
+        """
+        if self.finished: 
+            raise RevisionFinishedError(self)
+        if isinstance(nodes, int):
+            contents = None
+            count = nodes
+        else:
+            contents = list(nodes)
+            count = len(contents)
+        with gc_paused():
+            refs = tuple(NodeRef.take(count))
+            created = self._make_nodes(refs, contents)
+            self.attach_nodes(created)
+        return ProxySequence(self, refs)
+
+    def _make_nodes(self, refs, contents):
+        runtime = self.runtime
+        new = Node.__new__
+        # slots are set directly, fresh nodes need no sealed check
+        set_runtime = Node._runtime.__set__
+        set_ref = Node._ref.__set__
+        set_digest = Node._digest.__set__
+        set_frozen = Node._frozen.__set__
+        created = []
+        append = created.append
+        for node_ref in refs:
+            node = new(Node)
+            set_runtime(node, runtime)
+            set_ref(node, node_ref)
+            set_digest(node, None)
+            set_frozen(node, None)
+            append(node)
+        if contents is not None:
+            for node, content in zip(created, contents):
+                node.__dict__ = dict(content)
+            for node in created:
+                for name, value in node.__dict__.items():
+                    try:
+                        self.validate(node, name, value)
+                    except TypeError as error:
+                        raise AttributeError(name)
+        return created
+
+    def attach_nodes(self, nodes):
+        "Attaches many nodes with single batched registration"
+        if self.finished:
+            raise RevisionFinishedError(self)
+        runtime = self.runtime
+        rid = self._rid
+        refs = [node.ref for node in nodes]
+        if runtime._undo.active:
+            runtime.record_undo(runtime._resolved.pop, rid, None)
+            runtime.record_undo(self._nodes.difference_update, 
+                [node_ref for node_ref in refs if node_ref not in self._nodes])
+            runtime.record_undo(_restore_slots, self, {"_refs": self._refs})
+        self._nodes.update(refs)
+        self._refs = self._refs.update((node_ref, rid) for node_ref in refs)
+        resolution = runtime._resolved.get(rid)
+        if resolution is not None and not resolution.depends.isdisjoint(refs):
+            resolution.clear()
+        runtime.register_nodes(
+            (NodeId(node.ref, rid), node) for node in nodes)
+
     def attach_node(self, node):
         if self.finished:
             raise RevisionFinishedError(self)
-        node_id = NodeId(node.ref, self.id)
+        node_id = NodeId.intern(node.ref, self.id)
+        runtime = self.runtime
+        runtime.record_undo(self.invalidate, node.ref)
+        if node.ref not in self._nodes:
+            runtime.record_undo(self._nodes.discard, node.ref)
+        runtime.record_undo(_restore_slots, self, {"_refs": self._refs})
         self._nodes.add(node.ref)
-        self._refs[node.ref] = self.id
+        self._refs = self._refs.set(node.ref, self.id)
+        self.invalidate(node.ref)
         self.runtime.register_node(node_id, node)
 
+    def copy_node(self, node):
+        """
+        Makes version of inherited node in this revision. Usually it is
+        a delta over given node, but every `keyframe_interval` versions 
+        full snapshot is made to keep reconstruction cost bounded.
+        """
+        if self.finished:
+            raise RevisionFinishedError(self)
+        if node.depth + 1 >= self.runtime.keyframe_interval:
+            copy = Node(self.runtime, node.ref)
+            copy.__dict__.update(node.content)
+        else:
+            base_id = NodeId.intern(node.ref, self._refs[node.ref])
+            copy = DeltaNode(self.runtime, base_id, node)
+        self.attach_node(copy)
+        return copy
+
+    def _resolution(self):
+        resolved = self.runtime._resolved
+        resolution = resolved.get(self._rid)
+        if resolution is None:
+            resolution = resolved[self._rid] = self._inherit_resolution()
+        return resolution
+
+    def _inherit_resolution(self):
+        """
+        Revision with single parent sees the same schema nodes as parent
+        except its own ones, so parent's cache is taken unless it used
+        any of them. Working copies do not compile validators again.
+        """
+        if len(self._ancestors) == 1:
+            parent = self.runtime._resolved.get(self._ancestors[0])
+            if parent is not None and parent.depends.isdisjoint(self._nodes):
+                return parent.copy()
+        return Resolution()
+
+    def _raw_node(self, node_ref:NodeRef):
+        try:
+            return self.get_node(node_ref)()
+        except NodeNotFound:
+            return None
+
+    def resolve_getter(self, klass_ref:NodeRef, node=None):
+        """
+        Returns `getter` of the class node visible in this revision. 
+        Resolution result is cached per revision. For finished revision
+        it never changes, for working copy it is reset by writes into
+        class nodes.
+        """
+        resolution = self._resolution()
+        getter = resolution.getters.get(klass_ref, undefined)
+        if getter is undefined:
+            if node is not None and klass_ref == node.ref:
+                klass = node
+            else:
+                klass = self.get_node(klass_ref)
+            getter = getattr(klass, "getter", None)
+            resolution.depends.add(klass_ref)
+            resolution.getters[klass_ref] = getter
+        return getter
+
+    def _find_field(self, klass_ref:NodeRef, name, depends, seen):
+        if klass_ref in seen:
+            return None
+        seen.add(klass_ref)
+        depends.add(klass_ref)
+        klass = self._raw_node(klass_ref)
+        if klass is None:
+            return None
+        fields = getattr(klass, "__fields__", None)
+        if fields is not None and name in fields:
+            return fields[name]
+        for base_ref in getattr(klass, "__bases__", ()):
+            field_ref = self._find_field(base_ref, name, depends, seen)
+            if field_ref is not None:
+                return field_ref
+        return None
+
+    def _compile_field(self, field_ref:NodeRef, resolution):
+        validator = resolution.fields.get(field_ref)
+        if validator is not None:
+            return validator
+        resolution.depends.add(field_ref)
+        field = self._raw_node(field_ref)
+        item_ref = getattr(field, "__item__", None)
+        key_ref = getattr(field, "__key__", None)
+        value_ref = getattr(field, "__value__", None)
+        kind = getattr(field, "__type__", None)
+        if item_ref is not None:
+            validator = list_validator(self._compile_field(item_ref, resolution))
+        elif key_ref is not None or value_ref is not None:
+            key = check_value if key_ref is None \
+                else self._compile_field(key_ref, resolution)
+            value = check_value if value_ref is None \
+                else self._compile_field(value_ref, resolution)
+            validator = dict_validator(key, value)
+        elif isinstance(kind, str) and kind in ATOMIC_FIELD_TYPES:
+            validator = atomic_validator(ATOMIC_FIELD_TYPES[kind])
+        elif isinstance(kind, NodeRef):
+            validator = atomic_validator((NodeRef,))
+        else:
+            validator = check_value
+        resolution.fields[field_ref] = validator
+        return validator
+
+    def resolve_validator(self, klass_ref:NodeRef, name):
+        """
+        Returns validator compiled from field schema of given attribute.
+        Fields are searched in class node and its bases. Attributes 
+        without schema are checked with generic `check_value`.
+        """
+        resolution = self._resolution()
+        key = (klass_ref, name)
+        validator = resolution.validators.get(key)
+        if validator is None:
+            field_ref = self._find_field(klass_ref, name, 
+                resolution.depends, set())
+            if isinstance(field_ref, NodeRef):
+                validator = self._compile_field(field_ref, resolution)
+            else:
+                validator = check_value
+            resolution.validators[key] = validator
+        return validator
+
+    def validate(self, node, name, value):
+        """
+        Validates value assigned to node attribute. Large containers are
+        validated at commit time when runtime defers validation.
+        """
+        klass_ref = getattr(node, "__isinstance__", None)
+        if klass_ref is None:
+            validator = check_value
+        else:
+            validator = self.resolve_validator(klass_ref, name)
+        threshold = self.runtime.defer_validation
+        if threshold is not None and _is_container(value) \
+                and len(value) > threshold:
+            key = (node.ref, name)
+            self.runtime.record_undo(_restore_item, self._pending, key,
+                self._pending.get(key, undefined))
+            self._pending[key] = validator
+            return
+        validator(value)
+
+    def validate_pending(self):
+        "Validates all deferred values in one pass"
+        for (node_ref, name), validator in self._pending.items():
+            node = self._raw_node(node_ref)
+            value = getattr(node, name, undefined)
+            if value is not undefined:
+                validator(value)
+        self._pending.clear()
+
+    def invalidate(self, node_ref:NodeRef):
+        resolution = self.runtime._resolved.get(self._rid)
+        if resolution is not None and node_ref in resolution.depends:
+            # dependent resolutions are not tracked, drop all of them
+            resolution.clear()
+
     def has_node(self, node_ref:NodeRef):
         return node_ref in self._nodes
 
     def search(self, node_ref:NodeRef):
         if self.has_node(node_ref):
             return self
-        return self.get_node(self._refs[node.ref])
+        return self.runtime.get_revision(self._refs[node_ref])
 
     def get_node(self, node_ref:NodeRef):
+        if not self._finished:
+            return self._make_proxy(node_ref)
+        # finished revision never changes, so read only proxies are shared
+        cache = self.runtime.proxy_cache
+        key = (self._rid, node_ref)
+        proxy = cache.get(key)
+        if proxy is None:
+            proxy = cache[key] = self._make_proxy(node_ref)
+            # revision finished inside transaction may be rolled back
+            self.runtime.record_undo(cache.pop, key)
+        return proxy
+
+    def _make_proxy(self, node_ref:NodeRef):
         if node_ref == self.ref:
             if self.finished:
                 return ReadOnlyNodeProxy(self, self)
@@ -264,7 +1112,7 @@ class Revision(Node):
                 return ReadWriteNodeProxy(self, self)
         
         if node_ref in self._nodes:
-            node_uid = NodeId(node_ref, self._rid)
+            node_uid = NodeId.intern(node_ref, self._rid)
             node = self.runtime.get_node(node_uid)
             if self.finished:
                 return ReadOnlyNodeProxy(self, node)
@@ -275,38 +1123,182 @@ class Revision(Node):
         if revision_id is None:
             raise NodeNotFound(node_ref)
 
-        node_uid = NodeId(node_ref, revision_id)
+        node_uid = NodeId.intern(node_ref, revision_id)
         node = self.runtime.get_node(node_uid)
 
+        if self.finished:
+            return ReadOnlyNodeProxy(self, node)
         return CopyOnWriteNodeProxy(self, node)
         
-"""
     def _merge(self, revision):
+        """
+        Merges finished revision into this working copy. Only nodes 
+        changed on our side since merge base are visited, nodes changed
+        on their side only are taken by sharing refs map. Returns list 
+        of conflicts, which are resolved in favour of working copy.
+        """
         if self.finished: 
             raise RevisionFinishedError(self)
         if not revision.finished: 
-            raise RevisionNotFinishedError(self)
-        # TODO: find conflicted nodes
-        for node_ref, node_id in revision._nodes.items():
-            if node_ref in self._nodes:
-                # node merge
-                pass
-            elif node_ref in self._refs:
-                revision_ref = self._refs[node_ref]
-                if revision_ref != revision.ref:
-                    # node merge
-                    pass
-            else:
-                self._refs[node_ref] = revision.ref
+            raise RevisionNotFinishedError(revision)
+        runtime = self.runtime
+        base_id = runtime.merge_base(self.id, revision.id)
+        if base_id is None:
+            base_refs = PersistentMap()
+        else:
+            base_refs = runtime.get_revision(base_id)._refs
+        theirs = revision._refs
+        merged = theirs
+        both = []
+        for node_ref, base_rid, our_rid in base_refs.diff(self._refs):
+            if our_rid is undefined:
+                continue
+            their_rid = theirs.get(node_ref, undefined)
+            if their_rid == base_rid or \
+                    runtime.same_content(node_ref, base_rid, their_rid):
+                merged = merged.set(node_ref, our_rid)
+            elif their_rid != our_rid:
+                merged = merged.set(node_ref, our_rid)
+                both.append((node_ref, base_rid, their_rid))
+        runtime.record_undo(runtime._resolved.pop, self._rid, None)
+        runtime.record_undo(_restore_slots, self, 
+            {"_refs": self._refs, "_ancestors": self._ancestors})
+        self._refs = merged
+        self._ancestors += (revision.id,)
+        runtime.update_ancestry(self)
+        self._resolution().clear()
+
+        conflicts = []
+        for node_ref, base_rid, their_rid in both:
+            conflicts.extend(self._merge_node(node_ref, base_rid, their_rid))
+        return conflicts
+
+    def _merge_node(self, node_ref:NodeRef, base_rid, their_rid):
+        runtime = self.runtime
+        if base_rid is undefined:
+            base = {}
+        else:
+            base = runtime.get_node(NodeId.intern(node_ref, base_rid)).content
+        theirs = runtime.get_node(NodeId.intern(node_ref, their_rid)).content
+        proxy = self.get_node(node_ref)
+        mine = proxy().content
+        merged, conflicts = merge_content(base, mine, theirs, (node_ref,))
+        for name, value in merged.items():
+            if mine.get(name, undefined) is not value:
+                setattr(proxy, name, value)
+        for name in list(mine):
+            if name not in merged:
+                delattr(proxy, name)
+        return conflicts
+
+class ProxySequence(Sequence):
+    "Nodes of revision given by refs, proxies are made on access"
+    __slots__ = "_revision", "_refs"
+
+    def __init__(self, revision, refs):
+        self._revision = revision
+        self._refs = refs
 
-        for node_ref, revision_ref in revision._refs.items():
-            if node_ref in self._nodes:
-                pass
-            elif node_ref in self._refs:
-                pass
-            else:
-                pass
-"""
+    @property
+    def refs(self):
+        return self._refs
+
+    def __len__(self):
+        return len(self._refs)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return ProxySequence(self._revision, self._refs[index])
+        return self._revision.get_node(self._refs[index])
+
+class WorkingCopy(Revision):
+    """
+    One of concurrent working copies of a branch, made by `checkout`.
+    It is identified apart from branch revisions and remembers nodes it
+    read, own nodes are its writes. Commit validates it against head
+    of the branch optimistically: when nobody committed meanwhile it is
+    taken as is, otherwise it is merged and only genuine conflicts fail
+    the commit.
+    """
+    __slots__ = "_branch", "_reads"
+    def __init__(self, runtime, branch_id:BranchId, base_id:RevisionId=None):
+        self._branch = branch_id
+        self._reads = set() # NodeRef
+        ancestors = () if base_id is None else (base_id,)
+        super().__init__(runtime, None, RevisionId.detached(), *ancestors)
+
+    @property
+    def branch(self):
+        return self._branch
+
+    @property
+    def reads(self):
+        return ReadOnlySet(self._reads)
+
+    @property
+    def writes(self):
+        return ReadOnlySet(self._nodes - {self.ref})
+
+    def get_node(self, node_ref:NodeRef):
+        if not self._finished:
+            self._reads.add(node_ref)
+        return super().get_node(node_ref)
+
+    def update(self):
+        """
+        Merges head of the branch into this working copy. Returns list
+        of conflicts, which are resolved in favour of working copy.
+        """
+        head = self.runtime.get_branch(self._branch).head
+        if head is None or self.runtime.is_ancestor(head, self._rid):
+            return []
+        return self._merge(self.runtime.get_revision(head))
+
+    def discard(self):
+        """
+        Forgets working copy which was not committed, with nodes made in
+        it. Committed ones are part of branch history and are kept.
+        """
+        if self._finished:
+            raise RevisionFinishedError(self)
+        self.runtime.discard_revision(self)
+
+    def _stale_reads(self, head:RevisionId):
+        runtime = self.runtime
+        base_id = runtime.merge_base(head, self._rid)
+        if base_id is None or base_id == head:
+            return []
+        base = runtime.get_revision(base_id)
+        return [node_ref 
+            for node_ref, ours, theirs in base.diff(runtime.get_revision(head))
+            if node_ref in self._reads and node_ref not in self._nodes]
+
+    def commit(self, serializable=False):
+        """
+        Finishes working copy and makes it next revision of the branch. 
+        With `serializable` commit also fails when nodes which were only
+        read were changed in the branch meanwhile. Nothing is changed
+        when commit fails. Returns id of new branch revision.
+        """
+        runtime = self.runtime
+        with runtime.commit_lock, runtime.atomic(sync=False):
+            branch = runtime.get_branch(self._branch)
+            wc = branch.wc
+            if wc._nodes - {wc.ref, branch.ref}:
+                raise RuntimeError(
+                    "Default working copy of the branch is not committed")
+            head = branch.head
+            if serializable and head is not None:
+                stale = self._stale_reads(head)
+                if stale:
+                    raise StaleReadError(stale)
+            self.finish()
+            conflicts = branch.merge(self._rid)
+            if conflicts:
+                raise CommitConflictError(conflicts)
+            branch.commit()
+        runtime.sync()
+        return branch.head
 
 class Branch(Node):
     __slots__ = "_bid", "_revision", "_wc"
@@ -320,6 +1312,8 @@ class Branch(Node):
         self._wc = wc.id
         wc.attach_node(self)
         runtime.register_branch(self)
+        runtime.publish()
+        runtime.sync()
 
     @property
     def id(self):
@@ -329,38 +1323,530 @@ class Branch(Node):
     def wc(self):
         return self.runtime.get_revision(self._wc)
 
+    @property
+    def wc_id(self):
+        "Id of working copy, which is made on first use after restore"
+        return self._wc
+
     @property
     def revision(self):
         return self._revision
 
+    @property
+    def head(self):
+        "Id of latest finished revision or None"
+        if not self._revision:
+            return None
+        return RevisionId(self._bid, self._revision - 1)
+
+    def checkout(self):
+        "Makes new working copy based on latest finished revision"
+        return WorkingCopy(self._runtime, self._bid, self.head)
+
     def merge(self, revision_id:RevisionId):
-        revision = runtime.get_revision(revision_id)
-        self.wc._merge(revision)
+        revision = self.runtime.get_revision(revision_id)
+        return self.wc._merge(revision)
 
     def commit(self):
+        with self._runtime.commit_lock:
+            self._commit()
+        # durability is waited for outside of lock, so commits share fsync
+        self._runtime.sync()
+
+    def _commit(self):
         old = self.wc
-        old._finished = True
+        old.finish()
+        self._runtime.record_undo(_restore_slots, self, 
+            {"_revision": self._revision, "_wc": self._wc})
         # here we need to create new Node with same bid
         self._revision += 1
         wc = Revision(self._runtime, None, RevisionId(self.id, self._revision), old.id)
         self._wc = wc.id
+        self._runtime._changed(self._runtime._moved, self._bid)
+        self._runtime.publish()
+
+class RevisionIndex(object):
+    """
+    Revisions of a single branch ordered by number. Supports constant 
+    time access to the latest revision, binary search by number and
+    ranged iteration.
+    """
+    __slots__ = "_numbers", "_ids"
+
+    def __init__(self):
+        self._numbers = []
+        self._ids = []
+
+    def add(self, revision_id:RevisionId):
+        number = revision_id.number
+        numbers = self._numbers
+        if not numbers or numbers[-1] < number:
+            numbers.append(number)
+            self._ids.append(revision_id)
+            return
+        position = bisect_left(numbers, number)
+        if numbers[position] == number:
+            self._ids[position] = revision_id
+        else:
+            numbers.insert(position, number)
+            self._ids.insert(position, revision_id)
+
+    def discard(self, revision_id:RevisionId):
+        position = bisect_left(self._numbers, revision_id.number)
+        if position < len(self._ids) and self._ids[position] == revision_id:
+            del self._numbers[position]
+            del self._ids[position]
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __iter__(self):
+        return iter(self._ids)
+
+    def latest(self):
+        if not self._ids:
+            return None
+        return self._ids[-1]
+
+    def find(self, number:int):
+        position = bisect_left(self._numbers, number)
+        if position < len(self._numbers) and self._numbers[position] == number:
+            return self._ids[position]
+        return None
+
+    def range(self, start:int=None, stop:int=None):
+        "Iterates over revisions with `start <= number < stop`"
+        low = 0 if start is None else bisect_left(self._numbers, start)
+        high = len(self._numbers) if stop is None else bisect_left(self._numbers, stop)
+        ids = self._ids
+        for position in range(low, high):
+            yield ids[position]
 
 # TODO: Determine whether node created or requested
-# TODO: Transactions for rollbacks 
 class Runtime(object):
-    def __init__(self):
+    def __init__(self, keyframe_interval=16, proxy_cache_size=4096, 
+            defer_validation=None, storage=None, cache_nodes=None,
+            cache_bytes=None, resolution_cache_size=1024):
+        self.keyframe_interval = keyframe_interval
+        # containers longer than that are validated at commit time
+        self.defer_validation = defer_validation
+        self.proxy_cache = LRUCache(proxy_cache_size)
+        self.blobs = BlobStore()
+        self._resolved = LRUCache(resolution_cache_size) # RevisionId -> Resolution
         self._nodes = {}
         self._revisions = {}
+        self._restored = set() # RevisionId read from storage
         self._branches = {}
+        self._branch_revisions = defaultdict(RevisionIndex)
+        self._ancestry = AncestryIndex()
+        # every thread rolls back and publishes only its own changes
+        self._local = threading.local()
+        # commits of concurrent working copies are validated one by one
+        self.commit_lock = threading.RLock()
+        # published changes are persisted, missing data is faulted in
+        self.storage = storage
+        if storage is not None:
+            # persisted nodes are evicted, working copies stay pinned
+            self._nodes = PinningCache(cache_nodes, cache_bytes, self._evicted)
+        self._ticket = None # of latest batch submitted to storage
+        if storage is None:
+            self._snapshots = SnapshotRegistry()
+        else:
+            self._snapshots = SnapshotRegistry(Snapshot(loader=self))
+            self._restore_branches()
+
+    @property
+    def _undo(self):
+        log = getattr(self._local, "undo", None)
+        if log is None:
+            log = self._local.undo = UndoLog()
+        return log
+
+    @property
+    def _unpublished(self):
+        "Revisions this thread finished since it last published"
+        changes = getattr(self._local, "unpublished", None)
+        if changes is None:
+            changes = self._local.unpublished = set() # RevisionId
+        return changes
+
+    @property
+    def _moved(self):
+        "Branches this thread moved since it last published"
+        changes = getattr(self._local, "moved", None)
+        if changes is None:
+            changes = self._local.moved = set() # BranchId
+        return changes
+
+    def _changed(self, changes, key):
+        "Adds key to unpublished changes, rollback takes it back out"
+        if key not in changes:
+            changes.add(key)
+            self._undo.record(changes.discard, key)
+
+    def atomic(self, sync=True):
+        "Returns savepoint in open transaction or new transaction"
+        if self._undo.active:
+            return self.savepoint()
+        return self.transaction(sync)
+
+    def transaction(self, sync=True):
+        """
+        Returns context manager of transaction. All changes made in the
+        block are undone if it exits with exception. Commits made in 
+        transaction are published when it is closed, with `sync` closing
+        waits until storage has made them durable.
+        """
+        if self._undo.active:
+            raise TransactionError("Transaction is already open")
+        return Savepoint(self._undo, self._close if sync else self.publish)
+
+    def _close(self):
+        self.publish()
+        self.sync()
+
+    def savepoint(self):
+        """
+        Returns context manager of savepoint nested in open transaction.
+        Rollback to it undoes only changes made after it.
+        """
+        if not self._undo.active:
+            raise TransactionError("Savepoint outside of transaction")
+        return Savepoint(self._undo)
+
+    def snapshot(self):
+        """
+        Returns context manager pinning latest published snapshot. 
+        Readers see finished revisions only and are not affected by
+        commits made while they hold the snapshot.
+        """
+        return self._snapshots.reader()
+
+    def publish(self):
+        """
+        Makes revisions finished and branches moved by this thread since
+        its last call visible to readers. Changes made in open
+        transaction are kept until it is closed.
+        """
+        with self.commit_lock:
+            self._publish()
+
+    def _publish(self):
+        if self._undo.active or not (self._unpublished or self._moved):
+            return
+        # rolled back changes are taken out of the sets by undo log
+        revisions = [self._revisions[revision_id]
+            for revision_id in self._unpublished]
+        branches = [self._branches[branch_id] for branch_id in self._moved]
+        with gc_paused():
+            if self.storage is not None:
+                # changes stay pending until storage has taken them
+                self._persist(revisions, branches)
+            snapshot = self._snapshots.current.publish(revisions, branches)
+        self._unpublished.clear()
+        self._moved.clear()
+        self._snapshots.publish(snapshot)
+
+    def _persist(self, revisions, branches):
+        "Writes revisions, their nodes and branch positions in one batch"
+        dumps = _codec.dumps
+        records = []
+        persisted = [] # (node_id, size of record)
+        for revision in revisions:
+            records.append(("revision", str(revision.id), 
+                dumps(self._revision_record(revision))))
+            for node_id, node in revision.own_nodes():
+                if node is not revision:
+                    records.append(("node", str(node_id), 
+                        dumps(_node_record(node))))
+                    persisted.append((node_id, len(records[-1][2])))
+        for branch in branches:
+            records.append(("branch", str(branch.id), dumps(dict(
+                ref=branch.ref,
+                revision=branch.revision,
+                content=dict(branch.content),
+                digest=branch._digest,
+                ))))
+        self._ticket = self.storage.submit(records)
+        for node_id, size in persisted:
+            self._nodes.unpin(node_id, size)
+
+    def sync(self):
+        "Returns when everything published so far is durable in storage"
+        if self.storage is not None:
+            self.storage.wait(self._ticket)
+
+    def _revision_record(self, revision):
+        "Refs are kept as changes over first parent"
+        ancestors = revision.ancestors
+        if ancestors:
+            base = self._revisions[ancestors[0]]._refs
+        else:
+            base = PersistentMap()
+        changed = []
+        removed = []
+        for node_ref, old, new in base.diff(revision._refs):
+            if new is undefined:
+                removed.append(node_ref)
+            else:
+                changed.append([node_ref, new])
+        return dict(
+            ref=revision.ref,
+            ancestors=list(ancestors),
+            nodes=list(revision._nodes),
+            changed=changed,
+            removed=removed,
+            digest=revision._digest,
+            )
+
+    def _restore_branches(self):
+        "Brings back stored branches, their revisions are read on demand"
+        keys = self.storage.keys("branch")
+        for key, data in zip(keys, self.storage.get_many("branch", keys)):
+            if data is not None:
+                self._restore_branch(BranchId.from_string(key), _codec.loads(data))
+        self.publish()
+
+    def _restore_branch(self, branch_id, record):
+        branch = Branch.__new__(Branch)
+        Node.__init__(branch, self, record["ref"])
+        branch._bid = branch_id
+        branch._revision = number = record["revision"]
+        index = self._branch_revisions[branch_id]
+        for position in range(number):
+            index.add(RevisionId(branch_id, position))
+        self._branches[branch_id] = branch
+        if number:
+            # branch node is sealed with its first revision
+            branch._freeze(record["digest"], record["content"])
+            self._nodes[NodeId(branch.ref, RevisionId(branch_id, 0))] = branch
+            # history is not read until working copy is asked for
+            branch._wc = RevisionId(branch_id, number)
+        else:
+            branch.__dict__.update(record["content"])
+            wc = Revision(self, None, RevisionId(branch_id, 0))
+            wc.attach_node(branch)
+            branch._wc = wc.id
+        self._moved.add(branch_id)
+        return branch
+
+    def _restore_working_copy(self, branch):
+        with self.commit_lock:
+            wc = self._revisions.get(branch.wc_id)
+            if wc is None:
+                wc = Revision(self, None, branch.wc_id, branch.head)
+        return wc
+
+    def _evicted(self, node_id, node):
+        "Releases payload of evicted node, it is read from storage again"
+        if type(node) is Node and node._frozen is not None:
+            self.blobs.release(node._digest, node._frozen)
+
+    def _load_nodes(self, node_ids):
+        """
+        Faults nodes in from storage and returns dictionary of them.
+        Bases of delta versions are asked in further batches, one per
+        level of delta chains.
+        """
+        records = {} # node_id -> (record, size)
+        pending = list(node_ids)
+        while pending:
+            bases = []
+            values = self.storage.get_many("node", [str(node_id) for node_id in pending])
+            for node_id, data in zip(pending, values):
+                if data is None:
+                    continue
+                record = _codec.loads(data)
+                records[node_id] = record, len(data)
+                base = record.get("base")
+                if base is not None and base not in records and base not in self._nodes:
+                    bases.append(base)
+            pending = list(dict.fromkeys(bases))
+        loaded = {}
+        for node_id in records:
+            # bases are made before versions built over them
+            chain = []
+            while node_id is not None and node_id not in loaded \
+                    and node_id not in self._nodes:
+                chain.append(node_id)
+                node_id = records[node_id][0].get("base")
+            for node_id in reversed(chain):
+                record, size = records[node_id]
+                node = loaded[node_id] = self._make_node(node_id, record, loaded)
+                self._nodes.add(node_id, node, size)
+        return loaded
+
+    def _make_node(self, node_id, record, loaded):
+        if "branch" in record:
+            return self.get_branch(record["branch"])
+        digest = record["digest"]
+        if "base" in record:
+            base = loaded.get(record["base"])
+            if base is None:
+                base = self._node(record["base"])
+            node = DeltaNode(self, record["base"], base)
+            delta = node.delta
+            for name, value in record["changed"].items():
+                delta[name] = value
+            for name in record["removed"]:
+                del delta[name]
+        else:
+            node = Node(self, node_id.node_ref)
+            node._freeze(digest, record["content"])
+        node._digest = digest
+        return node
+
+    def _load_revision(self, revision_id):
+        """
+        Faults revision in from storage with all its ancestors. Previous
+        revisions of a branch are first parents of next ones, so they
+        are asked ahead in batches growing twice with every round trip.
+        """
+        records = {}
+        pending = [revision_id]
+        ahead = 16
+        while pending:
+            parents = []
+            for rid in list(pending):
+                pending.extend(self._chain_ahead(rid, ahead, records))
+            pending = list(dict.fromkeys(pending))
+            values = self.storage.get_many("revision", [str(rid) for rid in pending])
+            for rid, data in zip(pending, values):
+                if data is None:
+                    continue
+                records[rid] = _codec.loads(data)
+            for rid in pending:
+                record = records.get(rid)
+                if record is None:
+                    continue
+                for parent in record["ancestors"]:
+                    if parent not in records and parent not in self._revisions:
+                        parents.append(parent)
+            pending = list(dict.fromkeys(parents))
+            ahead *= 2
+        if revision_id not in records:
+            return None
+        # ancestry index needs parents before children
+        stack = [revision_id]
+        while stack:
+            rid = stack[-1]
+            if rid in self._revisions:
+                stack.pop()
+                continue
+            missing = [parent for parent in records[rid]["ancestors"]
+                if parent not in self._revisions]
+            if missing:
+                stack.extend(missing)
+                continue
+            stack.pop()
+            self._make_revision(rid, records[rid])
+        return self._revisions[revision_id]
+
+    def _chain_ahead(self, revision_id, count, records):
+        "Yields ids of up to `count` previous revisions not loaded yet"
+        if revision_id.is_detached:
+            return
+        branch_id = revision_id.branch
+        for number in range(revision_id.number - 1,
+                max(revision_id.number - count, 0) - 1, -1):
+            rid = RevisionId(branch_id, number)
+            if rid in self._revisions or rid in records:
+                return
+            yield rid
+
+    def _make_revision(self, revision_id, record):
+        ancestors = tuple(record["ancestors"])
+        revision = Revision.__new__(Revision)
+        Node.__init__(revision, self, record["ref"])
+        revision._rid = revision_id
+        revision._ancestors = ancestors
+        revision._nodes = set(record["nodes"])
+        if ancestors:
+            refs = self._revisions[ancestors[0]]._refs
+        else:
+            refs = PersistentMap()
+        refs = refs.update(record["changed"])
+        for node_ref in record["removed"]:
+            refs = refs.discard(node_ref)
+        revision._refs = refs
+        revision._finished = True
+        revision._pending = {}
+        revision._digest = record["digest"]
+        self._nodes[NodeId(revision.ref, revision_id)] = revision
+        self._revisions[revision_id] = revision
+        self._restored.add(revision_id)
+        if not revision_id.is_detached:
+            self._branch_revisions[revision_id.branch].add(revision_id)
+        self._ancestry.add(revision_id, ancestors)
+
+    def record_undo(self, undo, *args):
+        "Logs `undo(*args)` call reverting change made in transaction"
+        self._undo.record(undo, *args)
 
     def register_node(self, node_id, node):
+        self._undo.record(_restore_item, self._nodes, node_id, 
+            self._nodes.get(node_id, undefined))
         self._nodes[node_id] = node
 
+    def register_nodes(self, pairs):
+        "Registers many `(node_id, node)` pairs with one dict update"
+        nodes = self._nodes
+        if not self._undo.active:
+            nodes.update(pairs)
+            return
+        pairs = list(pairs)
+        if any(node_id in nodes for node_id, node in pairs):
+            for node_id, node in pairs:
+                self.register_node(node_id, node)
+            return
+        self._undo.record(_forget_items, nodes, [node_id for node_id, node in pairs])
+        nodes.update(pairs)
+
     def register_revision(self, revision):
+        self._undo.record(self._unregister_revision, revision.id,
+            self._revisions.get(revision.id, undefined))
+        self._revisions[revision.id] = revision
+        if not revision.id.is_detached:
+            self._branch_revisions[revision.id.branch].add(revision.id)
+        self._ancestry.add(revision.id, revision.ancestors)
+
+    def _unregister_revision(self, revision_id, old):
+        self._resolved.pop(revision_id, None)
+        if old is undefined:
+            del self._revisions[revision_id]
+            if not revision_id.is_detached:
+                self._branch_revisions[revision_id.branch].discard(revision_id)
+            self._ancestry.discard(revision_id)
+        else:
+            self._revisions[revision_id] = old
+            self._ancestry.add(revision_id, old.ancestors)
+
+    def discard_revision(self, revision):
+        "Forgets unfinished detached revision with nodes made in it"
+        nodes = dict(revision.own_nodes())
+        self._undo.record(self._restore_revision, revision, nodes)
+        for node_id in nodes:
+            self._nodes.pop(node_id, None)
+        del self._revisions[revision.id]
+        self._ancestry.discard(revision.id)
+        self._resolved.pop(revision.id, None)
+
+    def _restore_revision(self, revision, nodes):
+        self._nodes.update(nodes)
         self._revisions[revision.id] = revision
+        self._ancestry.add(revision.id, revision.ancestors)
+
+    def update_ancestry(self, revision):
+        "Reindexes working copy revision after its ancestors changed"
+        self._undo.record(self._ancestry.add, revision.id, 
+            self._ancestry.parents(revision.id))
+        self._ancestry.add(revision.id, revision.ancestors)
 
     def register_branch(self, branch):
+        self._undo.record(_restore_item, self._branches, branch.id,
+            self._branches.get(branch.id, undefined))
         self._branches[branch.id] = branch
+        self._changed(self._moved, branch.id)
 
     def create_branch(self):
         branch = Branch(self)
@@ -371,23 +1857,157 @@ class Runtime(object):
         branch.merge(revision_id)
         return branch
 
+    def merge_base(self, first:RevisionId, second:RevisionId):
+        "Returns nearest common ancestor of two revisions or None"
+        return self._ancestry.merge_base(first, second)
+
+    def is_ancestor(self, ancestor:RevisionId, revision:RevisionId):
+        "Whether `ancestor` is reachable from `revision`"
+        return self._ancestry.is_ancestor(ancestor, revision)
+
+    def ahead_behind(self, first:RevisionId, second:RevisionId):
+        """
+        Returns pair of numbers of revisions reachable only from `first`
+        and only from `second`.
+        """
+        return self._ancestry.ahead_behind(first, second)
+
     def get_node(self, node_id:NodeId):
-        return self._nodes.get(node_id)
+        node = self._nodes.get(node_id)
+        if node is None and self.storage is not None:
+            node = self._load_nodes([node_id]).get(node_id)
+            if node is None and self.get_revision(node_id.revision) is not None:
+                # node of revision itself comes with it
+                node = self._nodes.get(node_id)
+        return node
+
+    def get_nodes(self, node_ids):
+        "Returns list of nodes, missing ones are faulted in by one batch"
+        node_ids = list(node_ids)
+        nodes = self._nodes
+        loaded = {}
+        if self.storage is not None:
+            missing = [node_id for node_id in node_ids if node_id not in nodes]
+            if missing:
+                loaded = self._load_nodes(missing)
+        return [loaded[node_id] if node_id in loaded else self.get_node(node_id)
+            for node_id in node_ids]
+
+    def _node(self, node_id:NodeId):
+        try:
+            return self._nodes[node_id]
+        except KeyError:
+            node = self.get_node(node_id)
+            if node is None:
+                raise
+            return node
+
+    def get_committed_node(self, node_id:NodeId):
+        """
+        Returns node of revision which snapshot has checked is published,
+        such nodes never change, evicted ones are read from storage.
+        """
+        return self.get_node(node_id)
+
+    def get_committed_revision(self, revision_id:RevisionId):
+        """
+        Returns revision restored from storage records or None. Ones
+        published by this runtime are held by snapshots, so working
+        copies and revisions of open transactions are never returned.
+        """
+        if revision_id in self._revisions:
+            if revision_id in self._restored:
+                return self._revisions[revision_id]
+            return None
+        return self._load_revision(revision_id)
+
+    def leaf_digest(self, node_ref:NodeRef, revision_id:RevisionId):
+        "Digest of refs map entry, revision nodes are not counted"
+        node = self._node(NodeId.intern(node_ref, revision_id))
+        if isinstance(node, Revision):
+            return 0
+        return entry_digest(node_ref, node.digest)
+
+    def same_content(self, node_ref:NodeRef, first, second):
+        "Compares digests of two finished versions of node"
+        if first is undefined or second is undefined:
+            return first is second
+        return self._node(NodeId.intern(node_ref, first)).digest == \
+            self._node(NodeId.intern(node_ref, second)).digest
+
+    def get_node_delta(self, node_id:NodeId, base_id:NodeId):
+        """
+        Returns DictDelta turning content of node version `base_id` into
+        `node_id`. Chain of delta versions between them is squashed, 
+        contents are compared only when chain passes through keyframe.
+        """
+        deltas = []
+        current = node_id
+        while current != base_id:
+            node = self._node(current)
+            if not isinstance(node, DeltaNode):
+                return DictDelta.between(
+                    self._node(base_id).content, 
+                    self._node(node_id).content)
+            deltas.append(node.changes)
+            current = node.base
+        return squash(reversed(deltas)) or DictDelta()
 
     def get_revision(self, revision_id:RevisionId):
-        return self._revisions.get(revision_id)
+        revision = self._revisions.get(revision_id)
+        if revision is None and self.storage is not None:
+            branch = self._branches.get(revision_id.branch)
+            if branch is not None and branch.wc_id == revision_id:
+                return self._restore_working_copy(branch)
+            revision = self._load_revision(revision_id)
+        return revision
 
     def get_branch(self, branch_id:BranchId):
-        return self._branches.get(branch_id)
+        branch = self._branches.get(branch_id)
+        if branch is None and self.storage is not None:
+            data = self.storage.get("branch", str(branch_id))
+            if data is not None:
+                branch = self._restore_branch(branch_id, _codec.loads(data))
+                self.publish()
+        return branch
 
     def get_branches(self):
         for bid in self._branches:
             yield bid
 
-    def get_revisions(self, branch_id:BranchId):
-        for rid in self._revisions:
-            if rid.branch == branch_id:
-                yield rid
+    def get_revisions(self, branch_id:BranchId, start:int=None, stop:int=None):
+        index = self._branch_revisions.get(branch_id)
+        if index is None:
+            return iter(())
+        return index.range(start, stop)
+
+    def get_revision_id(self, branch_id:BranchId, number:int):
+        index = self._branch_revisions.get(branch_id)
+        if index is None:
+            return None
+        return index.find(number)
+
+    def get_latest_revision_id(self, branch_id:BranchId):
+        index = self._branch_revisions.get(branch_id)
+        if index is None:
+            return None
+        return index.latest()
+
+def _node_record(node):
+    "Stored form of finished node version"
+    if isinstance(node, Branch):
+        return dict(branch=node.id)
+    if isinstance(node, DeltaNode):
+        changed = {}
+        removed = []
+        for name, (old, new) in node.changes.items():
+            if new is undefined:
+                removed.append(name)
+            else:
+                changed[name] = new
+        return dict(base=node.base, changed=changed, removed=removed, 
+            digest=node._digest)
+    return dict(content=dict(node.content), digest=node._digest)
 
 class BoilerPlate(object):
     def __init__(self, runtime, features=()):
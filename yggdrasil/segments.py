@@ -0,0 +1,309 @@
+"""
+Append-only segment log on local disk.
+
+Records are appended to numbered segment files, every batch written by
+`set_many` ends with commit marker, so batch torn by crash is dropped
+on open. Location of the latest value of every key is kept in memory,
+opening scans record headers only and values are read through `mmap`
+when asked. Overwritten values become garbage, compactor copies live
+records of mostly dead segments to the end of log and removes them.
+"""
+
+import logging
+import mmap
+import os
+import struct
+import threading
+import zlib
+
+from .storage import Storage
+
+_log = logging.getLogger(__name__)
+
+# crc32, length of kind, length of key, length of value
+_HEADER = struct.Struct("<IBHI")
+_SUFFIX = ".seg"
+# unmapped bytes at the end of segment which are read without remapping
+_MAP_STEP = 1 << 20
+
+class _Segment(object):
+    "Single segment file, mapped into memory on first read"
+    def __init__(self, path, number):
+        self.path = path
+        self.number = number
+        self.size = os.path.getsize(path) if os.path.exists(path) else 0
+        self.live = 0 # bytes of records which are latest for their keys
+        self.keys = set() # (kind, key) of those records
+        self._file = open(path, "ab+")
+        self._map = None
+
+    def append(self, data):
+        offset = self.size
+        self._file.write(data)
+        self.size += len(data)
+        return offset
+
+    def flush(self, sync=False):
+        self._file.flush()
+        if sync:
+            os.fsync(self._file.fileno())
+
+    def truncate(self, size):
+        self._unmap()
+        self._file.truncate(size)
+        self.size = size
+
+    def read(self, offset, length):
+        """
+        Returns copy of bytes, values must outlive mapping, which is
+        renewed as segment grows and closed by compaction. Tail of active
+        segment is read from file until it grows by `_MAP_STEP` past the
+        mapping, so appends do not remap the segment one by one.
+        """
+        end = offset + length
+        mapped = 0 if self._map is None else len(self._map)
+        if mapped < end:
+            self._file.flush()
+            if self.size - mapped < _MAP_STEP:
+                self._file.seek(offset)
+                return self._file.read(length)
+            self._unmap()
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._map[offset:end]
+
+    def records(self):
+        """
+        Yields `(offset, kind, key, value offset, value length)` of valid
+        records, commit markers have `kind` None. Stops at torn record.
+        """
+        if not self.size:
+            return
+        self._file.flush()
+        with mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            offset = 0
+            size = len(data)
+            while offset + _HEADER.size <= size:
+                crc, kind_length, key_length, value_length = \
+                    _HEADER.unpack_from(data, offset)
+                start = offset + _HEADER.size
+                end = start + kind_length + key_length + value_length
+                if end > size or zlib.crc32(data[offset + 4:end]) != crc:
+                    return
+                if kind_length:
+                    kind = data[start:start + kind_length].decode()
+                    key = data[start + kind_length:
+                        start + kind_length + key_length].decode()
+                    yield offset, kind, key, end - value_length, value_length
+                else:
+                    yield offset, None, None, end, 0
+                offset = end
+
+    def _unmap(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+    def close(self):
+        self._unmap()
+        self._file.close()
+
+def _record(kind, key, value):
+    kind = kind.encode()
+    key = key.encode()
+    body = _HEADER.pack(0, len(kind), len(key), len(value))[4:] + kind + key + value
+    return struct.pack("<I", zlib.crc32(body)) + body
+
+_MARKER = _record("", "", b"")
+
+def _sync_directory(path):
+    "Makes creation and removal of files in directory durable"
+    if not hasattr(os, "O_DIRECTORY"):
+        return
+    fd = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+class SegmentStorage(Storage):
+    """
+    Storage in directory of segment files. New segment is started when
+    active one grows over `segment_size` bytes. With `sync` every batch
+    is flushed to disk before `set_many` returns.
+    """
+    def __init__(self, path, segment_size=64 << 20, sync=False):
+        self._path = path
+        self._segment_size = segment_size
+        self._sync = sync
+        self._lock = threading.RLock()
+        self._segments = {} # number -> _Segment
+        self._index = {} # kind -> key -> (segment, offset of value, length)
+        os.makedirs(path, exist_ok=True)
+        numbers = sorted(int(name[:-len(_SUFFIX)]) for name in os.listdir(path)
+            if name.endswith(_SUFFIX))
+        for number in numbers:
+            self._open_segment(number)
+        if not numbers:
+            self._open_segment(1)
+        self._active = self._segments[max(self._segments)]
+
+    def _open_segment(self, number):
+        path = os.path.join(self._path, "{:08d}{}".format(number, _SUFFIX))
+        created = not os.path.exists(path)
+        segment = self._segments[number] = _Segment(path, number)
+        if created:
+            _sync_directory(self._path)
+        pending = []
+        committed = 0
+        for offset, kind, key, value_offset, length in segment.records():
+            if kind is None:
+                for entry in pending:
+                    self._locate(*entry)
+                pending = []
+                committed = value_offset
+            else:
+                pending.append((kind, key, segment, value_offset, length))
+        if committed < segment.size:
+            # batch torn by crash or never committed
+            segment.truncate(committed)
+        return segment
+
+    def _locate(self, kind, key, segment, offset, length):
+        keys = self._index.setdefault(kind, {})
+        old = keys.get(key)
+        if old is not None:
+            old[0].live -= self._size(kind, key, old[2])
+            old[0].keys.discard((kind, key))
+        keys[key] = segment, offset, length
+        segment.live += self._size(kind, key, length)
+        segment.keys.add((kind, key))
+
+    @staticmethod
+    def _size(kind, key, length):
+        return _HEADER.size + len(kind.encode()) + len(key.encode()) + length
+
+    def get_many(self, kind, keys):
+        with self._lock:
+            index = self._index.get(kind, {})
+            result = []
+            for key in keys:
+                location = index.get(key)
+                if location is None:
+                    result.append(None)
+                else:
+                    segment, offset, length = location
+                    result.append(segment.read(offset, length))
+            return result
+
+    def set_many(self, records):
+        with self._lock:
+            self._append([(kind, key, value) for kind, key, value in records])
+
+    def _append(self, records):
+        "Writes records as one batch, returns segment holding them"
+        segment = self._active
+        offsets = []
+        for kind, key, value in records:
+            data = _record(kind, key, value)
+            offsets.append(segment.append(data) + len(data) - len(value))
+        segment.append(_MARKER)
+        segment.flush(self._sync)
+        for (kind, key, value), offset in zip(records, offsets):
+            self._locate(kind, key, segment, offset, len(value))
+        if segment.size >= self._segment_size:
+            self._active = self._open_segment(segment.number + 1)
+        return segment
+
+    def keys(self, kind):
+        with self._lock:
+            return list(self._index.get(kind, ()))
+
+    def flush(self):
+        with self._lock:
+            for segment in self._segments.values():
+                segment.flush(True)
+
+    @property
+    def stats(self):
+        with self._lock:
+            size = sum(segment.size for segment in self._segments.values())
+            live = sum(segment.live for segment in self._segments.values())
+            return dict(
+                segments=len(self._segments),
+                bytes=size,
+                live_bytes=live,
+                garbage_ratio=1 - live / size if size else 0.0,
+                )
+
+    def compact(self, threshold=0.5):
+        """
+        Moves live records of finished segments with larger share of
+        garbage than `threshold` to the end of log and removes those
+        segments. Returns number of removed segments.
+        """
+        removed = 0
+        with self._lock:
+            candidates = [segment for segment in self._segments.values()
+                if segment is not self._active
+                and (not segment.size or 1 - segment.live / segment.size > threshold)]
+        for segment in candidates:
+            # lock is taken per segment, so writers wait for one copy only
+            with self._lock:
+                records = []
+                for kind, key in segment.keys:
+                    owner, offset, length = self._index[kind][key]
+                    records.append((kind, key, segment.read(offset, length)))
+                if records:
+                    # copies must be on disk before originals are gone
+                    self._append(records).flush(True)
+                del self._segments[segment.number]
+                segment.close()
+                os.remove(segment.path)
+                _sync_directory(self._path)
+                removed += 1
+        return removed
+
+    def close(self):
+        with self._lock:
+            for segment in self._segments.values():
+                segment.close()
+
+class Compactor(threading.Thread):
+    """
+    Background thread compacting segment storage every `interval` seconds.
+    Failed run is logged and retried next time, latest error is kept in
+    `stats`.
+    """
+    def __init__(self, storage, interval=60.0, threshold=0.5):
+        super().__init__(daemon=True)
+        self.storage = storage
+        self.interval = interval
+        self.threshold = threshold
+        self.runs = 0
+        self.failures = 0
+        self.removed = 0
+        self.last_error = None
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            self.runs += 1
+            try:
+                self.removed += self.storage.compact(self.threshold)
+            except Exception as error:
+                self.failures += 1
+                self.last_error = error
+                _log.exception("Segment compaction failed")
+
+    @property
+    def stats(self):
+        return dict(
+            runs=self.runs,
+            failures=self.failures,
+            removed=self.removed,
+            last_error=self.last_error,
+            )
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
@@ -0,0 +1,201 @@
+"""
+Multiversion snapshots of runtime.
+
+Writers publish committed state as immutable Snapshot built of
+persistent maps, which share structure with previous snapshot, so
+publishing costs as much as the changes since it. Readers pin current
+snapshot for the time of a request and never wait for commits. Retired
+snapshot is dropped from registry once the last reader unpins it.
+"""
+
+import threading
+
+from .hamt import PersistentMap
+
+class BranchState(object):
+    "Position of branch at the moment of publishing"
+    __slots__ = "_id", "_revision", "_wc"
+
+    def __init__(self, branch):
+        self._id = branch.id
+        self._revision = branch.revision
+        self._wc = branch.wc_id
+
+    @property
+    def id(self):
+        return self._id
+
+    @property
+    def revision(self):
+        "Number of working copy, all revisions before it are finished"
+        return self._revision
+
+    @property
+    def wc(self):
+        return self._wc
+
+    @property
+    def head(self):
+        "Id of latest finished revision or None"
+        if not self._revision:
+            return None
+        return self.revision_id(self._revision - 1)
+
+    def revision_id(self, number):
+        # class of working copy id, node module imports this one
+        return type(self._wc)(self._id, number)
+
+class Snapshot(object):
+    """
+    Immutable view of finished revisions, their nodes and branches.
+    Working copies are not visible, only their ids are. Finished data
+    missing from snapshot is asked from `loader`, if there is one, which
+    faults it in from persistent storage. Loader is asked only for ids
+    published before the snapshot.
+    """
+    __slots__ = "_epoch", "_nodes", "_revisions", "_branches", "_loader"
+
+    def __init__(self, epoch=0, nodes=None, revisions=None, branches=None,
+            loader=None):
+        self._epoch = epoch
+        self._loader = loader
+        self._nodes = PersistentMap() if nodes is None else nodes
+        self._revisions = PersistentMap() if revisions is None else revisions
+        self._branches = PersistentMap() if branches is None else branches
+
+    @property
+    def epoch(self):
+        return self._epoch
+
+    def publish(self, revisions, branches):
+        """
+        Returns next snapshot with given finished revisions and branch
+        states added.
+        """
+        nodes = {}
+        if self._loader is None:
+            # otherwise nodes are faulted in and evicted by loader
+            for revision in revisions:
+                for node_id, node in revision.own_nodes():
+                    nodes[node_id] = node
+        return Snapshot(self._epoch + 1,
+            self._nodes.update(nodes),
+            self._revisions.update((revision.id, revision)
+                for revision in revisions),
+            self._branches.update((branch.id, BranchState(branch))
+                for branch in branches),
+            self._loader)
+
+    def _published(self, revision_id):
+        """
+        Whether revision could be published before this snapshot. Ids of
+        detached working copies are never reused, so only revisions of
+        branches are checked against their position.
+        """
+        if revision_id.is_detached:
+            return True
+        state = self._branches.get(revision_id.branch)
+        return state is not None and revision_id.number < state.revision
+
+    def get_node(self, node_id):
+        node = self._nodes.get(node_id)
+        if node is None and self._loader is not None \
+                and self.get_revision(node_id.revision) is not None:
+            node = self._loader.get_committed_node(node_id)
+        return node
+
+    def get_revision(self, revision_id):
+        if not self._published(revision_id):
+            return None
+        revision = self._revisions.get(revision_id)
+        if revision is None and self._loader is not None:
+            revision = self._loader.get_committed_revision(revision_id)
+        return revision
+
+    def get_branch(self, branch_id):
+        return self._branches.get(branch_id)
+
+    def get_branches(self):
+        return iter(self._branches)
+
+    def get_revisions(self, branch_id, start:int=None, stop:int=None):
+        "Iterates over finished revisions with `start <= number < stop`"
+        state = self._branches.get(branch_id)
+        if state is None:
+            return iter(())
+        start = 0 if start is None else max(start, 0)
+        stop = state.revision if stop is None else min(stop, state.revision)
+        return (state.revision_id(number) for number in range(start, stop))
+
+    def get_latest_revision_id(self, branch_id):
+        state = self._branches.get(branch_id)
+        if state is None:
+            return None
+        return state.head
+
+class SnapshotRegistry(object):
+    """
+    Current snapshot and counts of readers pinning every epoch. Lock
+    guards bookkeeping only, so it is never held while commit runs.
+    """
+    def __init__(self, snapshot=None):
+        self._lock = threading.Lock()
+        self._current = Snapshot() if snapshot is None else snapshot
+        self._pins = {} # epoch -> number of readers
+        self._retired = {} # epoch -> snapshot still pinned by readers
+
+    @property
+    def current(self):
+        return self._current
+
+    def publish(self, snapshot):
+        with self._lock:
+            old = self._current
+            if old.epoch in self._pins:
+                self._retired[old.epoch] = old
+            self._current = snapshot
+
+    def pin(self):
+        with self._lock:
+            snapshot = self._current
+            self._pins[snapshot.epoch] = self._pins.get(snapshot.epoch, 0) + 1
+            return snapshot
+
+    def unpin(self, snapshot):
+        with self._lock:
+            count = self._pins[snapshot.epoch] - 1
+            if count:
+                self._pins[snapshot.epoch] = count
+                return
+            del self._pins[snapshot.epoch]
+            self._retired.pop(snapshot.epoch, None)
+
+    def reader(self):
+        "Returns context manager pinning current snapshot"
+        return _Reader(self)
+
+    @property
+    def stats(self):
+        with self._lock:
+            return dict(
+                epoch=self._current.epoch,
+                readers=sum(self._pins.values()),
+                pinned=len(self._pins),
+                retired=len(self._retired),
+                )
+
+class _Reader(object):
+    __slots__ = "_registry", "_snapshot"
+
+    def __init__(self, registry):
+        self._registry = registry
+        self._snapshot = None
+
+    def __enter__(self):
+        self._snapshot = self._registry.pin()
+        return self._snapshot
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._registry.unpin(self._snapshot)
+        self._snapshot = None
+        return False
@@ -0,0 +1,201 @@
+"""
+Persistent storage of runtime data.
+
+Storage keeps encoded records of finished revisions, their nodes and
+branch positions, grouped by kind. Records are written in batches when
+commits are published and read in batches when runtime faults missing
+data in, so a request costs a round trip per batch, not per record.
+"""
+
+import collections
+import json
+
+from .utils import ReadOnlyDict, ReadOnlySet
+
+class Codec(object):
+    """
+    JSON form of attribute values. Identifiers and containers which
+    JSON has no notion of are tagged, so they are decoded with the same
+    types. Identifier classes must provide `from_string`.
+    """
+    def __init__(self, *identifiers):
+        self._identifiers = {cls.__name__: cls for cls in identifiers}
+
+    def encode(self, value):
+        kind = type(value)
+        if value is None or kind in (bool, int, float, str):
+            return value
+        if kind.__name__ in self._identifiers:
+            return {"#": kind.__name__, "v": str(value)}
+        encode = self.encode
+        if kind is list:
+            return [encode(item) for item in value]
+        if kind is tuple:
+            return {"#": "tuple", "v": [encode(item) for item in value]}
+        if isinstance(value, collections.Mapping):
+            tag = "rodict" if isinstance(value, ReadOnlyDict) else "dict"
+            return {"#": tag, "v": [[encode(key), encode(item)]
+                for key, item in value.items()]}
+        if isinstance(value, collections.Set):
+            tag = "roset" if isinstance(value, ReadOnlySet) else "set"
+            return {"#": tag, "v": [encode(item) for item in value]}
+        if isinstance(value, collections.Sequence):
+            return [encode(item) for item in value]
+        raise TypeError("Can not encode {!r}".format(kind))
+
+    def decode(self, data):
+        if isinstance(data, list):
+            return [self.decode(item) for item in data]
+        if not isinstance(data, dict):
+            return data
+        tag = data["#"]
+        value = data["v"]
+        identifier = self._identifiers.get(tag)
+        if identifier is not None:
+            return identifier.from_string(value)
+        decode = self.decode
+        if tag == "tuple":
+            return tuple(decode(item) for item in value)
+        if tag in ("dict", "rodict"):
+            result = {decode(key): decode(item) for key, item in value}
+            return ReadOnlyDict(result) if tag == "rodict" else result
+        if tag in ("set", "roset"):
+            # sets of values are hashable only in frozen form
+            result = frozenset(decode(item) for item in value)
+            return ReadOnlySet(result) if tag == "roset" else result
+        raise ValueError("Unknown tag {!r}".format(tag))
+
+    def dumps(self, value):
+        return json.dumps(self.encode(value), separators=(",", ":")).encode()
+
+    def loads(self, data):
+        if isinstance(data, bytes):
+            data = data.decode()
+        return self.decode(json.loads(data))
+
+class Storage(object):
+    """
+    Interface of storage backends. Keys are strings, values are bytes,
+    every kind of records has its own key space.
+    """
+    volatile = False # whether records are lost with process
+
+    def get_many(self, kind, keys):
+        "Returns list of values for given keys, None for missing ones"
+        raise NotImplementedError()
+
+    def set_many(self, records):
+        """
+        Writes `(kind, key, value)` records all together, either all of
+        them become visible or none.
+        """
+        raise NotImplementedError()
+
+    def keys(self, kind):
+        "Returns keys of all records of given kind"
+        raise NotImplementedError()
+
+    def submit(self, records):
+        """
+        Writes records like `set_many`, returns ticket for `wait`. They
+        may become durable later, so caller can wait without holding
+        locks.
+        """
+        self.set_many(records)
+
+    def wait(self, ticket):
+        "Returns when records of `submit` which gave `ticket` are durable"
+
+    def flush(self):
+        "Makes all written records durable"
+
+    def get(self, kind, key):
+        return self.get_many(kind, [key])[0]
+
+    def set(self, kind, key, value):
+        self.set_many([(kind, key, value)])
+
+class MemoryStorage(Storage):
+    "Storage in process memory, counts requests like round trips"
+    volatile = True
+
+    def __init__(self):
+        self._records = collections.defaultdict(dict) # kind -> key -> value
+        self.requests = 0
+
+    def get_many(self, kind, keys):
+        self.requests += 1
+        records = self._records[kind]
+        return [records.get(key) for key in keys]
+
+    def set_many(self, records):
+        self.requests += 1
+        for kind, key, value in records:
+            self._records[kind][key] = value
+
+    def keys(self, kind):
+        self.requests += 1
+        return list(self._records[kind])
+
+class RedisStorage(Storage):
+    """
+    Storage in Redis. Records are plain string keys prefixed with kind,
+    keys of each kind are also kept in a set, so they can be listed.
+    Writes of one batch go in single MULTI/EXEC pipeline. Clients made
+    from connection parameters share connection pool.
+    """
+    __chunk__ = 1024 # keys per MGET/MSET command
+    _pools = {}
+
+    def __init__(self, client=None, prefix="yggdrasil:", **connection):
+        if client is None:
+            client = self.connect(**connection)
+        self._client = client
+        self._prefix = prefix
+
+    @classmethod
+    def connect(cls, **connection):
+        import redis
+        key = tuple(sorted(connection.items()))
+        pool = cls._pools.get(key)
+        if pool is None:
+            pool = cls._pools.setdefault(key, redis.ConnectionPool(**connection))
+        return redis.Redis(connection_pool=pool)
+
+    def _key(self, kind, key):
+        return "{}{}:{}".format(self._prefix, kind, key)
+
+    def _index(self, kind):
+        return "{}{}".format(self._prefix, kind)
+
+    def get_many(self, kind, keys):
+        keys = [self._key(kind, key) for key in keys]
+        if len(keys) <= self.__chunk__:
+            return self._client.mget(keys) if keys else []
+        pipeline = self._client.pipeline(transaction=False)
+        for start in range(0, len(keys), self.__chunk__):
+            pipeline.mget(keys[start:start + self.__chunk__])
+        result = []
+        for values in pipeline.execute():
+            result.extend(values)
+        return result
+
+    def set_many(self, records):
+        grouped = collections.defaultdict(dict)
+        for kind, key, value in records:
+            grouped[kind][key] = value
+        if not grouped:
+            return
+        pipeline = self._client.pipeline(transaction=True)
+        for kind, values in grouped.items():
+            keys = list(values)
+            for start in range(0, len(keys), self.__chunk__):
+                chunk = keys[start:start + self.__chunk__]
+                pipeline.mset({self._key(kind, key): values[key]
+                    for key in chunk})
+                pipeline.sadd(self._index(kind), *chunk)
+        pipeline.execute()
+
+    def keys(self, kind):
+        return [key.decode() if isinstance(key, bytes) else key
+            for key in self._client.smembers(self._index(kind))]
@@ -0,0 +1,110 @@
+import random
+import unittest
+from ..ancestry import AncestryIndex
+from ..node import *
+
+class TestAncestryIndex(unittest.TestCase):
+    def make(self, graph):
+        index = AncestryIndex()
+        for revision, parents in graph:
+            index.add(revision, parents)
+        return index
+
+    def test_linear(self):
+        index = self.make([(i, (i - 1,) if i else ()) for i in range(100)])
+        self.assertTrue(index.is_ancestor(3, 97))
+        self.assertFalse(index.is_ancestor(97, 3))
+        self.assertEqual(index.merge_base(40, 70), 40)
+        self.assertEqual(index.ahead_behind(70, 40), (30, 0))
+        self.assertEqual(index.ahead_behind(40, 70), (0, 30))
+
+    def test_fork_and_merge(self):
+        #   0 - 1 - 2 - 5
+        #        \     /
+        #         3 - 4 - 6
+        index = self.make([
+            (0, ()), (1, (0,)), (2, (1,)), (3, (1,)), 
+            (4, (3,)), (5, (2, 4)), (6, (4,)),
+            ])
+        self.assertEqual(index.merge_base(2, 4), 1)
+        self.assertEqual(index.merge_base(5, 6), 4)
+        self.assertTrue(index.is_ancestor(3, 5))
+        self.assertFalse(index.is_ancestor(6, 5))
+        self.assertEqual(index.ahead_behind(5, 6), (2, 1))
+        self.assertEqual(index.ahead_behind(2, 4), (1, 2))
+
+    def test_criss_cross(self):
+        index = self.make([
+            (0, ()), (1, (0,)), (2, (0,)), 
+            (3, (1, 2)), (4, (2, 1)),
+            ])
+        self.assertIn(index.merge_base(3, 4), (1, 2))
+
+    def test_unrelated(self):
+        index = self.make([(0, ()), (1, (0,)), (2, ()), (3, (2,))])
+        self.assertIsNone(index.merge_base(1, 3))
+        self.assertEqual(index.ahead_behind(1, 3), (2, 2))
+
+    def test_forks_are_not_painted(self):
+        # two long chains from 0, second one merges a side chain
+        graph = [(0, ())]
+        graph += [(i, (i - 1 if i > 1 else 0,)) for i in range(1, 500)]
+        graph += [(1000, (0,))]
+        graph += [(i, (i - 1,)) for i in range(1001, 1500)]
+        graph += [(2000, (1200,)), (2001, (1499, 2000))]
+        index = self.make(graph)
+        index._paint = lambda *args, **kwargs: self.fail("history painted")
+        self.assertEqual(index.merge_base(499, 1499), 0)
+        self.assertEqual(index.merge_base(499, 2001), 0)
+        self.assertEqual(index.merge_base(1300, 2001), 1300)
+        self.assertEqual(index.merge_base(2001, 1300), 1300)
+
+    def test_random(self):
+        generator = random.Random(7)
+        graph = []
+        ancestors = {}
+        for revision in range(300):
+            parents = ()
+            if revision and generator.random() < 0.95:
+                parents = tuple(generator.sample(range(max(0, revision - 20),
+                    revision), min(revision, generator.choice((1, 1, 1, 2)))))
+            graph.append((revision, parents))
+            ancestors[revision] = {revision}.union(*(ancestors[parent]
+                for parent in parents))
+        index = self.make(graph)
+        for i in range(500):
+            first, second = generator.sample(range(300), 2)
+            common = ancestors[first] & ancestors[second]
+            base = index.merge_base(first, second)
+            if not common:
+                self.assertIsNone(base)
+                continue
+            self.assertIn(base, common)
+            self.assertEqual(index.generation(base),
+                max(index.generation(revision) for revision in common))
+
+class TestRuntimeAncestry(unittest.TestCase):
+    def commit(self, branch):
+        revision_id = branch.wc.id
+        branch.commit()
+        return revision_id
+
+    def test_branches(self):
+        runtime = Runtime()
+        branch1 = runtime.create_branch()
+        self.commit(branch1)
+        fork_point = self.commit(branch1)
+        branch2 = runtime.fork(fork_point)
+        self.commit(branch2)
+        self.commit(branch1)
+        rid1 = self.commit(branch1)
+        rid2 = self.commit(branch2)
+        self.assertTrue(runtime.is_ancestor(fork_point, rid2))
+        self.assertFalse(runtime.is_ancestor(rid1, rid2))
+        self.assertEqual(runtime.merge_base(rid1, rid2), fork_point)
+        self.assertEqual(runtime.ahead_behind(rid1, rid2), (2, 2))
+        branch1.merge(rid2)
+        rid3 = self.commit(branch1)
+        self.assertTrue(runtime.is_ancestor(rid2, rid3))
+        self.assertEqual(runtime.merge_base(rid3, rid2), rid2)
+        self.assertEqual(runtime.ahead_behind(rid3, rid2), (3, 0))
@@ -0,0 +1,73 @@
+import unittest
+from ..delta import *
+from ..utils import ProxyDict, ProxySet, undefined
+
+class TestDictDelta(unittest.TestCase):
+    def test_from_proxy(self):
+        d = ProxyDict({"a": 0, "b": 1, "c": 2})
+        d["a"] = 10
+        d["c"] = 3
+        d["c"] = 2
+        del d["b"]
+        d["x"] = 5
+        delta = DictDelta.from_proxy(d)
+        self.assertEqual(delta, DictDelta.between({"a": 0, "b": 1, "c": 2}, d))
+        self.assertEqual(delta.dump(), 
+            dict(added={"x": 5}, changed={"a": (0, 10)}, removed={"b": 1}))
+
+    def test_compose(self):
+        a = {"x": 1, "y": 2, "z": 3}
+        b = {"x": 10, "y": 2, "w": 4}
+        c = {"x": 1, "w": 5, "z": 6}
+        ab = DictDelta.between(a, b)
+        bc = DictDelta.between(b, c)
+        self.assertEqual(ab.compose(bc), DictDelta.between(a, c))
+        self.assertEqual(ab.compose(bc).apply(a), c)
+        self.assertNotIn("x", ab.compose(bc))
+
+    def test_invert(self):
+        a = {"x": 1, "y": 2}
+        b = {"x": 3, "z": 4}
+        delta = DictDelta.between(a, b)
+        self.assertEqual(delta.invert().apply(b), a)
+        self.assertEqual(len(delta.compose(delta.invert())), 0)
+
+    def test_not_following(self):
+        first = DictDelta.between({"x": 1}, {"x": 2})
+        second = DictDelta.between({"x": 3}, {"x": 4})
+        self.assertRaises(ValueError, first.compose, second)
+
+    def test_squash(self):
+        states = [{"n": i, "even": i % 2 == 0} for i in range(10)]
+        states[5]["extra"] = True
+        deltas = [DictDelta.between(a, b) for a, b in zip(states, states[1:])]
+        self.assertEqual(squash(deltas), DictDelta.between(states[0], states[-1]))
+        self.assertIsNone(squash([]))
+
+    def test_dump_load(self):
+        delta = DictDelta.between({"a": 1, "b": 2}, {"a": 3, "c": 4})
+        self.assertEqual(DictDelta.load(delta.dump()), delta)
+        self.assertEqual(delta.old("c"), undefined)
+        self.assertEqual(delta.new("c"), 4)
+
+class TestSetDelta(unittest.TestCase):
+    def test_from_proxy(self):
+        s = ProxySet({1, 2, 3})
+        s.add(1)
+        s.add(4)
+        s.discard(4)
+        s.discard(2)
+        s.add(5)
+        self.assertEqual(SetDelta.from_proxy(s), SetDelta({5}, {2}))
+
+    def test_compose(self):
+        a, b, c = {1, 2, 3}, {2, 3, 4}, {1, 3, 5}
+        delta = SetDelta.between(a, b).compose(SetDelta.between(b, c))
+        self.assertEqual(delta, SetDelta.between(a, c))
+        self.assertEqual(delta.invert().apply(c), a)
+
+    def test_squash(self):
+        states = [{i, i + 1, i * 2} for i in range(8)]
+        deltas = [SetDelta.between(a, b) for a, b in zip(states, states[1:])]
+        self.assertEqual(squash(deltas), SetDelta.between(states[0], states[-1]))
+        self.assertEqual(SetDelta.load(deltas[0].dump()), deltas[0])
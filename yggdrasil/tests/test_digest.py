@@ -0,0 +1,30 @@
+import unittest
+from collections import UserList
+from ..digest import *
+from ..utils import ReadOnlyDict, ReadOnlySet
+
+class TestValueDigest(unittest.TestCase):
+    def test_equal(self):
+        pairs = [
+            ({"a": 1, "b": 2}, ReadOnlyDict({"b": 2, "a": 1})),
+            ({1, 2}, ReadOnlySet(frozenset({2, 1}))),
+            ([1, (2, 3)], UserList([1, (2, 3)])),
+            ((1, [2]), (1, [2])),
+            ]
+        for first, second in pairs:
+            self.assertEqual(first, second)
+            self.assertEqual(value_digest(first), value_digest(second))
+
+    def test_kinds(self):
+        pairs = [(1, 1.0), (True, 1), (False, 0), ((1, 2), [1, 2]),
+            ("a", b"a"), ((), [])]
+        for first, second in pairs:
+            self.assertNotEqual(value_digest(first), value_digest(second))
+
+    def test_equal_digest_means_equal(self):
+        values = [None, True, False, 0, 1, 1.0, 0.0, "", b"", "1", (), [],
+            (1,), [1], {1}, {1: 1}, {}, frozenset()]
+        for first in values:
+            for second in values:
+                if value_digest(first) == value_digest(second):
+                    self.assertEqual(first, second)
@@ -0,0 +1,62 @@
+import unittest
+from ..hamt import PersistentMap
+from ..utils import undefined
+
+class TestPersistentMap(unittest.TestCase):
+    def test_persistence(self):
+        empty = PersistentMap()
+        one = empty.set("a", 1)
+        two = one.set("b", 2)
+        self.assertEqual(len(empty), 0)
+        self.assertEqual(dict(one.items()), {"a": 1})
+        self.assertEqual(dict(two.items()), {"a": 1, "b": 2})
+        self.assertEqual(dict(two.discard("a").items()), {"b": 2})
+        self.assertIs(two.discard("c"), two)
+
+    def test_update(self):
+        base = PersistentMap((i, i) for i in range(1000))
+        updated = base.update((i, -i) for i in range(10))
+        self.assertEqual(len(updated), 1000)
+        self.assertEqual(updated[5], -5)
+        self.assertEqual(base[5], 5)
+        self.assertEqual(sorted(key for key, old, new in base.diff(updated)), 
+            list(range(1, 10)))
+
+    def test_collisions(self):
+        class Key(object):
+            def __init__(self, value):
+                self.value = value
+            def __hash__(self):
+                return self.value % 3
+            def __eq__(self, other):
+                return self.value == other.value
+        keys = [Key(i) for i in range(20)]
+        result = PersistentMap()
+        for key in keys:
+            result = result.set(key, key.value)
+        for key in keys[::2]:
+            result = result.discard(key)
+        self.assertEqual(sorted(result.values()), list(range(1, 20, 2)))
+        self.assertNotIn(keys[0], result)
+        self.assertIn(keys[1], result)
+
+    def test_digest(self):
+        leaf = lambda key, value: hash((key, value % 10)) & ((1 << 256) - 1)
+        base = PersistentMap((i, i) for i in range(1000))
+        same = PersistentMap((i, i + 10) for i in range(1000))
+        changed = base.set(5, 6)
+        self.assertEqual(base.digest(leaf), same.digest(leaf))
+        self.assertNotEqual(base.digest(leaf), changed.digest(leaf))
+        self.assertEqual(list(base.diff(same, leaf)), [])
+        self.assertEqual(list(base.diff(changed, leaf)), [(5, 5, 6)])
+        self.assertEqual(len(list(base.diff(same))), 1000)
+
+    def test_invalidate(self):
+        values = {i: i for i in range(1000)}
+        leaf = lambda key, value: values[key]
+        base = PersistentMap((i, i) for i in range(1000))
+        before = base.digest(leaf)
+        values[5] = 105
+        self.assertEqual(base.digest(leaf), before)
+        base.invalidate([5, 2000])
+        self.assertEqual(base.digest(leaf), before + 100)
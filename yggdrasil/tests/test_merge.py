@@ -0,0 +1,137 @@
+import unittest
+from ..node import *
+from ..merge import track_list, diff_lists, merge_content
+from ..utils import (
+    CCMergeConflict,
+    RCMergeConflict,
+    IIMergeConflict,
+    )
+
+class TestMergeContent(unittest.TestCase):
+    def test_track_list(self):
+        tracked = track_list(list("ABCDE"), list("AXCEF"))
+        self.assertEqual(list(tracked), list("AXCEF"))
+
+    def test_diff_lists(self):
+        self.assertEqual(
+            list(diff_lists(list(range(10)), [0, 1, "x", 3, 4, 5, 6, "y", "z", 9])), [
+            ("equal", 0, 2, 0, 2),
+            ("replace", 2, 3, 2, 3),
+            ("equal", 3, 7, 3, 7),
+            ("replace", 7, 9, 7, 9),
+            ("equal", 9, 10, 9, 10),
+            ])
+        # shortest edit script keeps longest common subsequence
+        opcodes = list(diff_lists("ABCABBA", "CBABAC"))
+        self.assertEqual(sum(i2 - i1 for tag, i1, i2, j1, j2 in opcodes 
+            if tag == "equal"), 4)
+
+    def test_merge_lists_apart(self):
+        base = tuple(range(1000))
+        mine = base[:100] + ("M",) + base[100:]
+        theirs = base[:700] + base[750:] + ("T",)
+        merged, conflicts = merge_content({"l": base}, {"l": mine}, {"l": theirs})
+        self.assertEqual(merged["l"], base[:100] + ("M",) + base[100:700] + 
+            base[750:] + ("T",))
+        self.assertEqual(conflicts, [])
+
+    def test_independent_keys(self):
+        merged, conflicts = merge_content(
+            {"a": 1, "b": 2, "c": 3},
+            {"a": 10, "b": 2, "c": 3},
+            {"a": 1, "b": 20},
+            )
+        self.assertEqual(merged, {"a": 10, "b": 20})
+        self.assertEqual(conflicts, [])
+
+    def test_nested(self):
+        merged, conflicts = merge_content(
+            {"d": {"x": 1, "y": 2}, "l": (1, 2, 3), "s": frozenset((1, 2))},
+            {"d": {"x": 5, "y": 2}, "l": (0, 1, 2, 3), "s": frozenset((1, 2, 3))},
+            {"d": {"x": 1, "y": 6}, "l": (1, 2, 3, 4), "s": frozenset((2,))},
+            )
+        self.assertEqual(merged, {
+            "d": {"x": 5, "y": 6}, 
+            "l": (0, 1, 2, 3, 4), 
+            "s": frozenset((2, 3)),
+            })
+        self.assertEqual(conflicts, [])
+
+    def test_conflicts(self):
+        merged, conflicts = merge_content(
+            {"a": 1, "b": 2},
+            {"a": 10, "c": 1},
+            {"a": 20, "b": 3, "c": 2},
+            ("node",),
+            )
+        self.assertEqual(merged, {"a": 10, "c": 1})
+        kinds = {conflict.path: type(conflict) for conflict in conflicts}
+        self.assertEqual(kinds, {
+            ("node", "a"): CCMergeConflict,
+            ("node", "b"): RCMergeConflict,
+            ("node", "c"): IIMergeConflict,
+            })
+
+class TestBranchMerge(unittest.TestCase):
+    def setUp(self):
+        self.runtime = Runtime()
+        self.main = self.runtime.create_branch()
+        node = self.main.wc.create_node()
+        node.title = "a"
+        node.tags = ("x", "y", "z")
+        self.ref = node.ref
+        self.main.commit()
+        self.base = self.main.wc.ancestors[0]
+        self.fork = self.runtime.fork(self.base)
+
+    def commit_fork(self):
+        self.fork.commit()
+        return self.fork.wc.ancestors[0]
+
+    def test_fork(self):
+        self.assertEqual(self.fork.wc.get_node(self.ref).title, "a")
+        self.assertIn(self.base, self.fork.wc.ancestors)
+
+    def test_theirs_only(self):
+        self.fork.wc.get_node(self.ref).title = "b"
+        rid = self.commit_fork()
+        self.assertEqual(self.main.merge(rid), [])
+        wc = self.main.wc
+        self.assertEqual(wc.get_node(self.ref).title, "b")
+        self.assertFalse(wc.has_node(self.ref))
+        self.assertEqual(wc.ancestors[-1], rid)
+
+    def test_ours_only(self):
+        self.main.wc.get_node(self.ref).title = "b"
+        other = self.fork.wc.create_node()
+        rid = self.commit_fork()
+        self.assertEqual(self.main.merge(rid), [])
+        wc = self.main.wc
+        self.assertEqual(wc.get_node(self.ref).title, "b")
+        self.assertIsNotNone(wc.get_node(other.ref))
+
+    def test_both_changed(self):
+        self.main.wc.get_node(self.ref).tags = ("w", "x", "y", "z")
+        node = self.fork.wc.get_node(self.ref)
+        node.title = "b"
+        node.tags = ("x", "y", "z", "q")
+        rid = self.commit_fork()
+        self.assertEqual(self.main.merge(rid), [])
+        node = self.main.wc.get_node(self.ref)
+        self.assertEqual(node.title, "b")
+        self.assertEqual(node.tags, ("w", "x", "y", "z", "q"))
+
+    def test_conflict(self):
+        self.main.wc.get_node(self.ref).title = "b"
+        self.fork.wc.get_node(self.ref).title = "c"
+        rid = self.commit_fork()
+        conflicts = self.main.merge(rid)
+        self.assertEqual(len(conflicts), 1)
+        self.assertIsInstance(conflicts[0], CCMergeConflict)
+        self.assertEqual(conflicts[0].path, (self.ref, "title"))
+        self.assertEqual(self.main.wc.get_node(self.ref).title, "b")
+
+    def test_merge_base(self):
+        rid = self.commit_fork()
+        self.assertEqual(self.runtime.merge_base(self.main.wc.id, rid), 
+            self.base)
@@ -0,0 +1,802 @@
+import unittest
+import threading
+from ..node import *
+from ..hamt import PersistentMap
+from ..utils import undefined, ReadOnlyDict, CCMergeConflict
+
+class TestIdentifiers(unittest.TestCase):
+    def test_node_ref_roundtrip(self):
+        ref = NodeRef()
+        text = str(ref)
+        self.assertEqual(len(text), 32)
+        self.assertEqual(NodeRef.from_string(text), ref)
+        self.assertEqual(hash(NodeRef.from_string(text)), hash(ref))
+
+    def test_branch_id_roundtrip(self):
+        bid = BranchId()
+        self.assertEqual(len(str(bid)), 16)
+        self.assertEqual(BranchId.from_string(str(bid)), bid)
+
+    def test_types_are_distinct(self):
+        ref = NodeRef(0)
+        bid = BranchId(0)
+        self.assertNotEqual(ref, bid)
+        self.assertEqual(str(ref), "2" * 32)
+
+    def test_revision_id(self):
+        bid = BranchId()
+        rid = RevisionId(bid, 10)
+        self.assertEqual(str(rid), "{}:0000000a".format(bid))
+        parsed = RevisionId.from_string(str(rid))
+        self.assertEqual(parsed, rid)
+        self.assertEqual(parsed.branch, bid)
+        self.assertEqual(parsed.number, 10)
+        self.assertNotEqual(rid, RevisionId(bid, 11))
+
+    def test_node_id(self):
+        ref = NodeRef()
+        rid = RevisionId(BranchId(), 3)
+        uid = NodeId(ref, rid)
+        self.assertEqual(len(str(uid)), 58)
+        parsed = NodeId.from_string(str(uid))
+        self.assertEqual(parsed, uid)
+        self.assertEqual(parsed.node_ref, ref)
+        self.assertEqual(parsed.revision, rid)
+
+    def test_interned(self):
+        ref = NodeRef()
+        rid = RevisionId(BranchId(), 0)
+        self.assertIs(NodeId.intern(ref, rid), NodeId.intern(ref, rid))
+
+    def test_compact(self):
+        ref = NodeRef()
+        self.assertFalse(hasattr(ref, "__dict__"))
+        self.assertFalse(hasattr(NodeId(ref, RevisionId(BranchId(), 0)), 
+            "__dict__"))
+
+class TestUUIDGenerator(unittest.TestCase):
+    def test_range(self):
+        generator = UUIDGenerator(16, batch=8)
+        for uid in generator.take(100):
+            self.assertTrue(0 <= uid < len(ALPHABET) ** 16)
+
+    def test_seeded(self):
+        first = UUIDGenerator(32, seed=1).take(10)
+        second = UUIDGenerator(32, seed=1).take(10)
+        self.assertEqual(first, second)
+        self.assertEqual(len(set(first)), 10)
+
+    def test_seed_uuids(self):
+        seed_uuids(5)
+        first = [NodeRef() for i in range(3)]
+        seed_uuids(5)
+        second = [NodeRef() for i in range(3)]
+        seed_uuids(None)
+        self.assertEqual(first, second)
+
+    def test_legacy_uuid_string(self):
+        uid = UUID(32)()
+        self.assertEqual(len(uid), 32)
+        self.assertEqual(str(NodeRef(uid)), str(uid))
+
+class TestRevisionIndex(unittest.TestCase):
+    def setUp(self):
+        self.runtime = Runtime()
+        self.branch = self.runtime.create_branch()
+        for i in range(5):
+            self.branch.commit()
+
+    def test_ordered(self):
+        numbers = [rid.number 
+            for rid in self.runtime.get_revisions(self.branch.id)]
+        self.assertEqual(numbers, list(range(6)))
+
+    def test_latest(self):
+        latest = self.runtime.get_latest_revision_id(self.branch.id)
+        self.assertEqual(latest, self.branch.wc.id)
+
+    def test_find(self):
+        rid = self.runtime.get_revision_id(self.branch.id, 3)
+        self.assertEqual(rid, RevisionId(self.branch.id, 3))
+        self.assertIsNone(self.runtime.get_revision_id(self.branch.id, 30))
+
+    def test_range(self):
+        numbers = [rid.number 
+            for rid in self.runtime.get_revisions(self.branch.id, 2, 4)]
+        self.assertEqual(numbers, [2, 3])
+
+    def test_other_branch(self):
+        other = self.runtime.create_branch()
+        self.assertEqual(len(list(self.runtime.get_revisions(other.id))), 1)
+        self.assertEqual(list(self.runtime.get_revisions(BranchId())), [])
+
+    def test_out_of_order(self):
+        index = RevisionIndex()
+        bid = BranchId()
+        for number in (5, 1, 3, 3):
+            index.add(RevisionId(bid, number))
+        self.assertEqual([rid.number for rid in index], [1, 3, 5])
+        self.assertEqual(index.latest(), RevisionId(bid, 5))
+
+class TestRevisionRefs(unittest.TestCase):
+    def setUp(self):
+        self.runtime = Runtime()
+        self.branch = self.runtime.create_branch()
+
+    def test_commit_inherits_refs(self):
+        wc = self.branch.wc
+        node = wc.create_node()
+        node.value = 1
+        self.branch.commit()
+        wc = self.branch.wc
+        self.assertFalse(wc.has_node(node.ref))
+        self.assertEqual(wc.refs[node.ref], RevisionId(self.branch.id, 0))
+        self.assertEqual(wc.get_node(node.ref).value, 1)
+        self.assertEqual(wc.search(node.ref).id, RevisionId(self.branch.id, 0))
+
+    def test_refs_are_shared(self):
+        first = self.branch.wc
+        for i in range(10):
+            first.create_node()
+        self.branch.commit()
+        second = self.branch.wc
+        self.assertEqual(len(second.refs), len(first.refs) + 1)
+        changed = list(first._refs.diff(second._refs))
+        self.assertEqual(changed, [(second.ref, undefined, second.id)])
+
+class TestCopyOnWrite(unittest.TestCase):
+    def setUp(self):
+        self.runtime = Runtime(keyframe_interval=4)
+        self.branch = self.runtime.create_branch()
+        node = self.branch.wc.create_node()
+        node.a = 1
+        node.b = 2
+        self.ref = node.ref
+        self.branch.commit()
+
+    def test_write_does_not_touch_finished(self):
+        first = self.branch.wc.ancestors[0]
+        node = self.branch.wc.get_node(self.ref)
+        self.assertIsInstance(node, CopyOnWriteNodeProxy)
+        node.a = 10
+        self.assertEqual(node.a, 10)
+        old = self.runtime.get_revision(first).get_node(self.ref)
+        self.assertIsInstance(old, ReadOnlyNodeProxy)
+        self.assertEqual(old.a, 1)
+
+    def test_delta(self):
+        wc = self.branch.wc
+        node = wc.get_node(self.ref)
+        node.a = 10
+        node.c = 3
+        del node.b
+        self.assertTrue(wc.has_node(self.ref))
+        copy = wc.get_node(self.ref)()
+        self.assertIsInstance(copy, DeltaNode)
+        self.assertEqual(dict(copy.content), {"a": 10, "c": 3})
+        self.assertEqual(copy.delta.changed, {"a": 1})
+        self.assertEqual(copy.delta.added, {"c"})
+        self.assertEqual(copy.delta.removed, {"b": 2})
+        self.assertEqual(copy.base, NodeId(self.ref, wc.ancestors[0]))
+
+    def test_stale_proxy(self):
+        wc = self.branch.wc
+        first = wc.get_node(self.ref)
+        second = wc.get_node(self.ref)
+        first.a = 10
+        second.b = 20
+        self.assertEqual(dict(wc.get_node(self.ref).content), 
+            {"a": 10, "b": 20})
+
+    def test_keyframes(self):
+        depths = []
+        for i in range(10):
+            node = self.branch.wc.get_node(self.ref)
+            node.a = i
+            depths.append(node().depth)
+            self.branch.commit()
+        self.assertEqual(depths, [1, 2, 3, 0, 1, 2, 3, 0, 1, 2])
+        node = self.branch.wc.get_node(self.ref)
+        self.assertEqual(dict(node.content), {"a": 9, "b": 2})
+
+    def test_node_delta(self):
+        first = NodeId(self.ref, self.branch.wc.ancestors[0])
+        for i in range(6):
+            node = self.branch.wc.get_node(self.ref)
+            node.a = i
+            if i == 1:
+                node.c = 3
+            last = NodeId(self.ref, self.branch.wc.id)
+            self.branch.commit()
+        delta = self.runtime.get_node_delta(last, first)
+        self.assertEqual(delta.dump(), 
+            dict(added={"c": 3}, changed={"a": (1, 5)}, removed={}))
+        self.assertEqual(delta.apply(self.runtime.get_node(first).content),
+            dict(self.runtime.get_node(last).content))
+
+class TestDigests(unittest.TestCase):
+    def setUp(self):
+        self.runtime = Runtime(keyframe_interval=4)
+        self.branch = self.runtime.create_branch()
+        node = self.branch.wc.create_node()
+        node.a = 1
+        node.b = [1, 2, {"c": 3}]
+        self.ref = node.ref
+        self.branch.commit()
+
+    def test_delta_digest(self):
+        for i in range(6):
+            node = self.branch.wc.get_node(self.ref)
+            node.a = i
+            self.branch.commit()
+            node = self.runtime.get_node(NodeId(self.ref, self.branch.wc.ancestors[0]))
+            copy = Node(self.runtime, self.ref)
+            copy.__dict__.update(node.content)
+            self.assertEqual(node.digest, copy.digest)
+
+    def test_revision_digest(self):
+        first = self.runtime.get_revision(self.branch.wc.ancestors[0])
+        node = self.branch.wc.get_node(self.ref)
+        node.a = 2
+        self.branch.commit()
+        second = self.runtime.get_revision(self.branch.wc.ancestors[0])
+        node = self.branch.wc.get_node(self.ref)
+        node.a = 1
+        self.branch.commit()
+        third = self.runtime.get_revision(self.branch.wc.ancestors[0])
+        self.assertNotEqual(first.digest, second.digest)
+        self.assertEqual(first.digest, third.digest)
+        self.assertEqual(list(first.diff(third)), [])
+        self.assertEqual(list(first.diff(second)), 
+            [(self.ref, first.id, second.id)])
+        self.assertRaises(RevisionNotFinishedError, lambda: self.branch.wc.digest)
+
+    def test_merge_skips_reverted(self):
+        fork = self.runtime.fork(self.branch.wc.ancestors[0])
+        node = fork.wc.get_node(self.ref)
+        node.a = 5
+        node.a = 1
+        fork.commit()
+        node = self.branch.wc.get_node(self.ref)
+        node.a = 7
+        conflicts = self.branch.merge(fork.wc.ancestors[0])
+        self.assertEqual(conflicts, [])
+        self.assertEqual(self.branch.wc.get_node(self.ref).a, 7)
+
+class TestBlobs(unittest.TestCase):
+    def test_shared_payloads(self):
+        runtime = Runtime()
+        branch = runtime.create_branch()
+        refs = []
+        for i in range(3):
+            node = branch.wc.create_node()
+            node.name = "StringField"
+            node.required = True
+            refs.append(node.ref)
+        other = branch.wc.create_node()
+        other.name = "IntegerField"
+        rid = branch.wc.id
+        branch.commit()
+        nodes = [runtime.get_node(NodeId(ref, rid)) for ref in refs]
+        self.assertIs(nodes[0]._frozen, nodes[1]._frozen)
+        self.assertIs(nodes[0]._frozen, nodes[2]._frozen)
+        self.assertIsNot(nodes[0]._frozen, 
+            runtime.get_node(NodeId(other.ref, rid))._frozen)
+        stats = runtime.blobs.stats
+        # branch node itself is empty one
+        self.assertEqual(stats["blobs"], 3)
+        self.assertEqual(stats["references"], 5)
+        self.assertGreater(stats["bytes_saved"], 0)
+        node = branch.wc.get_node(refs[0])
+        node.required = False
+        self.assertTrue(runtime.get_revision(rid).get_node(refs[1]).required)
+
+    def test_sealed_read_only(self):
+        runtime = Runtime()
+        branch = runtime.create_branch()
+        node = branch.wc.create_node()
+        node.name = "sealed"
+        rid = branch.wc.id
+        branch.commit()
+        sealed = runtime.get_node(NodeId(node.ref, rid))
+        with self.assertRaises(RuntimeError):
+            branch.color = "red"
+        with self.assertRaises(RuntimeError):
+            del sealed.name
+        self.assertFalse(hasattr(sealed, "color"))
+        self.assertEqual(sealed.name, "sealed")
+        # slots of sealed branch still move with it
+        branch.commit()
+        self.assertEqual(branch.revision, 2)
+
+class TestBulkCreation(unittest.TestCase):
+    def setUp(self):
+        self.runtime = Runtime()
+        self.branch = self.runtime.create_branch()
+
+    def test_count(self):
+        wc = self.branch.wc
+        nodes = wc.create_nodes(100)
+        self.assertEqual(len(nodes), 100)
+        self.assertEqual(len(set(nodes.refs)), 100)
+        self.assertEqual(len(wc.nodes), 102)
+        nodes[5].value = 5
+        self.assertEqual(wc.get_node(nodes.refs[5]).value, 5)
+        self.assertEqual([node.ref for node in nodes[10:12]],
+            list(nodes.refs[10:12]))
+
+    def test_contents(self):
+        wc = self.branch.wc
+        nodes = wc.create_nodes({"value": i} for i in range(10))
+        rid = wc.id
+        self.branch.commit()
+        refs = [self.runtime.get_node(NodeId(ref, rid)) for ref in nodes.refs]
+        self.assertEqual([node.value for node in refs], list(range(10)))
+        head = self.runtime.get_revision(rid)
+        self.assertEqual(head.get_node(nodes.refs[3]).value, 3)
+        with self.runtime.snapshot() as snapshot:
+            self.assertIsNotNone(snapshot.get_node(NodeId(nodes.refs[3], rid)))
+
+    def test_validation(self):
+        wc = self.branch.wc
+        string = wc.create_node()
+        string.__type__ = "String"
+        klass = wc.create_node()
+        klass.__fields__ = ReadOnlyDict(name=string.ref)
+        before = len(wc.nodes)
+        with self.assertRaises(AttributeError):
+            wc.create_nodes([
+                {"__isinstance__": klass.ref, "name": "a"},
+                {"__isinstance__": klass.ref, "name": 1},
+                ])
+        self.assertEqual(len(wc.nodes), before)
+
+    def test_rollback(self):
+        wc = self.branch.wc
+        before = len(self.runtime._nodes), len(wc.nodes), len(wc.refs)
+        with self.assertRaises(ValueError):
+            with self.runtime.transaction():
+                wc.create_nodes(10)
+                raise ValueError()
+        self.assertEqual(
+            (len(self.runtime._nodes), len(wc.nodes), len(wc.refs)), before)
+
+class TestTransactions(unittest.TestCase):
+    def setUp(self):
+        self.runtime = Runtime(keyframe_interval=4)
+        self.branch = self.runtime.create_branch()
+        node = self.branch.wc.create_node()
+        node.a = 1
+        node.b = 2
+        self.ref = node.ref
+        self.branch.commit()
+
+    def state(self):
+        runtime = self.runtime
+        wc = self.branch.wc
+        return (len(runtime._nodes), len(runtime._revisions),
+            len(runtime._branches), self.branch.revision, wc.id,
+            wc.ancestors, set(wc.nodes), dict(wc.refs),
+            dict(wc.get_node(self.ref).content), runtime.blobs.stats)
+
+    def test_rollback(self):
+        before = self.state()
+        with self.assertRaises(ValueError):
+            with self.runtime.transaction():
+                node = self.branch.wc.get_node(self.ref)
+                node.a = 10
+                del node.b
+                self.branch.wc.create_node().c = 3
+                self.branch.commit()
+                other = self.runtime.fork(self.branch.wc.ancestors[0])
+                other.wc.get_node(self.ref).a = 20
+                other.commit()
+                self.branch.merge(other.wc.ancestors[0])
+                raise ValueError()
+        self.assertEqual(self.state(), before)
+        self.assertIs(self.runtime.get_branch(self.branch.id), self.branch)
+        # numbers of rolled back revisions are taken again
+        self.branch.wc.get_node(self.ref).a = 5
+        self.branch.commit()
+        rid = self.branch.wc.ancestors[0]
+        self.assertEqual(rid.number, 1)
+        self.assertEqual(self.runtime.get_revision(rid).get_node(self.ref).a, 5)
+        self.assertEqual(list(self.runtime.get_revisions(self.branch.id)),
+            [RevisionId(self.branch.id, number) for number in range(3)])
+
+    def test_rollback_digest(self):
+        self.branch.wc.get_node(self.ref).a = 2
+        with self.assertRaises(ValueError):
+            with self.runtime.transaction():
+                self.branch.wc.get_node(self.ref).a = 3
+                self.branch.commit()
+                raise ValueError()
+        self.branch.wc.get_node(self.ref).a = 99
+        self.branch.commit()
+        first = self.runtime.get_revision(self.branch.head)
+        self.branch.wc.get_node(self.ref).a = 3
+        self.branch.commit()
+        second = self.runtime.get_revision(self.branch.head)
+        self.assertNotEqual(first.digest, second.digest)
+        self.assertEqual(first.digest, PersistentMap(first._refs.items()).digest(
+            self.runtime.leaf_digest))
+        self.assertEqual(list(first.diff(second)),
+            [(self.ref, first.id, second.id)])
+
+    def test_savepoints(self):
+        with self.runtime.transaction():
+            node = self.branch.wc.get_node(self.ref)
+            node.a = 10
+            with self.assertRaises(KeyError):
+                with self.runtime.savepoint():
+                    node.a = 20
+                    node.c = 3
+                    with self.runtime.savepoint() as inner:
+                        node.d = 4
+                        inner.rollback()
+                        self.assertFalse(hasattr(node, "d"))
+                        node.e = 5
+                    raise KeyError()
+            self.assertEqual(dict(node.content), {"a": 10, "b": 2})
+            self.assertEqual(node().delta.changed, {"a": 1})
+            self.assertEqual(node().delta.added, set())
+        self.assertEqual(len(self.runtime._undo), 0)
+        self.assertEqual(dict(self.branch.wc.get_node(self.ref).content),
+            {"a": 10, "b": 2})
+
+    def test_nesting(self):
+        with self.assertRaises(TransactionError):
+            self.runtime.savepoint()
+        with self.runtime.transaction():
+            with self.assertRaises(TransactionError):
+                self.runtime.transaction()
+
+class TestWorkingCopies(unittest.TestCase):
+    def setUp(self):
+        self.runtime = Runtime()
+        self.branch = self.runtime.create_branch()
+        first = self.branch.wc.create_node()
+        first.a = 1
+        first.b = 1
+        second = self.branch.wc.create_node()
+        second.a = 1
+        self.first = first.ref
+        self.second = second.ref
+        self.branch.commit()
+
+    def content(self, node_ref):
+        head = self.runtime.get_revision(self.branch.head)
+        return dict(head.get_node(node_ref).content)
+
+    def test_fast_forward(self):
+        wc = self.branch.checkout()
+        wc.get_node(self.first).a = 2
+        self.assertEqual(set(wc.writes), {self.first})
+        rid = wc.commit()
+        self.assertEqual(rid, RevisionId(self.branch.id, 1))
+        self.assertEqual(self.content(self.first), {"a": 2, "b": 1})
+        self.assertTrue(self.runtime.is_ancestor(wc.id, rid))
+
+    def test_detached(self):
+        wc = self.branch.checkout()
+        self.assertTrue(wc.id.is_detached)
+        self.assertIsNone(wc.id.branch)
+        self.assertEqual(wc.branch, self.branch.id)
+        wc.get_node(self.first).a = 2
+        self.assertEqual(set(self.runtime._branch_revisions), {self.branch.id})
+        rid = wc.commit()
+        revisions = list(self.runtime.get_revisions(self.branch.id))
+        self.assertIn(rid, revisions)
+        self.assertNotIn(wc.id, revisions)
+        self.assertEqual(RevisionId.from_string(str(wc.id)), wc.id)
+
+    def test_discard(self):
+        wc = self.branch.checkout()
+        node = wc.get_node(self.first)
+        node.a = 2
+        node_id = NodeId(self.first, wc.id)
+        with self.assertRaises(ValueError):
+            with self.runtime.transaction():
+                wc.discard()
+                self.assertIsNone(self.runtime.get_revision(wc.id))
+                raise ValueError()
+        self.assertIs(self.runtime.get_revision(wc.id), wc)
+        self.assertEqual(self.runtime.get_node(node_id).a, 2)
+        wc.discard()
+        self.assertIsNone(self.runtime.get_revision(wc.id))
+        self.assertIsNone(self.runtime.get_node(node_id))
+        self.assertNotIn(wc.id, self.runtime._ancestry)
+        committed = self.branch.checkout()
+        committed.commit()
+        self.assertRaises(RevisionFinishedError, committed.discard)
+        self.assertTrue(self.runtime.is_ancestor(committed.id, self.branch.head))
+
+    def test_auto_merge(self):
+        first = self.branch.checkout()
+        second = self.branch.checkout()
+        first.get_node(self.first).a = 2
+        second.get_node(self.first).b = 3
+        second.get_node(self.second).a = 3
+        first.commit()
+        second.commit()
+        self.assertEqual(self.branch.revision, 3)
+        self.assertEqual(self.content(self.first), {"a": 2, "b": 3})
+        self.assertEqual(self.content(self.second), {"a": 3})
+
+    def test_conflict(self):
+        first = self.branch.checkout()
+        second = self.branch.checkout()
+        first.get_node(self.first).a = 2
+        second.get_node(self.first).a = 3
+        first.commit()
+        with self.assertRaises(CommitConflictError) as context:
+            second.commit()
+        self.assertEqual(len(context.exception.conflicts), 1)
+        self.assertIsInstance(context.exception.conflicts[0], CCMergeConflict)
+        self.assertFalse(second.finished)
+        self.assertEqual(self.branch.revision, 2)
+        self.assertEqual(self.content(self.first), {"a": 2, "b": 1})
+        self.assertEqual(len(second.update()), 1)
+        second.commit()
+        self.assertEqual(self.content(self.first), {"a": 3, "b": 1})
+
+    def test_stale_read(self):
+        first = self.branch.checkout()
+        second = self.branch.checkout()
+        second.get_node(self.second).a = second.get_node(self.first).a + 1
+        first.get_node(self.first).a = 5
+        first.commit()
+        with self.assertRaises(StaleReadError) as context:
+            second.commit(serializable=True)
+        self.assertEqual(context.exception.conflicts, [self.first])
+        second.commit()
+        self.assertEqual(self.content(self.second), {"a": 2})
+
+    def test_threads(self):
+        refs = []
+        for i in range(8):
+            refs.append(self.branch.wc.create_node().ref)
+        self.branch.commit()
+        def work(node_ref):
+            for i in range(10):
+                wc = self.branch.checkout()
+                wc.get_node(node_ref).value = i
+                wc.commit()
+        threads = [threading.Thread(target=work, args=(ref,)) for ref in refs]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.branch.revision, 82)
+        for node_ref in refs:
+            self.assertEqual(self.content(node_ref), {"value": 9})
+
+class TestSnapshots(unittest.TestCase):
+    def setUp(self):
+        self.runtime = Runtime()
+        self.branch = self.runtime.create_branch()
+        node = self.branch.wc.create_node()
+        node.a = 1
+        self.ref = node.ref
+        self.branch.commit()
+
+    def test_committed_only(self):
+        rid = self.branch.wc.ancestors[0]
+        self.branch.wc.get_node(self.ref).a = 2
+        with self.runtime.snapshot() as snapshot:
+            self.assertEqual(list(snapshot.get_branches()), [self.branch.id])
+            state = snapshot.get_branch(self.branch.id)
+            self.assertEqual(state.wc, self.branch.wc.id)
+            self.assertEqual(state.head, rid)
+            self.assertEqual(list(snapshot.get_revisions(self.branch.id)), [rid])
+            self.assertIsNone(snapshot.get_revision(self.branch.wc.id))
+            self.assertIsNone(snapshot.get_node(NodeId(self.ref, self.branch.wc.id)))
+            self.assertEqual(snapshot.get_node(NodeId(self.ref, rid)).a, 1)
+
+    def test_pinned(self):
+        registry = self.runtime._snapshots
+        with self.runtime.snapshot() as old:
+            self.branch.commit()
+            with self.runtime.snapshot() as new:
+                self.assertEqual(new.epoch, old.epoch + 1)
+                self.assertEqual(registry.stats,
+                    dict(epoch=new.epoch, readers=2, pinned=2, retired=1))
+            self.assertEqual(old.get_latest_revision_id(self.branch.id).number, 0)
+            self.assertEqual(new.get_latest_revision_id(self.branch.id).number, 1)
+        self.assertEqual(registry.stats,
+            dict(epoch=new.epoch, readers=0, pinned=0, retired=0))
+
+    def test_transaction(self):
+        epoch = self.runtime._snapshots.current.epoch
+        with self.runtime.transaction():
+            self.branch.commit()
+            self.runtime.create_branch()
+            self.assertEqual(self.runtime._snapshots.current.epoch, epoch)
+        with self.runtime.snapshot() as snapshot:
+            self.assertEqual(snapshot.epoch, epoch + 1)
+            self.assertEqual(len(list(snapshot.get_branches())), 2)
+            self.assertEqual(len(list(snapshot.get_revisions(self.branch.id))), 2)
+        with self.assertRaises(ValueError):
+            with self.runtime.transaction():
+                self.branch.commit()
+                raise ValueError()
+        with self.runtime.snapshot() as snapshot:
+            self.assertEqual(len(list(snapshot.get_revisions(self.branch.id))), 2)
+            self.assertIsNone(snapshot.get_revision(self.branch.wc.id))
+
+    def test_other_thread_publishes(self):
+        committed = threading.Event()
+        published = threading.Event()
+        def rolled_back():
+            try:
+                with self.runtime.transaction():
+                    self.branch.commit()
+                    committed.set()
+                    published.wait()
+                    raise ValueError()
+            except ValueError:
+                pass
+        thread = threading.Thread(target=rolled_back)
+        thread.start()
+        committed.wait()
+        other = self.runtime.create_branch()
+        published.set()
+        thread.join()
+        head = RevisionId(self.branch.id, 0)
+        with self.runtime.snapshot() as snapshot:
+            self.assertIsNotNone(snapshot.get_branch(other.id))
+            self.assertEqual(snapshot.get_latest_revision_id(self.branch.id), head)
+            self.assertIsNone(snapshot.get_revision(RevisionId(self.branch.id, 1)))
+        self.branch.commit()
+        with self.runtime.snapshot() as snapshot:
+            revision = snapshot.get_revision(self.branch.head)
+            self.assertEqual(revision.id, RevisionId(self.branch.id, 1))
+            self.assertTrue(revision.finished)
+
+class TestProxyCache(unittest.TestCase):
+    def test_finished_proxies_are_shared(self):
+        runtime = Runtime()
+        branch = runtime.create_branch()
+        node = branch.wc.create_node()
+        branch.commit()
+        revision = runtime.get_revision(branch.wc.ancestors[0])
+        first = revision.get_node(node.ref)
+        second = revision.get_node(node.ref)
+        self.assertIs(first, second)
+        self.assertIsInstance(first, ReadOnlyNodeProxy)
+        self.assertEqual(runtime.proxy_cache.hits, 1)
+        self.assertEqual(runtime.proxy_cache.misses, 1)
+
+    def test_working_copy_not_cached(self):
+        runtime = Runtime()
+        branch = runtime.create_branch()
+        node = branch.wc.create_node()
+        self.assertIsNot(branch.wc.get_node(node.ref), 
+            branch.wc.get_node(node.ref))
+        self.assertEqual(len(runtime.proxy_cache), 0)
+
+class TestGetterResolution(unittest.TestCase):
+    def setUp(self):
+        self.runtime = Runtime()
+        self.branch = self.runtime.create_branch()
+        wc = self.branch.wc
+        self.klass = wc.create_node()
+        self.instance = wc.create_node()
+        self.instance.__isinstance__ = self.klass.ref
+        self.instance.value = 1
+
+    def test_invalidated_by_class_write(self):
+        calls = []
+        self.assertEqual(self.instance.value, 1)
+        self.klass().getter = lambda proxy, name: calls.append(name) or 42
+        # resolution is cached until class node is written through proxy
+        self.assertEqual(self.instance.value, 1)
+        self.klass.__name__ = "Klass"
+        self.assertEqual(self.instance.value, 42)
+        self.assertEqual(calls, ["value"])
+
+    def test_finished_revision(self):
+        self.branch.commit()
+        revision = self.runtime.get_revision(self.branch.wc.ancestors[0])
+        instance = revision.get_node(self.instance.ref)
+        self.assertEqual(instance.value, 1)
+        self.assertEqual(self.runtime._resolved.get(revision.id).getters, 
+            {self.klass.ref: None})
+
+class TestValidators(unittest.TestCase):
+    def setUp(self):
+        self.runtime = Runtime(defer_validation=100)
+        self.branch = self.runtime.create_branch()
+        wc = self.branch.wc
+        self.string = wc.create_node()
+        self.string.__type__ = "String"
+        integer = wc.create_node()
+        integer.__type__ = "Integer"
+        tags = wc.create_node()
+        tags.__item__ = self.string.ref
+        counts = wc.create_node()
+        counts.__key__ = self.string.ref
+        counts.__value__ = integer.ref
+        base = wc.create_node()
+        base.__fields__ = ReadOnlyDict(name=self.string.ref)
+        klass = wc.create_node()
+        klass.__bases__ = (base.ref, )
+        klass.__fields__ = ReadOnlyDict(tags=tags.ref, counts=counts.ref)
+        self.instance = wc.create_node()
+        self.instance.__isinstance__ = klass.ref
+
+    def test_atomic(self):
+        self.instance.name = "name"
+        self.instance.name = None
+        with self.assertRaises(AttributeError):
+            self.instance.name = 1
+
+    def test_list(self):
+        self.instance.tags = ("a", "b")
+        with self.assertRaises(AttributeError):
+            self.instance.tags = ("a", 1)
+        with self.assertRaises(AttributeError):
+            self.instance.tags = "ab"
+
+    def test_dict(self):
+        self.instance.counts = {"a": 1}
+        with self.assertRaises(AttributeError):
+            self.instance.counts = {"a": "b"}
+        with self.assertRaises(AttributeError):
+            self.instance.counts = {1: 1}
+
+    def test_unknown_attribute(self):
+        self.instance.other = (1, "a")
+        with self.assertRaises(AttributeError):
+            self.instance.other = object()
+
+    def test_field_change_resets_cache(self):
+        self.instance.name = "name"
+        self.string.__type__ = "Integer"
+        self.instance.name = 1
+        with self.assertRaises(AttributeError):
+            self.instance.name = "name"
+
+    def test_deferred_atomic_subclass(self):
+        class Integer(int):
+            pass
+        self.instance.other = Integer(1)
+        self.assertEqual(self.instance.other, 1)
+        with self.assertRaises(AttributeError):
+            self.instance.other = object()
+        self.assertEqual(self.branch.wc._pending, {})
+
+    def test_shared_with_next_working_copy(self):
+        self.instance.name = "name"
+        key = (self.instance.__isinstance__, "name")
+        validator = self.runtime._resolved.get(self.branch.wc.id).validators[key]
+        self.branch.commit()
+        wc = self.branch.wc
+        wc.get_node(self.instance.ref).name = "other"
+        self.assertIs(self.runtime._resolved.get(wc.id).validators[key], validator)
+        # schema node changed in working copy is not taken from parent
+        self.branch.commit()
+        wc = self.branch.wc
+        wc.get_node(self.string.ref).__type__ = "Integer"
+        wc.get_node(self.instance.ref).name = 1
+        self.assertIsNot(self.runtime._resolved.get(wc.id).validators[key],
+            validator)
+
+    def test_bounded(self):
+        runtime = Runtime(resolution_cache_size=4)
+        branch = runtime.create_branch()
+        node = branch.wc.create_node()
+        node.__isinstance__ = branch.wc.create_node().ref
+        for i in range(20):
+            branch.wc.get_node(node.ref).value = i
+            branch.commit()
+        self.assertLessEqual(len(runtime._resolved), 4)
+
+    def test_deferred(self):
+        self.instance.tags = ["a"] * 50 + [1] * 100
+        with self.assertRaises(ValidationError):
+            self.branch.commit()
+        self.instance.tags = ["a"] * 150
+        self.branch.commit()
+        self.assertTrue(self.runtime.get_revision(
+            self.branch.wc.ancestors[0]).finished)
@@ -0,0 +1,145 @@
+import mmap
+import os
+import shutil
+import tempfile
+import unittest
+from ..segments import *
+from ..node import Runtime
+
+class TestSegmentStorage(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.storage = SegmentStorage(self.path, segment_size=256)
+
+    def tearDown(self):
+        self.storage.close()
+        shutil.rmtree(self.path)
+
+    def reopen(self):
+        self.storage.close()
+        self.storage = SegmentStorage(self.path, segment_size=256)
+        return self.storage
+
+    def test_reopen(self):
+        self.storage.set_many([("node", str(i), b"value %d" % i) for i in range(20)])
+        self.storage.set("branch", "b", b"first")
+        self.storage.set("branch", "b", b"second")
+        self.assertGreater(self.storage.stats["segments"], 1)
+        storage = self.reopen()
+        self.assertEqual(storage.get_many("node", ["0", "19", "20"]),
+            [b"value 0", b"value 19", None])
+        self.assertEqual(storage.get("branch", "b"), b"second")
+        self.assertEqual(sorted(storage.keys("branch")), ["b"])
+
+    def test_torn_batch(self):
+        self.storage.set("node", "a", b"kept")
+        self.storage.set_many([("node", "b", b"torn"), ("node", "c", b"torn")])
+        segment = self.storage._active
+        size = segment.size
+        self.storage.close()
+        with open(segment.path, "r+b") as f:
+            f.truncate(size - 3)
+        storage = self.reopen()
+        self.assertEqual(storage.get_many("node", ["a", "b", "c"]), [b"kept", None, None])
+        storage.set("node", "d", b"after")
+        self.assertEqual(self.reopen().get("node", "d"), b"after")
+
+    def test_remap_steps(self):
+        storage = SegmentStorage(os.path.join(self.path, "large"))
+        value = b"x" * (64 << 10)
+        maps = []
+        original = mmap.mmap
+        mmap.mmap = lambda *args, **kwargs: maps.append(args) or original(*args, **kwargs)
+        try:
+            for i in range(48):
+                storage.set("node", str(i), value + str(i).encode())
+                self.assertEqual(storage.get("node", str(i)), value + str(i).encode())
+            self.assertEqual(storage.get("node", "0"), value + b"0")
+        finally:
+            mmap.mmap = original
+            storage.close()
+        # three megabytes are mapped in one megabyte steps
+        self.assertLessEqual(len(maps), 3)
+
+    def test_compact(self):
+        for i in range(30):
+            self.storage.set("branch", "b", b"revision %d" % i)
+        self.storage.set("node", "n", b"node")
+        before = self.storage.stats
+        self.assertGreater(before["garbage_ratio"], 0.5)
+        self.assertGreater(self.storage.compact(), 0)
+        after = self.storage.stats
+        self.assertLess(after["segments"], before["segments"])
+        self.assertLess(after["bytes"], before["bytes"])
+        self.assertEqual(self.storage.get("branch", "b"), b"revision 29")
+        storage = self.reopen()
+        self.assertEqual(storage.get("branch", "b"), b"revision 29")
+        self.assertEqual(storage.get("node", "n"), b"node")
+
+    def test_compact_durable(self):
+        for i in range(30):
+            self.storage.set("branch", "b", b"revision %d" % i)
+        events = []
+        fsync, remove = os.fsync, os.remove
+        os.fsync = lambda fd: events.append("fsync") or fsync(fd)
+        os.remove = lambda path: events.append("remove") or remove(path)
+        try:
+            self.assertGreater(self.storage.compact(), 0)
+        finally:
+            os.fsync, os.remove = fsync, remove
+        # copies are synced before removal, removal is synced after it
+        for index, event in enumerate(events):
+            if event == "remove":
+                self.assertEqual(events[index - 1], "fsync")
+                self.assertEqual(events[index + 1], "fsync")
+
+    def test_compactor(self):
+        for i in range(30):
+            self.storage.set("branch", "b", b"revision %d" % i)
+        compactor = Compactor(self.storage, interval=0.01)
+        compactor.start()
+        try:
+            for i in range(100):
+                if self.storage.stats["segments"] == 1:
+                    break
+                compactor._stopped.wait(0.01)
+        finally:
+            compactor.stop()
+        self.assertEqual(self.storage.stats["segments"], 1)
+        self.assertEqual(self.storage.get("branch", "b"), b"revision 29")
+
+    def test_compactor_failure(self):
+        for i in range(30):
+            self.storage.set("branch", "b", b"revision %d" % i)
+        remove = os.remove
+        def fail(path):
+            os.remove = remove
+            raise OSError("busy")
+        os.remove = fail
+        compactor = Compactor(self.storage, interval=0.01)
+        try:
+            with self.assertLogs("yggdrasil.segments", "ERROR"):
+                compactor.start()
+                for i in range(100):
+                    if self.storage.stats["segments"] == 1:
+                        break
+                    compactor._stopped.wait(0.01)
+        finally:
+            os.remove = remove
+            compactor.stop()
+        # next run after failure compacts the rest
+        self.assertEqual(self.storage.stats["segments"], 1)
+        stats = compactor.stats
+        self.assertEqual(stats["failures"], 1)
+        self.assertIsInstance(stats["last_error"], OSError)
+        self.assertGreater(stats["runs"], 1)
+
+    def test_runtime(self):
+        runtime = Runtime(storage=self.storage)
+        branch = runtime.create_branch()
+        node = branch.wc.create_node()
+        node.name = "stored"
+        branch.commit()
+        runtime = Runtime(storage=self.reopen())
+        restored = runtime.get_branch(branch.id)
+        self.assertEqual(restored.wc.get_node(node.ref).name, "stored")
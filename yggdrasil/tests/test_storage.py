@@ -0,0 +1,305 @@
+import unittest
+from ..storage import *
+from ..node import Runtime, NodeRef, BranchId, NodeId, RevisionId, DeltaNode, _codec
+from ..utils import ReadOnlyDict, ReadOnlySet
+
+class FakeRedis(object):
+    "In-process stand-in for the part of redis client used by storage"
+    def __init__(self):
+        self.data = {}
+        self.round_trips = 0
+
+    def _execute(self, name, *args):
+        return getattr(self, "_" + name)(*args)
+
+    def _mget(self, keys):
+        return [self.data.get(key) for key in keys]
+
+    def _mset(self, mapping):
+        self.data.update(mapping)
+        return True
+
+    def _sadd(self, key, *members):
+        members = {member.encode() for member in members}
+        values = self.data.setdefault(key, set())
+        added = len(members - values)
+        values.update(members)
+        return added
+
+    def _smembers(self, key):
+        return set(self.data.get(key, ()))
+
+    def mget(self, keys):
+        self.round_trips += 1
+        return self._mget(keys)
+
+    def smembers(self, key):
+        self.round_trips += 1
+        return self._smembers(key)
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+class FakePipeline(object):
+    def __init__(self, client):
+        self._client = client
+        self._commands = []
+
+    def __getattr__(self, name):
+        def queue(*args):
+            self._commands.append((name, args))
+            return self
+        return queue
+
+    def execute(self):
+        self._client.round_trips += 1
+        commands, self._commands = self._commands, []
+        return [self._client._execute(name, *args) for name, args in commands]
+
+class TestCodec(unittest.TestCase):
+    def test_roundtrip(self):
+        ref = NodeRef()
+        rid = RevisionId(BranchId(), 3)
+        value = {
+            "atoms": [None, True, 1, 1.5, "a", 1 << 200],
+            "ids": (ref, rid, NodeId(ref, rid)),
+            "fields": ReadOnlyDict({1: "x", (1, 2): ref}),
+            "set": ReadOnlySet(frozenset({1, 2})),
+            }
+        data = _codec.dumps(value)
+        self.assertIsInstance(data, bytes)
+        result = _codec.loads(data)
+        self.assertEqual(result, value)
+        self.assertIsInstance(result["ids"], tuple)
+        self.assertIsInstance(result["ids"][0], NodeRef)
+        self.assertIsInstance(result["fields"], ReadOnlyDict)
+        self.assertIsInstance(result["set"], ReadOnlySet)
+
+    def test_unknown(self):
+        with self.assertRaises(TypeError):
+            _codec.dumps(object())
+
+class StorageTests(object):
+    def make_storage(self):
+        raise NotImplementedError()
+
+    def setUp(self):
+        self.storage = self.make_storage()
+        self.runtime = Runtime(storage=self.storage)
+        self.branch = self.runtime.create_branch()
+        wc = self.branch.wc
+        first = wc.create_node()
+        second = wc.create_node()
+        first.name = "first"
+        first.items = (1, 2)
+        first.other = second.ref
+        second.name = "second"
+        self.first = first.ref
+        self.second = second.ref
+        self.branch.commit()
+        self.branch.wc.get_node(self.first).name = "changed"
+        del self.branch.wc.get_node(self.second).name
+        self.branch.commit()
+
+    def reopen(self):
+        return Runtime(storage=self.storage)
+
+    def test_batch_set(self):
+        self.branch.wc.get_node(self.first).name = "again"
+        self.assertEqual(self.requests(lambda: self.branch.commit()), 1)
+
+    def test_restore(self):
+        runtime = self.reopen()
+        self.assertEqual(list(runtime.get_branches()), [self.branch.id])
+        branch = runtime.get_branch(self.branch.id)
+        self.assertEqual(branch.revision, 2)
+        self.assertEqual(branch.wc.ancestors, (self.branch.head,))
+        first = branch.wc.get_node(self.first)
+        self.assertEqual(first.name, "changed")
+        self.assertEqual(first.items, (1, 2))
+        self.assertEqual(first.other, self.second)
+        self.assertFalse(hasattr(branch.wc.get_node(self.second), "name"))
+        node = runtime.get_node(NodeId(self.first, self.branch.head))
+        self.assertIsInstance(node, DeltaNode)
+        head = runtime.get_revision(self.branch.head)
+        self.assertEqual(head.digest,
+            self.runtime.get_revision(self.branch.head).digest)
+        self.assertEqual(list(head.diff(runtime.get_revision(head.ancestors[0]))),
+            list(self.runtime.get_revision(self.branch.head).diff(
+                self.runtime.get_revision(head.ancestors[0]))))
+
+    def test_reopen_long_branch(self):
+        for i in range(300):
+            self.branch.wc.get_node(self.first).value = i
+            self.branch.commit()
+        runtimes = []
+        self.assertEqual(self.requests(lambda: runtimes.append(self.reopen())), 3)
+        branch = runtimes[0].get_branch(self.branch.id)
+        # previous revisions are asked in batches growing twice
+        self.assertLessEqual(self.requests(lambda: branch.wc), 6)
+        self.assertEqual(branch.wc.get_node(self.first).value, 299)
+        self.assertEqual(branch.wc.ancestors, (self.branch.head,))
+
+    def test_open_reads_branches_only(self):
+        for i in range(3):
+            fork = self.runtime.fork(self.branch.head)
+            fork.wc.get_node(self.first).value = i
+            fork.commit()
+            self.branch.wc.get_node(self.first).value = i
+            self.branch.commit()
+        get_many = self.storage.get_many
+        kinds = []
+        def spy(kind, keys):
+            kinds.extend(kind for key in keys)
+            return get_many(kind, keys)
+        self.storage.get_many = spy
+        runtime = self.reopen()
+        self.assertEqual(kinds, ["branch"] * 4)
+        self.assertEqual(len(runtime._revisions), 0)
+
+    def test_uncommitted(self):
+        self.branch.wc.get_node(self.first).name = "lost"
+        self.runtime.create_branch()
+        runtime = self.reopen()
+        self.assertEqual(len(list(runtime.get_branches())), 2)
+        branch = runtime.get_branch(self.branch.id)
+        self.assertEqual(branch.wc.get_node(self.first).name, "changed")
+
+    def test_commit_after_restore(self):
+        runtime = self.reopen()
+        branch = runtime.get_branch(self.branch.id)
+        branch.wc.get_node(self.first).name = "restored"
+        branch.commit()
+        runtime = self.reopen()
+        branch = runtime.get_branch(self.branch.id)
+        self.assertEqual(branch.revision, 3)
+        self.assertEqual(branch.wc.get_node(self.first).name, "restored")
+
+    def test_merge(self):
+        fork = self.runtime.fork(self.branch.head)
+        fork.wc.get_node(self.second).name = "fork"
+        fork.commit()
+        runtime = self.reopen()
+        branch = runtime.get_branch(self.branch.id)
+        self.assertEqual(branch.merge(fork.head), [])
+        branch.commit()
+        self.assertEqual(branch.wc.get_node(self.second).name, "fork")
+        self.assertEqual(runtime.merge_base(branch.head, fork.head), fork.head)
+
+    def test_snapshot(self):
+        runtime = self.reopen()
+        with runtime.snapshot() as snapshot:
+            head = snapshot.get_latest_revision_id(self.branch.id)
+            self.assertEqual(head, self.branch.head)
+            self.assertEqual(snapshot.get_revision(head).id, head)
+            self.assertEqual(snapshot.get_node(NodeId(self.first, head)).name,
+                "changed")
+            wc = runtime.get_branch(self.branch.id).wc.id
+            self.assertIsNone(snapshot.get_revision(wc))
+
+    def test_snapshot_isolation(self):
+        runtime = self.reopen()
+        branch = runtime.get_branch(self.branch.id)
+        wc = branch.wc.id
+        with runtime.snapshot() as snapshot:
+            branch.wc.get_node(self.first).name = "later"
+            branch.commit()
+            self.assertIsNone(snapshot.get_revision(wc))
+            self.assertIsNone(snapshot.get_node(NodeId(self.first, wc)))
+            self.assertEqual(snapshot.get_latest_revision_id(branch.id),
+                self.branch.head)
+        with runtime.snapshot() as snapshot:
+            self.assertEqual(snapshot.get_node(NodeId(self.first, wc)).name,
+                "later")
+
+    def test_snapshot_transaction(self):
+        runtime = self.reopen()
+        branch = runtime.get_branch(self.branch.id)
+        wc = branch.wc.id
+        with self.assertRaises(ValueError):
+            with runtime.transaction():
+                branch.wc.get_node(self.first).name = "rolled back"
+                branch.commit()
+                with runtime.snapshot() as snapshot:
+                    self.assertIsNone(snapshot.get_revision(wc))
+                    self.assertIsNone(snapshot.get_node(NodeId(self.first, wc)))
+                    detached = branch.checkout()
+                    detached.finish()
+                    self.assertIsNone(snapshot.get_revision(detached.id))
+                raise ValueError()
+        with runtime.snapshot() as snapshot:
+            self.assertIsNone(snapshot.get_revision(wc))
+            head = snapshot.get_latest_revision_id(branch.id)
+            self.assertEqual(snapshot.get_node(NodeId(self.first, head)).name,
+                "changed")
+
+    def test_batch_get(self):
+        runtime = self.reopen()
+        head = runtime.get_revision(self.branch.head)
+        ids = [NodeId(self.first, head.refs[self.first]),
+            NodeId(self.second, head.refs[self.second])]
+        # both deltas, then both their bases
+        self.assertEqual(self.requests(lambda: runtime.get_nodes(ids)), 2)
+        self.assertEqual([node.ref for node in runtime.get_nodes(ids)],
+            [self.first, self.second])
+
+    def test_eviction(self):
+        runtime = Runtime(storage=self.storage, cache_nodes=1)
+        branch = runtime.get_branch(self.branch.id)
+        nodes = runtime._nodes
+        first = branch.wc.get_node(self.first)
+        branch.wc.get_node(self.second)
+        self.assertEqual(nodes.stats["size"], 1)
+        self.assertGreater(nodes.stats["evictions"], 0)
+        first.name = "pinned"
+        node_id = NodeId(self.first, branch.wc.id)
+        self.assertIn(node_id, nodes)
+        branch.wc.get_node(self.second)
+        self.assertIn(node_id, nodes)
+        branch.commit()
+        self.assertEqual(nodes.stats["size"], 1)
+        with runtime.snapshot() as snapshot:
+            self.assertEqual(snapshot.get_node(node_id).name, "pinned")
+        self.assertEqual(branch.wc.get_node(self.first).name, "pinned")
+
+    def test_evicted_payloads(self):
+        runtime = Runtime(storage=self.storage, cache_nodes=2)
+        branch = runtime.get_branch(self.branch.id)
+        refs = []
+        for i in range(20):
+            node = branch.wc.create_node()
+            node.value = i
+            refs.append(node.ref)
+        branch.commit()
+        # two cached nodes and the branch node
+        self.assertLessEqual(len(runtime.blobs), 3)
+        for i, ref in enumerate(refs):
+            self.assertEqual(branch.wc.get_node(ref).value, i)
+        self.assertLessEqual(len(runtime.blobs), 3)
+        self.assertLessEqual(runtime.blobs.stats["references"], 3)
+
+class TestMemoryStorage(StorageTests, unittest.TestCase):
+    def make_storage(self):
+        return MemoryStorage()
+
+    def requests(self, func):
+        before = self.storage.requests
+        func()
+        return self.storage.requests - before
+
+class TestRedisStorage(StorageTests, unittest.TestCase):
+    def make_storage(self):
+        self.client = FakeRedis()
+        return RedisStorage(self.client, prefix="test:")
+
+    def requests(self, func):
+        before = self.client.round_trips
+        func()
+        return self.client.round_trips - before
+
+    def test_chunks(self):
+        storage = RedisStorage(self.client, prefix="chunks:")
+        storage.__chunk__ = 2
+        storage.set_many([("node", str(i), b"%d" % i) for i in range(5)])
+        self.assertEqual(sorted(storage.keys("node")), [str(i) for i in range(5)])
+        self.assertEqual(storage.get_many("node", ["0", "4", "9"]), [b"0", b"4", None])
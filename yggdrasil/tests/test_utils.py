@@ -1,3 +1,5 @@
+import sys
+import threading
 import unittest
 from ..utils import *
 
@@ -63,6 +65,138 @@ class TestProxyDict(unittest.TestCase):
         d['a'] = 2
         self.check(d, {}, {"a":0}, {})
 
+class TestOverlayDict(unittest.TestCase):
+    check = TestProxyDict.check
+
+    def test_read_through(self):
+        base = {"a": 0, "b": 1}
+        d = OverlayDict(base)
+        self.assertEqual(d["a"], 0)
+        self.assertEqual(dict(d), base)
+        self.assertEqual(d.fields, {})
+
+    def test_changed_added_removed(self):
+        base = {"a": 0, "b": 1}
+        d = OverlayDict(base)
+        d["a"] = 2
+        d["c"] = 3
+        del d["b"]
+        self.assertEqual(dict(d), {"a": 2, "c": 3})
+        self.assertEqual(len(d), 2)
+        self.assertNotIn("b", d)
+        self.check(d, {"c"}, {"a": 0}, {"b": 1})
+        self.assertEqual(base, {"a": 0, "b": 1})
+
+    def test_removed_changed(self):
+        d = OverlayDict({"a": 0})
+        del d["a"]
+        d["a"] = 1
+        self.assertEqual(dict(d), {"a": 1})
+        self.check(d, {}, {"a": 0}, {})
+
+class TestLRUCache(unittest.TestCase):
+    def test_eviction(self):
+        cache = LRUCache(2)
+        cache["a"] = 1
+        cache["b"] = 2
+        self.assertEqual(cache.get("a"), 1)
+        cache["c"] = 3
+        self.assertNotIn("b", cache)
+        self.assertIn("a", cache)
+        self.assertEqual(cache.get("b"), None)
+        self.assertEqual(cache.stats, 
+            dict(size=2, maxsize=2, hits=1, misses=1, evictions=1))
+
+    def test_concurrent(self):
+        # smallest cache evicts the key other thread has just set
+        cache = LRUCache(1)
+        errors = []
+        def use(offset):
+            try:
+                for i in range(5000):
+                    key = (i + offset) % 16
+                    if cache.get(key) is None:
+                        cache[key] = i
+            except Exception as error:
+                errors.append(error)
+        interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        threads = [threading.Thread(target=use, args=(i,)) for i in range(4)]
+        try:
+            for thread in threads:
+                thread.start()
+        finally:
+            for thread in threads:
+                thread.join()
+            sys.setswitchinterval(interval)
+        self.assertEqual(errors, [])
+        stats = cache.stats
+        self.assertEqual(stats["size"], 1)
+        self.assertEqual(stats["hits"] + stats["misses"], 20000)
+
+class TestPinningCache(unittest.TestCase):
+    def test_pinned(self):
+        cache = PinningCache(maxsize=1)
+        cache["a"] = 1
+        cache["b"] = 2
+        cache.add("c", 3, 10)
+        cache.add("d", 4, 10)
+        self.assertEqual(set(cache), {"a", "b", "d"})
+        cache.unpin("a", 5)
+        self.assertEqual(set(cache), {"a", "b"})
+        self.assertEqual(cache.get("c"), None)
+        self.assertEqual(cache["b"], 2)
+        self.assertEqual(cache.stats, dict(pinned=1, size=1, bytes=5,
+            hits=1, misses=1, evictions=2))
+
+    def test_bytes(self):
+        cache = PinningCache(maxbytes=10)
+        cache.add("a", 1, 4)
+        cache.add("b", 2, 4)
+        self.assertEqual(cache.get("a"), 1)
+        cache.add("c", 3, 4)
+        self.assertEqual(set(cache), {"a", "c"})
+        cache["a"] = 10
+        self.assertEqual(cache.bytes, 4)
+        del cache["c"]
+        self.assertEqual(dict(cache), {"a": 10})
+        self.assertEqual(cache.bytes, 0)
+
+    def test_on_evict(self):
+        evicted = []
+        cache = PinningCache(maxsize=1, on_evict=lambda *pair: evicted.append(pair))
+        cache["a"] = 1
+        cache.add("b", 2)
+        cache.unpin("a")
+        self.assertEqual(evicted, [("b", 2)])
+
+    def test_concurrent(self):
+        cache = PinningCache(maxsize=8)
+        errors = []
+        stop = threading.Event()
+        def read():
+            try:
+                while not stop.is_set():
+                    for key in range(16):
+                        cache.get(key)
+            except Exception as error:
+                errors.append(error)
+        interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        readers = [threading.Thread(target=read) for i in range(4)]
+        try:
+            for reader in readers:
+                reader.start()
+            for i in range(20000):
+                cache.add(i % 16, i)
+        finally:
+            stop.set()
+            for reader in readers:
+                reader.join()
+            sys.setswitchinterval(interval)
+        self.assertEqual(errors, [])
+        self.assertEqual(len(cache), 8)
+
 class TestProxyList(unittest.TestCase):
     def test_remove_existing(self):
         l = ProxyList(list("ABC"))
@@ -115,6 +249,90 @@ class TestProxyList(unittest.TestCase):
         self.assertEquals(l[2], "C")
         self.assertEquals(len(l), 3)
 
+    def test_chunks(self):
+        class SmallProxyList(ProxyList):
+            __chunk__ = 2
+        l = SmallProxyList(range(10))
+        expected = list(range(10))
+        for index, value in ((0, "a"), (5, "b"), (12, "c"), (7, "d")):
+            l.insert(index, value)
+            expected.insert(index, value)
+        for index in (3, 0, 9, 4, 4):
+            del l[index]
+            del expected[index]
+        l[-1] = "e"
+        expected[-1] = "e"
+        self.assertEqual(list(l), expected)
+        self.assertEqual([l[i] for i in range(len(l))], expected)
+        self.assertEqual(len(l), len(expected))
+        self.assertEqual(sum(1 for item in l.__items__ if item.removed), 3)
+
+    def test_slices(self):
+        l = ProxyList(list("ABCDEF"))
+        l[1:3] = "XYZ"
+        del l[4:6]
+        l.extend("GH")
+        l.extend("I")
+        self.assertEqual(list(l), list("AXYZFGHI"))
+        self.assertEqual(l[2:5], list("YZF"))
+        self.assertEqual(len(l), 8)
+        self.assertEqual([type(item).__name__ for item in l.__items__], [
+            "ProxyListSpan", "ProxyListRange", "ProxyListRange",
+            "ProxyListRange", "ProxyListSpan", "ProxyListRange"])
+        l.clear()
+        self.assertEqual(list(l), [])
+        self.assertEqual(len(l.__items__), 1)
+
+    def test_merge_slices(self):
+        l1 = ProxyList(list("ABCDEF"))
+        l2 = ProxyList(list("ABCDEF"))
+        del l1[1:3]
+        l1.extend("XY")
+        l2[4:5] = "MN"
+        merge = ProxyListMerge(l1, l2)
+        self.assertEqual(merge.merge(), list("ADMNFXY"))
+        self.assertEqual(merge.conflicts, [])
+
+    def test_merge(self):
+        l1 = ProxyList(list("ABCDEF"))
+        l2 = ProxyList(list("ABCDEF"))
+        l1.insert(2, "M")
+        del l1[5]
+        l2.insert(3, "N")
+        l2[0] = "Z"
+        merge = ProxyListMerge(l1, l2)
+        self.assertEqual(merge.merge(), list("ZBMCNDF"))
+        self.assertEqual(merge.conflicts, [])
+
+    def test_merge_runs(self):
+        base = tuple(range(10000))
+        l1 = ProxyList(base)
+        l2 = ProxyList(base)
+        l1.insert(10, "M")
+        l2.insert(9000, "N")
+        del l2[5000:6000]
+        merge = ProxyListMerge(l1, l2)
+        result = list(merge)
+        self.assertEqual(result, 
+            list(range(10)) + ["M"] + list(range(10, 5000)) +
+            list(range(6000, 9000)) + ["N"] + list(range(9000, 10000)))
+        self.assertEqual(merge.conflicts, [])
+
+    def test_merge_conflict(self):
+        l1 = ProxyList(list("ABC"))
+        l2 = ProxyList(list("ABC"))
+        l1[1] = "X"
+        l2[1] = "Y"
+        del l2[2]
+        merge = ProxyListMerge(l1, l2, ("path",))
+        self.assertEqual(merge.merge(), list("AX"))
+        self.assertEqual(len(merge.conflicts), 1)
+        conflict = merge.conflicts[0]
+        self.assertIsInstance(conflict, CCMergeConflict)
+        self.assertEqual(conflict.path, ("path", 1))
+        self.assertEqual((conflict.base, conflict.mine, conflict.theirs), 
+            ("B", "X", "Y"))
+
 """
     def test_merge_1(self):
         l1 = ProxyList(list("ABCDEF"))
@@ -0,0 +1,135 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from ..wal import *
+from ..storage import MemoryStorage
+from ..segments import SegmentStorage
+from ..node import Runtime
+
+class TestWriteAheadLog(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.log_path = os.path.join(self.path, "wal.log")
+        # cleanups run in reverse, files are closed before removal
+        self.addCleanup(shutil.rmtree, self.path)
+
+    def open(self, storage=None, **kwargs):
+        storage = MemoryStorage() if storage is None else storage
+        log = WriteAheadLog(self.log_path, **kwargs)
+        self.addCleanup(log.close)
+        return LoggedStorage(storage, log)
+
+    def segments(self):
+        storage = SegmentStorage(os.path.join(self.path, "segments"))
+        self.addCleanup(storage.close)
+        return storage
+
+    def test_replay(self):
+        storage = self.open()
+        storage.set_many([("node", "a", b"1"), ("node", "b", b"2")])
+        storage.log.close()
+        storage = self.open()
+        self.assertEqual(storage.get_many("node", ["a", "b"]), [b"1", b"2"])
+
+    def test_torn_tail(self):
+        storage = self.open()
+        storage.set("node", "a", b"kept")
+        storage.set("node", "b", b"torn")
+        storage.log.close()
+        with open(self.log_path, "r+b") as f:
+            f.truncate(os.path.getsize(self.log_path) - 2)
+        storage = self.open()
+        self.assertEqual(storage.get_many("node", ["a", "b"]), [b"kept", None])
+
+    def test_unsynced(self):
+        storage = self.open()
+        ticket = storage.submit([("node", "a", b"1")])
+        self.assertEqual(storage.get("node", "a"), b"1")
+        self.assertEqual(os.path.getsize(self.log_path), 0)
+        storage.wait(ticket)
+        self.assertGreater(os.path.getsize(self.log_path), 0)
+
+    def test_checkpoint(self):
+        storage = self.open(self.segments())
+        storage.set("node", "a", b"1")
+        self.assertGreater(storage.log.size, 0)
+        storage.checkpoint()
+        self.assertEqual(storage.log.size, 0)
+        storage.set("node", "b", b"2")
+        storage.log.close()
+        storage._storage.close()
+        storage = self.open(self.segments())
+        self.assertEqual(storage.get_many("node", ["a", "b"]), [b"1", b"2"])
+
+    def test_group_commit(self):
+        storage = self.open(window=0.01)
+        runtime = Runtime(storage=storage)
+        branches = [runtime.create_branch() for i in range(8)]
+        before = storage.log.stats
+        def commit(branch):
+            for i in range(5):
+                branch.wc.create_node().value = i
+                branch.commit()
+        threads = [threading.Thread(target=commit, args=(branch,))
+            for branch in branches]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        stats = storage.log.stats
+        batches = stats["batches"] - before["batches"]
+        fsyncs = stats["fsyncs"] - before["fsyncs"]
+        self.assertEqual(batches, 40)
+        self.assertLess(fsyncs, batches)
+
+    def test_recovery(self):
+        runtime = Runtime(storage=self.open())
+        branch = runtime.create_branch()
+        node = branch.wc.create_node()
+        node.name = "durable"
+        branch.commit()
+        wc = branch.checkout()
+        wc.get_node(node.ref).name = "merged"
+        wc.commit()
+        runtime.storage.log.close()
+        runtime = Runtime(storage=self.open())
+        restored = runtime.get_branch(branch.id)
+        self.assertEqual(restored.revision, 2)
+        self.assertEqual(restored.wc.get_node(node.ref).name, "merged")
+
+    def test_failed_flush(self):
+        storage = self.open()
+        log = storage.log
+        ticket = storage.submit([("node", "a", b"1")])
+        append = log._file.append
+        def failing(data):
+            raise OSError("disk full")
+        log._file.append = failing
+        with self.assertRaises(OSError):
+            storage.wait(ticket)
+        log._file.append = append
+        # lost batch is never reported durable, nothing is taken after it
+        with self.assertRaises(LogFailedError):
+            storage.wait(ticket)
+        with self.assertRaises(LogFailedError):
+            storage.submit([("node", "b", b"2")])
+        log.close()
+        storage = self.open()
+        self.assertEqual(storage.get_many("node", ["a", "b"]), [None, None])
+
+    def test_failed_publish(self):
+        storage = MemoryStorage()
+        runtime = Runtime(storage=storage)
+        branch = runtime.create_branch()
+        branch.wc.create_node().name = "kept"
+        def failing(records):
+            raise OSError("disk full")
+        storage.submit = failing
+        with self.assertRaises(OSError):
+            branch.commit()
+        del storage.submit
+        runtime.publish()
+        restored = Runtime(storage=storage).get_branch(branch.id)
+        self.assertEqual(restored.revision, 1)
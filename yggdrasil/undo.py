@@ -0,0 +1,83 @@
+"""
+Undo log of runtime changes.
+
+Every mutation of runtime state made while a transaction is open
+records a callable restoring previous state. Savepoint remembers length
+of the log, so rolling back to it replays only records made after it,
+in reverse order, and costs as much as changes made since then.
+"""
+
+class UndoLog(object):
+    def __init__(self):
+        self._records = [] # (undo, args)
+        self._marks = [] # log lengths of open savepoints
+
+    @property
+    def active(self):
+        return bool(self._marks)
+
+    def __len__(self):
+        return len(self._records)
+
+    def record(self, undo, *args):
+        "Remembers `undo(*args)` call if any savepoint is open"
+        if self._marks:
+            self._records.append((undo, args))
+
+    def begin(self):
+        mark = len(self._records)
+        self._marks.append(mark)
+        return mark
+
+    def rollback(self, mark):
+        "Undoes all changes recorded after `mark`, newest first"
+        records = self._records
+        while len(records) > mark:
+            undo, args = records.pop()
+            undo(*args)
+
+    def end(self, mark):
+        """
+        Closes savepoint, its records stay in the log until outermost
+        one is closed, so enclosing savepoint can still undo them.
+        Returns whether outermost savepoint was closed.
+        """
+        if not self._marks or self._marks[-1] != mark:
+            raise RuntimeError("Savepoints must be closed in reverse order")
+        self._marks.pop()
+        if self._marks:
+            return False
+        self._records.clear()
+        return True
+
+class Savepoint(object):
+    """
+    Context manager over undo log. Changes made inside the block are
+    undone when it exits with exception, `rollback` undoes them at any
+    moment without leaving the block. `on_close` is called when the
+    outermost savepoint is closed.
+    """
+    def __init__(self, log, on_close=None):
+        self._log = log
+        self._mark = None
+        self._on_close = on_close
+
+    def __enter__(self):
+        self._mark = self._log.begin()
+        return self
+
+    def rollback(self):
+        if self._mark is None:
+            raise RuntimeError("Savepoint is not open")
+        self._log.rollback(self._mark)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            if exc_type is not None:
+                self.rollback()
+        finally:
+            closed = self._log.end(self._mark)
+            self._mark = None
+        if closed and self._on_close is not None:
+            self._on_close()
+        return False
@@ -1,10 +1,27 @@
 import collections
+import contextlib
+import gc
+import threading
 
 class Undefined(object):
     def __repr__(self):
         return "???"
 undefined = Undefined()
 
+@contextlib.contextmanager
+def gc_paused():
+    """
+    Pauses cyclic garbage collector while many long-lived objects are
+    allocated, otherwise every collection rescans all of them.
+    """
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
 class ReadOnlySet(collections.Set):
     def __init__(self, data):
         self.__items__ = data
@@ -19,12 +36,12 @@ class ReadOnlySet(collections.Set):
     def __eq__(self, other):
         if not isinstance(other, collections.Set):
             return False
+        if len(self) != len(other):
+            return False
+        # same sizes, so inclusion one way is enough
         for item in self:
             if item not in other:
                 return False
-        for item in other:
-            if item not in self:
-                return False
         return True
     def __ne__(self, other):
         return not self == other
@@ -37,7 +54,8 @@ class ReadOnlyDict(collections.Mapping):
             return ValueError("Invalid arguments")
         if len(args) == 1:
             self.__items__ = args[0]
-            self.__items__.update(kwargs)
+            if kwargs:
+                self.__items__.update(kwargs)
         else:
             self.__items__ = kwargs
     def __getitem__(self, key):
@@ -61,18 +79,283 @@ class ReadOnlyDict(collections.Mapping):
     def __eq__(self, other):
         if not isinstance(other, collections.Mapping):
             return False
+        if isinstance(other, ReadOnlyDict) and other.__items__ is self.__items__:
+            return True
+        if len(self) != len(other):
+            return False
         for key, value in self.items():
             if value != other.get(key, undefined):
                 return False
-        for key, value in other.items():
-            if value != self.get(key, undefined):
-                return False
         return True
     def __ne__(self, other):
         return not self == other
     def __repr__(self):
         return "ReadOnlyDict({!r})".format(self.__items__)
 
+class KeyLayout(object):
+    """
+    Sorted keys of frozen dictionaries and their positions. Layouts are
+    interned, so dictionaries with the same keys share single one.
+    """
+    __slots__ = "keys", "positions"
+    _layouts = {} # keys -> KeyLayout
+
+    def __init__(self, keys):
+        self.keys = keys
+        self.positions = {key: position for position, key in enumerate(keys)}
+
+    @classmethod
+    def intern(cls, keys):
+        layout = cls._layouts.get(keys)
+        if layout is None:
+            layout = cls._layouts.setdefault(keys, cls(keys))
+        return layout
+
+class FrozenDict(collections.Mapping):
+    """
+    Immutable mapping stored as shared key layout and tuple of values,
+    much smaller than a dictionary of its own. Keys must be sortable.
+    """
+    __slots__ = "_layout", "_values"
+
+    def __init__(self, mapping):
+        keys = tuple(sorted(mapping))
+        self._layout = KeyLayout.intern(keys)
+        self._values = tuple(mapping[key] for key in keys)
+
+    @property
+    def layout(self):
+        return self._layout
+
+    def __getitem__(self, key):
+        return self._values[self._layout.positions[key]]
+
+    def get(self, key, default=None):
+        position = self._layout.positions.get(key)
+        if position is None:
+            return default
+        return self._values[position]
+
+    def __contains__(self, key):
+        return key in self._layout.positions
+
+    def __iter__(self):
+        return iter(self._layout.keys)
+
+    def __len__(self):
+        return len(self._values)
+
+    def items(self):
+        return zip(self._layout.keys, self._values)
+
+    def values(self):
+        return self._values
+
+    def __eq__(self, other):
+        if isinstance(other, FrozenDict):
+            return self._layout is other._layout and self._values == other._values
+        return collections.Mapping.__eq__(self, other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+    def __repr__(self):
+        return "FrozenDict({!r})".format(dict(self.items()))
+
+class LRUCache(object):
+    """
+    Bounded mapping which evicts least recently used entries. Counts hits,
+    misses and evictions, so cache can be sized by observation. Lock
+    guards it against concurrent readers.
+    """
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self.__items__ = collections.OrderedDict()
+
+    def get(self, key, default=None):
+        items = self.__items__
+        with self._lock:
+            try:
+                value = items[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            items.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def __setitem__(self, key, value):
+        items = self.__items__
+        with self._lock:
+            items[key] = value
+            items.move_to_end(key)
+            while len(items) > self.maxsize:
+                items.popitem(last=False)
+                self.evictions += 1
+
+    def __contains__(self, key):
+        return key in self.__items__
+
+    def __len__(self):
+        return len(self.__items__)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            return self.__items__.pop(key, default)
+
+    def clear(self):
+        with self._lock:
+            self.__items__.clear()
+
+    @property
+    def stats(self):
+        with self._lock:
+            return dict(
+                size=len(self.__items__),
+                maxsize=self.maxsize,
+                hits=self.hits,
+                misses=self.misses,
+                evictions=self.evictions,
+                )
+
+class PinningCache(collections.MutableMapping):
+    """
+    Mapping of pinned and evictable entries. Entries set the usual way
+    are pinned, `unpin` and `add` make them evictable with estimated
+    size. Evictable entries are dropped in least recently used order
+    while there are more than `maxsize` of them or their sizes sum to
+    more than `maxbytes`. Pinned entries are never dropped, dropped
+    ones are passed to `on_evict(key, value)` outside of lock, which
+    guards the cache against concurrent readers.
+    """
+    def __init__(self, maxsize=None, maxbytes=None, on_evict=None):
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.on_evict = on_evict
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self.__pinned__ = {}
+        self.__items__ = collections.OrderedDict() # key -> (value, size)
+
+    def get(self, key, default=None):
+        with self._lock:
+            value = self.__pinned__.get(key, undefined)
+            if value is undefined:
+                entry = self.__items__.get(key)
+                if entry is None:
+                    self.misses += 1
+                    return default
+                self.__items__.move_to_end(key)
+                value = entry[0]
+            self.hits += 1
+            return value
+
+    def __getitem__(self, key):
+        value = self.get(key, undefined)
+        if value is undefined:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        with self._lock:
+            self._discard(key)
+            self.__pinned__[key] = value
+
+    def __delitem__(self, key):
+        with self._lock:
+            if key in self.__pinned__:
+                del self.__pinned__[key]
+            elif key in self.__items__:
+                self._discard(key)
+            else:
+                raise KeyError(key)
+
+    def __contains__(self, key):
+        return key in self.__pinned__ or key in self.__items__
+
+    def __iter__(self):
+        with self._lock:
+            keys = list(self.__pinned__)
+            keys.extend(self.__items__)
+        return iter(keys)
+
+    def __len__(self):
+        return len(self.__pinned__) + len(self.__items__)
+
+    def update(self, pairs):
+        pairs = dict(pairs)
+        with self._lock:
+            if self.__items__:
+                for key in pairs.keys() & self.__items__.keys():
+                    self._discard(key)
+            self.__pinned__.update(pairs)
+
+    def _discard(self, key):
+        entry = self.__items__.pop(key, None)
+        if entry is not None:
+            self.bytes -= entry[1]
+
+    def _add(self, key, value, size):
+        self._discard(key)
+        self.__items__[key] = value, size
+        self.bytes += size
+        return self._evict()
+
+    def add(self, key, value, size=0):
+        "Sets evictable entry"
+        with self._lock:
+            self.__pinned__.pop(key, None)
+            evicted = self._add(key, value, size)
+        self._evicted(evicted)
+
+    def unpin(self, key, size=0):
+        "Makes pinned entry evictable"
+        with self._lock:
+            value = self.__pinned__.pop(key, undefined)
+            if value is undefined:
+                return
+            evicted = self._add(key, value, size)
+        self._evicted(evicted)
+
+    def _evict(self):
+        "Drops entries over limits, returns list of dropped pairs"
+        items = self.__items__
+        evicted = []
+        while items and (
+                (self.maxsize is not None and len(items) > self.maxsize) or
+                (self.maxbytes is not None and self.bytes > self.maxbytes)):
+            key, (value, size) = items.popitem(last=False)
+            self.bytes -= size
+            self.evictions += 1
+            evicted.append((key, value))
+        return evicted
+
+    def _evicted(self, evicted):
+        if self.on_evict is not None:
+            for key, value in evicted:
+                self.on_evict(key, value)
+
+    @property
+    def stats(self):
+        with self._lock:
+            return dict(
+                pinned=len(self.__pinned__),
+                size=len(self.__items__),
+                bytes=self.bytes,
+                hits=self.hits,
+                misses=self.misses,
+                evictions=self.evictions,
+                )
+
 class ProxySet(collections.MutableSet):
     def __init__(self, data=None):
         if data is None:
@@ -87,13 +370,20 @@ class ProxySet(collections.MutableSet):
     def __len__(self):
         return len(self.__items__)
     def add(self, value):
-        self.__removed__.discard(value)
-        self.__added__.add(value)
+        if value in self.__items__:
+            return
+        if value in self.__removed__:
+            self.__removed__.discard(value)
+        else:
+            self.__added__.add(value)
         self.__items__.add(value)
     def discard(self, value):
-        if value in self.__items__:
+        if value not in self.__items__:
+            return
+        if value in self.__added__:
+            self.__added__.discard(value)
+        else:
             self.__removed__.add(value)
-        self.__added__.discard(value)
         self.__items__.discard(value)
 
 class ProxyListItem(object):
@@ -116,6 +406,9 @@ class ProxyListItem(object):
             self.changed = False
         self.value = None
         return False
+    @property
+    def weight(self):
+        return 0 if self.removed else 1
     @classmethod
     def insert(cls, value):
         return cls(value, True)
@@ -139,23 +432,126 @@ class ProxyListItem(object):
             return "Item(removed, {!r})".format(self.old)
         return "Item({!r})".format(self.value)
 
+class ProxyListRange(object):
+    """
+    Contiguous values inserted or removed by single bulk operation.
+    Removed range keeps base values.
+    """
+    changed = False
+    def __init__(self, values, inserted=False, removed=False):
+        self.values = values
+        self.inserted = inserted
+        self.removed = removed
+    def __len__(self):
+        return len(self.values)
+    @property
+    def weight(self):
+        return 0 if self.removed else len(self.values)
+    def get(self, offset):
+        return self.values[offset]
+    def slice(self, start, stop):
+        return self.values[start:stop]
+    def split(self, offset):
+        return (
+            ProxyListRange(self.values[:offset], self.inserted, self.removed),
+            ProxyListRange(self.values[offset:], self.inserted, self.removed),
+            )
+    def item(self, offset):
+        "Returns equivalent single item at given offset"
+        if self.removed:
+            return ProxyListItem(None, removed=True, old=self.values[offset])
+        return ProxyListItem.insert(self.values[offset])
+    def items(self):
+        "Returns equivalent single items"
+        return [self.item(offset) for offset in range(len(self.values))]
+    def __repr__(self):
+        if self.removed:
+            return "Range(removed, {!r})".format(self.values)
+        return "Range(inserted, {!r})".format(self.values)
+
+class ProxyListSpan(object):
+    """
+    Unchanged values of base list from `start` to `stop`. Base list is 
+    shared by all spans, so splitting span costs O(1).
+    """
+    inserted = False
+    changed = False
+    removed = False
+    def __init__(self, source, start, stop):
+        self.source = source
+        self.start = start
+        self.stop = stop
+    def __len__(self):
+        return self.stop - self.start
+    @property
+    def weight(self):
+        return self.stop - self.start
+    @property
+    def values(self):
+        return self.source[self.start:self.stop]
+    def get(self, offset):
+        return self.source[self.start + offset]
+    def slice(self, start, stop):
+        return self.source[self.start + start:min(self.stop, self.start + stop)]
+    def split(self, offset):
+        middle = self.start + offset
+        return (
+            ProxyListSpan(self.source, self.start, middle),
+            ProxyListSpan(self.source, middle, self.stop),
+            )
+    def item(self, offset):
+        return ProxyListItem(self.source[self.start + offset])
+    def items(self):
+        return [ProxyListItem(value) for value in self.values]
+    def __repr__(self):
+        return "Span({!r})".format(self.values)
+
+def _base_values(item):
+    "Returns values of base list covered by an item"
+    if item.inserted:
+        return ()
+    if type(item) is not ProxyListItem:
+        return item.values
+    if item.removed or item.changed:
+        return (item.old,)
+    return (item.value,)
+
 class ProxyList(collections.MutableSequence):
+    """
+    Items are stored in chunks, live items count of every chunk is
+    summed by Fenwick tree. Index translation, insertion and deletion
+    cost O(log n) plus size of a chunk. Removed items stay in chunks as
+    tombstones, so merge can see them. Untouched parts of base list are
+    kept as spans, bulk operations store inserted and removed values as
+    single ranges.
+    """
+    __chunk__ = 64
+
     def __init__(self, data=None):
-        self.__items__ = []
+        self.__chunks__ = []
+        self.__counts__ = []
+        self.__tree__ = None
+        self.__length__ = 0
         if data is not None:
-            self.__length__ = len(data)
-            for value in data:
-                item = ProxyListItem(value)
-                self.__items__.append(item)
-        else:
-            self.__length__ = 0
+            # tuples are immutable, so they are shared instead of copied
+            source = data if type(data) is tuple else list(data)
+            self.__length__ = len(source)
+            if source:
+                self._reshape(0, 0, [ProxyListSpan(source, 0, len(source))])
+    @property
+    def __items__(self):
+        return [item for chunk in self.__chunks__ for item in chunk]
     def __iter__(self):
-        for item in self.__items__:
-            if item.removed: continue
-            yield item.value
+        for chunk in self.__chunks__:
+            for item in chunk:
+                if item.removed: continue
+                if type(item) is ProxyListItem:
+                    yield item.value
+                else:
+                    yield from item.values
     def __contains__(self, value):
         for item in self:
-            if value == item.value:
+            if value == item:
                 return True
         return False
     def __len__(self):
@@ -163,52 +559,278 @@ class ProxyList(collections.MutableSequence):
     def __repr__(self):
         return "["+ ", ".join(repr(item) for item in self.__items__) + "]"
     def __eq__(self, other):
-        if not isinstance(other, collections.Iterable):
+        if not isinstance(other, collections.Sized) or \
+                not isinstance(other, collections.Iterable):
             return False
-        if len(v1) != len(v2):
+        if len(self) != len(other):
             return False
         for v1, v2 in zip(self, other):
             if v1 != v2: return False
         return True
+    def _tree(self):
+        tree = self.__tree__
+        if tree is None:
+            tree = [0] + self.__counts__
+            size = len(tree)
+            for index in range(1, size):
+                parent = index + (index & -index)
+                if parent < size:
+                    tree[parent] += tree[index]
+            self.__tree__ = tree
+        return tree
+    def _count(self, chunk, delta):
+        self.__counts__[chunk] += delta
+        tree = self.__tree__
+        if tree is None:
+            return
+        index = chunk + 1
+        while index < len(tree):
+            tree[index] += delta
+            index += index & -index
+    def _reshape(self, start, stop, items):
+        "Replaces chunks from `start` to `stop` with chunks of given items"
+        size = self.__chunk__
+        parts = [items[offset:offset + size] 
+            for offset in range(0, len(items), size)]
+        self.__chunks__[start:stop] = parts
+        self.__counts__[start:stop] = [
+            sum(item.weight for item in part) for part in parts]
+        self.__tree__ = None
+    def _explode(self, chunk, position, offset, *middle):
+        "Splits range at offset and puts given items instead of the value"
+        items = self.__chunks__[chunk]
+        left, right = items[position].split(offset)
+        right = right.split(1)[1]
+        parts = [left] if len(left) else []
+        parts.extend(middle)
+        if len(right):
+            parts.append(right)
+        items[position:position + 1] = parts
+        if len(items) > 2 * self.__chunk__:
+            self._reshape(chunk, chunk + 1, items)
     def translate(self, index):
-        iterator = iter(self.__items__)
-        real = 0
-        virtual = index
-        while True:
-            try:
-                item = next(iterator)
-            except StopIteration:
-                if virtual > 0:
-                    raise IndexError(index)
-                break
-            if not item.removed:
-                if virtual == 0:  
-                    break
-                virtual -= 1
-            real += 1
-        return real
+        """
+        Returns chunk number, position in it and offset inside range of
+        the item with given index. Index equal to length points past the
+        last item.
+        """
+        if index < 0:
+            index += self.__length__
+        if not 0 <= index <= self.__length__:
+            raise IndexError(index)
+        if index == self.__length__:
+            if not self.__chunks__:
+                return 0, 0, 0
+            return len(self.__chunks__) - 1, len(self.__chunks__[-1]), 0
+        tree = self._tree()
+        chunk = 0
+        step = 1 << (len(tree).bit_length() - 1)
+        while step:
+            following = chunk + step
+            if following < len(tree) and tree[following] <= index:
+                chunk = following
+                index -= tree[following]
+            step >>= 1
+        for position, item in enumerate(self.__chunks__[chunk]):
+            kind = type(item)
+            if kind is ProxyListSpan:
+                size = item.stop - item.start
+            elif item.removed:
+                continue
+            elif kind is ProxyListItem:
+                if index:
+                    index -= 1
+                    continue
+                return chunk, position, 0
+            else:
+                size = len(item.values)
+            if index < size:
+                return chunk, position, index
+            index -= size
+    def _locate(self, index):
+        if index < 0:
+            index += self.__length__
+        if not 0 <= index < self.__length__:
+            raise IndexError(index)
+        return self.translate(index)
     def __getitem__(self, index):
-        index = self.translate(index)
-        return self.__items__[index].value
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self.__length__)
+            if step != 1:
+                return list(self)[index]
+            return list(self._values(start, stop))
+        chunk, position, offset = self._locate(index)
+        item = self.__chunks__[chunk][position]
+        if type(item) is ProxyListItem:
+            return item.value
+        return item.get(offset)
     def __setitem__(self, index, value):
-        index = self.translate(index)
-        self.__items__[index].set(value)
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self.__length__)
+            if step == 1:
+                self._splice(start, max(start, stop), value)
+                return
+            indices = range(start, stop, step)
+            value = list(value)
+            if len(value) != len(indices):
+                raise ValueError("attempt to assign sequence of size {} "
+                    "to extended slice of size {}".format(len(value), len(indices)))
+            for position, item in zip(indices, value):
+                self[position] = item
+            return
+        chunk, position, offset = self._locate(index)
+        item = self.__chunks__[chunk][position]
+        if type(item) is ProxyListItem:
+            item.set(value)
+        elif item.inserted:
+            item.values[offset] = value
+        else:
+            self._explode(chunk, position, offset, 
+                ProxyListItem(value, changed=True, old=item.get(offset)))
     def __delitem__(self, index):
-        index = self.translate(index)
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self.__length__)
+            if step == 1:
+                self._splice(start, max(start, stop), ())
+                return
+            for position in sorted(range(start, stop, step), reverse=True):
+                del self[position]
+            return
+        chunk, position, offset = self._locate(index)
+        items = self.__chunks__[chunk]
+        item = items[position]
         self.__length__ -= 1
-        if self.__items__[index].delete():
-            del self.__items__[index]
+        self._count(chunk, -1)
+        if type(item) is ProxyListItem:
+            dropped = item.delete()
+        elif item.inserted:
+            del item.values[offset]
+            dropped = not item.values
+        else:
+            self._explode(chunk, position, offset, 
+                ProxyListItem(None, removed=True, old=item.get(offset)))
+            return
+        if dropped:
+            del items[position]
+            if not items:
+                self._reshape(chunk, chunk + 1, ())
     def insert(self, index, value):
-        index = self.translate(index)
-        item = ProxyListItem.insert(value)
-        self.__items__.insert(index, item)
+        if index < 0:
+            index = max(0, index + self.__length__)
+        index = min(index, self.__length__)
+        if not self.__chunks__:
+            self.__chunks__.append([])
+            self.__counts__.append(0)
+            self.__tree__ = None
+        chunk, position, offset = self.translate(index)
+        items = self.__chunks__[chunk]
         self.__length__ += 1
+        self._count(chunk, 1)
+        if offset and items[position].inserted:
+            items[position].values.insert(offset, value)
+        elif offset:
+            left, right = items[position].split(offset)
+            items[position:position + 1] = \
+                left, ProxyListItem.insert(value), right
+        else:
+            items.insert(position, ProxyListItem.insert(value))
+        if len(items) > 2 * self.__chunk__:
+            self._reshape(chunk, chunk + 1, items)
+    def extend(self, values):
+        if values is self:
+            values = list(values)
+        self._splice(self.__length__, self.__length__, values)
+    def clear(self):
+        self._splice(0, self.__length__, ())
+    def _values(self, start, stop):
+        if start >= stop:
+            return
+        count = stop - start
+        chunk, position, offset = self.translate(start)
+        for items in self.__chunks__[chunk:]:
+            for item in items[position:]:
+                if item.removed:
+                    continue
+                if type(item) is ProxyListItem:
+                    yield item.value
+                    count -= 1
+                else:
+                    values = item.slice(offset, offset + count)
+                    offset = 0
+                    yield from values
+                    count -= len(values)
+                if not count:
+                    return
+            position = 0
+    def _splice(self, start, stop, values):
+        """
+        Replaces values from `start` to `stop` with given ones. Covered
+        base items are recorded as single removed range and new values
+        as single inserted range, which joins adjacent inserted ones.
+        """
+        values = list(values)
+        delta = len(values) - (stop - start)
+        if not delta and not values:
+            return
+        chunks = self.__chunks__
+        if not chunks:
+            chunks.append([])
+            self.__counts__.append(0)
+        chunk1, position1, offset1 = self.translate(start)
+        chunk2, position2, offset2 = self.translate(stop)
+        items = [item for items in chunks[chunk1:chunk2 + 1] for item in items]
+        position2 += sum(len(items) for items in chunks[chunk1:chunk2])
+        head = items[:position1]
+        tail = items[position2:]
+        if offset1:
+            head.append(items[position1].split(offset1)[0])
+        if offset2:
+            tail[0] = items[position2].split(offset2)[1]
+        removed = []
+        for position in range(position1, position2 + bool(offset2)):
+            item = items[position]
+            if item.inserted:
+                continue
+            if position == position2:
+                removed.extend(item.slice(
+                    offset1 if position == position1 else 0, offset2))
+            elif offset1 and position == position1:
+                removed.extend(item.slice(offset1, len(item)))
+            else:
+                removed.extend(_base_values(item))
+        middle = []
+        if removed:
+            middle.append(ProxyListRange(removed, removed=True))
+        if values:
+            if not removed and head and head[-1].inserted and \
+                    type(head[-1]) is ProxyListRange:
+                values = head.pop().values + values
+            if tail and tail[0].inserted and type(tail[0]) is ProxyListRange:
+                values = values + tail.pop(0).values
+            middle.append(ProxyListRange(values, inserted=True))
+        self._reshape(chunk1, chunk2 + 1, head + middle + tail)
+        self.__length__ += delta
+    def iterruns(self):
+        "Yields stored items, spans and ranges"
+        for chunk in self.__chunks__:
+            yield from chunk
     def iterdata(self):
-        for item in self.__items__:
-            yield item
+        for chunk in self.__chunks__:
+            for item in chunk:
+                if type(item) is ProxyListItem:
+                    yield item
+                else:
+                    yield from item.items()
         while True: yield None
 
-class MergeResult(object): pass
+class MergeResult(object):
+    def __init__(self, path=(), base=undefined, mine=undefined, theirs=undefined):
+        self.path = path
+        self.base = base
+        self.mine = mine
+        self.theirs = theirs
+    def __repr__(self):
+        return "{}({!r})".format(type(self).__name__, self.path)
 
 """
 Conflicts:
@@ -225,6 +847,7 @@ class MergeConflict(MergeResult): pass
 class RCMergeConflict(MergeConflict): pass
 class CRMergeConflict(MergeConflict): pass
 class CCMergeConflict(MergeConflict): pass
+class IIMergeConflict(MergeConflict): pass
 
 """
 Errors:
@@ -251,96 +874,205 @@ class VVMergeError(MergeError): pass
 
 class ComplettedMergeResult(MergeResult): pass
 
+class _ProxyListCursor(object):
+    "Position in items of ProxyList, ranges are consumed partially"
+    def __init__(self, proxy_list):
+        self.runs = proxy_list.iterruns()
+        self.advance()
+
+    def advance(self):
+        self.run = next(self.runs, None)
+        self.offset = 0
+
+    @property
+    def remaining(self):
+        if type(self.run) is ProxyListItem:
+            return 1
+        return len(self.run) - self.offset
+
+    def item(self):
+        "Returns current position as single item, None at the end"
+        run = self.run
+        if run is None or type(run) is ProxyListItem:
+            return run
+        return run.item(self.offset)
+
+    def values(self, count):
+        "Returns values of next `count` positions, base ones if removed"
+        run = self.run
+        if type(run) is ProxyListItem:
+            return [run.old if run.removed else run.value]
+        return run.slice(self.offset, self.offset + count)
+
+    def consume(self, count):
+        if type(self.run) is ProxyListItem:
+            self.advance()
+            return
+        self.offset += count
+        if self.offset >= len(self.run):
+            self.advance()
+
 class ProxyListMerge(object):
-    def __init__(self, list1, list2):
+    """
+    Merges two ProxyLists made from the same base list. Lists are walked
+    in lockstep, inserted items are consumed from one side only, so base
+    items of both lists stay aligned. Unchanged spans, inserted and 
+    removed ranges are consumed at once, only single changed items are
+    compared one by one. Merged values are produced by iteration.
+    """
+    def __init__(self, list1, list2, path=()):
         self.list1 = list1
         self.list2 = list2
-        self.iter1 = iter(list1.iterdata())
-        self.iter2 = iter(list2.iterdata())
-        self.item1 = next(self.iter1)
-        self.item2 = next(self.iter2)
-        self.result = []
+        self.path = path
+        self.cursor1 = _ProxyListCursor(list1)
+        self.cursor2 = _ProxyListCursor(list2)
+        self.item1 = None
+        self.item2 = None
+        self.position = 0
+        self.output = []
+        self.conflicts = []
+
+    def emit(self, values):
+        self.output.append(values)
+        self.position += len(values)
 
     def take1(self):
-        result.append(self.item1)
-        self.item1 = next(self.iter1)
-        self.item2 = next(self.iter2)
+        self.emit((self.item1.value,))
+        self.skip()
 
     def take2(self):
-        result.append(self.item2)
-        self.item1 = next(self.iter1)
-        self.item2 = next(self.iter2)
+        self.emit((self.item2.value,))
+        self.skip()
 
-    def push1(self):
-        result.append(self.item1)
-        self.item1 = next(self.iter1)
+    def skip(self, count=1):
+        self.cursor1.consume(count)
+        self.cursor2.consume(count)
 
-    def push2(self):
-        result.append(self.item2)
-        self.item2 = next(self.iter2)
+    def push(self, cursor):
+        "Takes the rest of inserted run of given side"
+        run = cursor.run
+        count = cursor.remaining
+        if not run.removed:
+            self.emit(cursor.values(count))
+        cursor.consume(count)
+
+    def conflict(self, cls):
+        item1 = self.item1
+        item2 = self.item2
+        return cls(self.path + (self.position,),
+            item1.old if item1.changed or item1.removed else item1.value,
+            item1.value, item2.value)
 
-    @classmethod
     def merge_one(self):
-        if self.item1 is None: # 0?
-            if self.item2 is None: # 00 
-                return ComplettedMergeResult()
-            self.push2()
-        elif self.item2 is None: # 0?
-            self.push1()
-        elif self.item1.inserted: # I?
-            self.push1()
-        elif self.item2.inserted: # ?I
-            self.push2()
-        elif self.item1.removed: # R?
-            if self.item2.removed: # RR
-                if self.item1.old == self.item2.old:
-                    self.take1()
+        """
+        Makes one step of merge. Returns MergeResult when merge completed
+        or step could not be done, otherwise None.
+        """
+        cursor1 = self.cursor1
+        cursor2 = self.cursor2
+        run1 = cursor1.run
+        run2 = cursor2.run
+        if run1 is None: # 0?
+            if run2 is None: # 00 
+                return ComplettedMergeResult(self.path)
+            self.push(cursor2)
+            return None
+        elif run2 is None: # ?0
+            self.push(cursor1)
+            return None
+        elif run1.inserted: # I?
+            self.push(cursor1)
+            return None
+        elif run2.inserted: # ?I
+            self.push(cursor2)
+            return None
+        if type(run1) is not ProxyListItem and type(run2) is not ProxyListItem:
+            # spans and removed ranges, VV, VR, RV and RR
+            count = min(cursor1.remaining, cursor2.remaining)
+            values = cursor1.values(count)
+            if values == cursor2.values(count):
+                if not run1.removed and not run2.removed:
+                    self.emit(values)
+                self.skip(count)
+                return None
+        self.item1 = item1 = cursor1.item()
+        self.item2 = item2 = cursor2.item()
+        if item1.removed: # R?
+            if item2.removed: # RR
+                if item1.old == item2.old:
+                    self.skip()
                 else:
-                    return RRMergeError()
-            elif self.item2.changed: # RC
-                if self.item1.old == self.item2.old:
-                    return RCMergeConflict()
+                    return self.conflict(RRMergeError)
+            elif item2.changed: # RC
+                if item1.old == item2.old:
+                    return self.conflict(RCMergeConflict)
                 else:
-                    return RCMergeError()                    
+                    return self.conflict(RCMergeError)
             else: # RV
-                if self.item1.old == self.item2.value:
-                    self.take2()
+                if item1.old == item2.value:
+                    self.skip()
                 else:
-                    return RVMergeError()
-        elif self.item2.removed: # ?R
-            if self.item1.changed: # CR
-                if self.item1.old == self.item2.old:
-                    return CRMergeConflict()
+                    return self.conflict(RVMergeError)
+        elif item2.removed: # ?R
+            if item1.changed: # CR
+                if item1.old == item2.old:
+                    return self.conflict(CRMergeConflict)
                 else:
-                    return CRMergeError()
+                    return self.conflict(CRMergeError)
             else: # VR
-                if self.item1.value == self.item2.old:
-                    self.take2()
+                if item1.value == item2.old:
+                    self.skip()
                 else:
-                    return VRMergeError()
-        elif self.item1.changed: # C?
-            if self.item2.changed: # CC
-                if self.item1.old == self.item2.old:
-                    return CCMergeConflict()
+                    return self.conflict(VRMergeError)
+        elif item1.changed: # C?
+            if item2.changed: # CC
+                if item1.old != item2.old:
+                    return self.conflict(CCMergeError)
+                elif item1.value == item2.value:
+                    self.take1()
                 else:
-                    return CCMergeError()
+                    return self.conflict(CCMergeConflict)
             else: # CV
-                if self.item1.value == self.item2.old:
-                    self.take2()
+                if item1.old == item2.value:
+                    self.take1()
                 else:
-                    return CVMergeError()
-        if self.item2.changed: # VC
-            if self.item1.value == self.item2.old:
-                self.push1().pop()
+                    return self.conflict(CVMergeError)
+        elif item2.changed: # VC
+            if item1.value == item2.old:
+                self.take2()
             else:
-                return VCMergeError()
-        else:
-            if self.item1.value == self.item2.value:
-                self.push1().pop()
+                return self.conflict(VCMergeError)
+        else: # VV
+            if item1.value == item2.value:
+                self.take1()
             else:
-                return VVMergeError()
+                return self.conflict(VVMergeError)
+        return None
 
-        raise RuntimeError("Unreachable code")
+    def __iter__(self):
+        """
+        Runs merge and yields merged values. Items which could not be 
+        merged are resolved in favour of first list and reported in 
+        `conflicts`.
+        """
+        while True:
+            result = self.merge_one()
+            if result is not None and \
+                    not isinstance(result, ComplettedMergeResult):
+                self.conflicts.append(result)
+                if self.item1.removed:
+                    self.skip()
+                else:
+                    self.take1()
+            for values in self.output:
+                yield from values
+            del self.output[:]
+            if isinstance(result, ComplettedMergeResult):
+                return
+
+    def merge(self):
+        "Runs merge till the end and returns list of merged values"
+        return list(self)
 
 class ProxyDict(collections.MutableMapping):
     def __init__(self, data=Undefined):
@@ -358,14 +1090,20 @@ class ProxyDict(collections.MutableMapping):
     def __len__(self):
         return len(self.fields)
 
+    def _get(self, key):
+        return self.fields.get(key, undefined)
+
+    def _pop(self, key):
+        return self.fields.pop(key, undefined)
+
     def __getitem__(self, key):
-        value = self.fields.get(key, undefined)
+        value = self._get(key)
         if value is undefined:
             raise KeyError(key)
         return value
 
     def __setitem__(self, key, value):
-        old = self.fields.get(key, undefined)
+        old = self._get(key)
         if old is undefined:
             old = self.removed.pop(key, undefined)
             if old is undefined:
@@ -378,7 +1116,7 @@ class ProxyDict(collections.MutableMapping):
         self.fields[key] = value
 
     def __delitem__(self, key):
-        old = self.fields.pop(key, undefined)
+        old = self._pop(key)
         if old is undefined:
             raise KeyError(key)
         if key in self.added:
@@ -386,3 +1124,54 @@ class ProxyDict(collections.MutableMapping):
         else:
             old = self.changed.pop(key, old)
             self.removed[key] = old
+
+    def save(self, key):
+        "Returns bookkeeping state of single key for `restore`"
+        return (self.fields.get(key, undefined), self.changed.get(key, undefined),
+            self.removed.get(key, undefined), key in self.added)
+
+    def restore(self, key, state):
+        "Puts key back into state returned by `save`"
+        for mapping, value in zip((self.fields, self.changed, self.removed), state):
+            if value is undefined:
+                mapping.pop(key, None)
+            else:
+                mapping[key] = value
+        if state[3]:
+            self.added.add(key)
+        else:
+            self.added.discard(key)
+
+class OverlayDict(ProxyDict):
+    """
+    ProxyDict layered over read-only base mapping. Only added and changed
+    values are stored in `fields`, all other keys are read through from
+    base, so memory is proportional to the amount of changes.
+    """
+    def __init__(self, base):
+        super().__init__()
+        self.base = base
+
+    def _get(self, key):
+        value = self.fields.get(key, undefined)
+        if value is undefined and key not in self.removed:
+            value = self.base.get(key, undefined)
+        return value
+
+    def _pop(self, key):
+        value = self._get(key)
+        self.fields.pop(key, None)
+        return value
+
+    def __contains__(self, key):
+        return self._get(key) is not undefined
+
+    def __iter__(self):
+        for key in self.base:
+            if key not in self.removed:
+                yield key
+        for key in self.added:
+            yield key
+
+    def __len__(self):
+        return len(self.base) - len(self.removed) + len(self.added)
@@ -0,0 +1,186 @@
+"""
+Write-ahead log in front of storage.
+
+Every batch of records is appended to log before it is applied to
+storage, so storage itself does not need to be synced per commit.
+Batches of concurrent commits are written with single fsync: first
+waiter becomes leader, waits `window` seconds for others to join and
+flushes everything submitted so far, the rest just wait for it. On
+open, batches found in log are replayed into storage, torn tail is
+dropped. Log is truncated once storage has made everything durable.
+Failed write leaves log failed, batches of it must not be reported
+durable, so it has to be reopened and replayed.
+"""
+
+import threading
+import time
+
+from .segments import _Segment, _record, _MARKER
+from .storage import Storage
+
+class LogFailedError(IOError): pass
+
+class WriteAheadLog(object):
+    """
+    Single log file. `append` only queues batch and returns its ticket,
+    `wait` returns when batch of given ticket is on disk and raises
+    LogFailedError when it never will be.
+    """
+    def __init__(self, path, window=0.0, sync=True):
+        self.window = window
+        self._sync = sync
+        self._file = _Segment(path, 0)
+        self._lock = threading.Lock()
+        self._flushed = threading.Condition(self._lock)
+        self._buffer = [] # encoded batches
+        self._submitted = 0
+        self._durable = 0
+        self._flushing = False
+        self._error = None # of failed flush, log takes no more batches
+        self.batches = 0
+        self.fsyncs = 0
+
+    def replay(self):
+        """
+        Returns list of batches of `(kind, key, value)` records found in
+        log. Records of torn batch are dropped.
+        """
+        batches = []
+        batch = []
+        committed = 0
+        for offset, kind, key, value_offset, length in self._file.records():
+            if kind is None:
+                batches.append(batch)
+                batch = []
+                committed = value_offset
+            else:
+                batch.append((kind, key, self._file.read(value_offset, length)))
+        if committed < self._file.size:
+            self._file.truncate(committed)
+        return batches
+
+    def append(self, records):
+        data = b"".join(_record(kind, key, value) for kind, key, value in records)
+        with self._lock:
+            self._check()
+            self._buffer.append(data + _MARKER)
+            self._submitted += 1
+            return self._submitted
+
+    def wait(self, ticket):
+        if ticket is None:
+            return
+        with self._lock:
+            while self._durable < ticket:
+                self._check()
+                if self._flushing:
+                    self._flushed.wait()
+                    continue
+                self._flushing = True
+                target = None
+                self._lock.release()
+                try:
+                    if self.window:
+                        # lets concurrent commits join this flush
+                        time.sleep(self.window)
+                    target = self._flush()
+                finally:
+                    self._lock.acquire()
+                    self._flushing = False
+                    if target is not None:
+                        self._durable = max(self._durable, target)
+                    self._flushed.notify_all()
+
+    def _check(self):
+        if self._error is not None:
+            raise LogFailedError("Write-ahead log failed") from self._error
+
+    def _flush(self):
+        "Writes queued batches, called by leader only"
+        with self._lock:
+            buffer, self._buffer = self._buffer, []
+            target = self._submitted
+        if buffer:
+            try:
+                self._file.append(b"".join(buffer))
+                self._file.flush(self._sync)
+            except BaseException as error:
+                # taken batches are lost, none of later may be reported durable
+                self._error = error
+                raise
+            self.batches += len(buffer)
+            self.fsyncs += 1
+        return target
+
+    @property
+    def size(self):
+        return self._file.size
+
+    def truncate(self):
+        "Drops logged batches, storage must have made them durable"
+        with self._lock:
+            while self._flushing:
+                self._flushed.wait()
+            self._file.truncate(0)
+
+    def close(self):
+        self._file.close()
+
+    @property
+    def stats(self):
+        return dict(
+            batches=self.batches,
+            fsyncs=self.fsyncs,
+            batches_per_fsync=self.batches / self.fsyncs if self.fsyncs else 0.0,
+            )
+
+class LoggedStorage(Storage):
+    """
+    Storage writing every batch to log before `storage`. Log grown
+    over `checkpoint_size` bytes is truncated after storage is flushed,
+    log in front of volatile storage is never truncated.
+    """
+    def __init__(self, storage, log, checkpoint_size=64 << 20):
+        self._storage = storage
+        self._log = log
+        self._checkpoint_size = checkpoint_size
+        self._lock = threading.Lock()
+        for batch in log.replay():
+            storage.set_many(batch)
+        self.checkpoint()
+
+    @property
+    def log(self):
+        return self._log
+
+    def get_many(self, kind, keys):
+        return self._storage.get_many(kind, keys)
+
+    def keys(self, kind):
+        return self._storage.keys(kind)
+
+    def submit(self, records):
+        records = list(records)
+        with self._lock:
+            ticket = self._log.append(records)
+            self._storage.set_many(records)
+        return ticket
+
+    def wait(self, ticket):
+        self._log.wait(ticket)
+        if self._log.size >= self._checkpoint_size:
+            self.checkpoint()
+
+    def set_many(self, records):
+        self.wait(self.submit(records))
+
+    def checkpoint(self):
+        if self._storage.volatile or not self._log.size:
+            return
+        with self._lock:
+            # batches applied after flush must stay in log
+            self._storage.flush()
+            self._log.truncate()
+
+    def flush(self):
+        self._log.wait(self._log.append([]))